@@ -0,0 +1,386 @@
+#!/usr/bin/python
+""" Load test: replay typical user sessions against the app, with many simulated users
+
+Each simulated user picks a glacier, pans and zooms the map (/mapdata), computes
+a flowline (/flowline), saves glacier outlines (/lines), meshes them (/mesh),
+extracts the 1-D glacier (/glacier1d) and plots it (/figure/glacier1d).
+Throughput and latency percentiles are reported per route.
+
+By default the app runs in-process (Flask test client) on a synthetic dataset
+generated on the fly, so that no data files or network are needed. With --url,
+sessions are replayed against a running server instead (with its own data).
+
+Examples
+--------
+    python loadtest.py --users 8 --sessions 5
+    python loadtest.py --url http://127.0.0.1:5000 --users 4 --real-data
+"""
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import types
+import random
+import shutil
+import tempfile
+import argparse
+import threading
+import traceback
+from collections import defaultdict
+
+import numpy as np
+
+#
+# Synthetic data backend: a stand-in for the icedata package
+#
+# Bamber et al 2013's polar stereographic grid, used by all synthetic datasets
+GRID_MAPPING = {
+    'grid_mapping_name': 'polar_stereographic',
+    'straight_vertical_longitude_from_pole': -39.,
+    'latitude_of_projection_origin': 90.,
+    'standard_parallel': 71.,
+    'false_easting': 0.,
+    'false_northing': 0.,
+    'ellipsoid': 'WGS84',
+}
+DOMAIN = [-900e3, 800e3, -3500e3, -500e3] # left, right, bottom, top (m)
+CENTER = (-100e3, -2000e3) # ice divide
+RADIUS = 900e3 # ice sheet radius
+
+def _speed(x, y):
+    r = np.hypot(x - CENTER[0], y - CENTER[1])
+    return 10. + 2000.*np.clip(r/RADIUS, 0, 1)**3
+
+def _direction(x, y):
+    dx, dy = x - CENTER[0], y - CENTER[1]
+    r = np.hypot(dx, dy) + 1.
+    return dx/r, dy/r
+
+def _surface(x, y):
+    r = np.hypot(x - CENTER[0], y - CENTER[1])
+    return 3000.*np.sqrt(np.clip(1 - (r/RADIUS)**2, 0, 1))
+
+def _bedrock(x, y):
+    return 300.*np.sin(x/50e3)*np.cos(y/70e3) - 100.
+
+def _thickness(x, y):
+    return np.clip(_surface(x, y) - _bedrock(x, y), 0, None)
+
+def _smb(x, y):
+    r = np.hypot(x - CENTER[0], y - CENTER[1])
+    return 0.5 - 2.*(r/RADIUS)**2
+
+# variable: (function of x and y in meters, units)
+FIELDS = {
+    'bedrock_elevation': (_bedrock, 'meters'),
+    'surface_elevation': (_surface, 'meters'),
+    'bottom_elevation': (lambda x, y: _surface(x, y) - _thickness(x, y), 'meters'),
+    'ice_thickness': (_thickness, 'meters'),
+    'bed': (_bedrock, 'meters'),
+    'surface': (_surface, 'meters'),
+    'thickness': (_thickness, 'meters'),
+    'surface_velocity': (_speed, 'meters/year'),
+    'velocity_angle': (lambda x, y: np.degrees(np.arctan2(*_direction(x, y)[::-1])), 'degrees'),
+    'vx': (lambda x, y: _speed(x, y)*_direction(x, y)[0], 'meters/year'),
+    'vy': (lambda x, y: _speed(x, y)*_direction(x, y)[1], 'meters/year'),
+    'velocity_x': (lambda x, y: _speed(x, y)*_direction(x, y)[0], 'meters/year'),
+    'velocity_y': (lambda x, y: _speed(x, y)*_direction(x, y)[1], 'meters/year'),
+    'surfvelmag': (_speed, 'meters/year'),
+    'balvelmag': (lambda x, y: 0.9*_speed(x, y), 'meters/year'),
+    'smb': (_smb, 'meters/year'),
+    'runoff': (lambda x, y: np.clip(-_smb(x, y), 0, None), 'meters/year'),
+    'dhdt': (lambda x, y: -0.2*np.clip(-_smb(x, y), 0, None), 'meters/year'),
+}
+
+# dataset: native resolution (m)
+RESOLUTION = {
+    'presentday': 5e3,
+    'bamber2013': 1e3,
+    'morlighem2014': 150.,
+    'rignot_mouginot2012': 150.,
+}
+
+def _make_load(res):
+    def load(variables, bbox=None, maxshape=None):
+        import dimarray.geo as da
+        if isinstance(variables, str):
+            variables = [variables]
+        l, r, b, t = DOMAIN if bbox is None else bbox
+        l, r, b, t = max(l, DOMAIN[0]), min(r, DOMAIN[1]), max(b, DOMAIN[2]), min(t, DOMAIN[3])
+        x = DOMAIN[0] + res*np.arange(np.ceil((l-DOMAIN[0])/res), np.floor((r-DOMAIN[0])/res)+1)
+        y = DOMAIN[2] + res*np.arange(np.ceil((b-DOMAIN[2])/res), np.floor((t-DOMAIN[2])/res)+1)
+        if maxshape is not None:
+            y = y[::max(1, int(np.ceil(y.size/maxshape[0])))]
+            x = x[::max(1, int(np.ceil(x.size/maxshape[1])))]
+        xx, yy = np.meshgrid(x, y)
+        ds = da.Dataset()
+        for v in variables:
+            func, units = FIELDS[v]
+            ds[v] = da.DimArray(func(xx, yy), axes=[y, x], dims=['y', 'x'])
+            ds[v].units = units
+        return ds
+    return load
+
+def _make_stdfile(directory):
+    """ netCDF file listing the variables of the standard dataset (read by config)
+    """
+    import netCDF4 as nc
+    fname = os.path.join(directory, 'presentday.nc')
+    f = nc.Dataset(fname, 'w')
+    for dim, n in [('time', 1), ('y1', 2), ('x1', 2)]:
+        f.createDimension(dim, n)
+    for v in ['smb', 'runoff', 'dhdt', 'surfvelmag', 'balvelmag', 'surface_elevation', 'ice_thickness']:
+        f.createVariable(v, 'f4', ('time', 'y1', 'x1'))[:] = 0.
+    f.close()
+    return fname
+
+def install_synthetic_icedata(directory):
+    """ make "import icedata" return the synthetic backend (before the app is imported)
+    """
+    from dimarray.geo.crs import get_crs
+
+    icedata = types.ModuleType('icedata')
+    greenland = types.ModuleType('icedata.greenland')
+    common = types.ModuleType('icedata.common')
+    icedata.greenland, icedata.common = greenland, common
+
+    def transform_bbox(bbox, crs_from, crs_to):
+        if crs_from == crs_to:
+            return np.asarray(bbox)
+        l, r, b, t = bbox
+        pts = get_crs(crs_to).transform_points(get_crs(crs_from), np.array([l, r, l, r]), np.array([b, b, t, t]))
+        return np.array([pts[:,0].min(), pts[:,0].max(), pts[:,1].min(), pts[:,1].max()])
+    common.transform_bbox = transform_bbox
+
+    stdfile = _make_stdfile(directory)
+    for name, res in RESOLUTION.items():
+        mod = types.ModuleType('icedata.greenland.'+name)
+        mod.GRID_MAPPING = GRID_MAPPING
+        mod.load = _make_load(res)
+        setattr(greenland, name, mod)
+        sys.modules[mod.__name__] = mod
+    greenland.presentday.get_file = lambda : stdfile
+
+    cresis = types.ModuleType('icedata.greenland.cresis')
+    cresis.MAPPING = GRID_MAPPING
+    cresis.glaciers = lambda : []
+    greenland.cresis = cresis
+    sys.modules[cresis.__name__] = cresis
+
+    sys.modules.update({'icedata': icedata, 'icedata.greenland': greenland, 'icedata.common': common})
+
+#
+# Clients
+#
+class TestClient(object):
+    """ in-process client (Flask test client), one per simulated user
+    """
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, query=None, data=None, json_data=None):
+        kwargs = {'query_string': query or {}}
+        if json_data is not None:
+            kwargs.update(data=json.dumps(json_data), content_type='application/json')
+        elif data is not None:
+            kwargs.update(data=data)
+        response = self.client.open(path, method=method, **kwargs)
+        return response.status_code, response.data
+
+class HTTPClient(object):
+    """ client of a running server, with its own cookies (session)
+    """
+    def __init__(self, url):
+        import urllib2, cookielib
+        class NoRedirect(urllib2.HTTPRedirectHandler):
+            def redirect_request(self, *args, **kwargs):
+                return None # time each request on its own
+        self.url = url.rstrip('/')
+        self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cookielib.CookieJar()), NoRedirect())
+
+    def request(self, method, path, query=None, data=None, json_data=None):
+        import urllib, urllib2
+        url = self.url + path
+        if query:
+            url += '?' + urllib.urlencode(query)
+        headers = {'Accept-Encoding': 'gzip'}
+        body = None
+        if json_data is not None:
+            body = json.dumps(json_data)
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urllib.urlencode(data)
+        elif method == 'POST':
+            body = ''
+        try:
+            response = self.opener.open(urllib2.Request(url, body, headers))
+            return response.getcode(), response.read()
+        except urllib2.HTTPError as error:
+            return error.code, error.read()
+
+#
+# Sessions
+#
+class Recorder(object):
+    """ collect (route, latency, ok) of all requests, thread-safe
+    """
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, route, latency, ok):
+        with self._lock:
+            self.records.append((route, latency, ok))
+
+def timed(recorder, client, route, method, path, **kwargs):
+    """ send one request, following background jobs (202) until they are done
+    """
+    start = time.time()
+    status, body = client.request(method, path, **kwargs)
+    if status == 202:
+        job = json.loads(body)
+        while True:
+            status, body = client.request('GET', job['status_url'])
+            state = json.loads(body)['status'] if status == 200 else 'failed'
+            if state in ('done', 'failed'):
+                if state == 'done':
+                    status, body = client.request('GET', json.loads(body)['result_url'])
+                else:
+                    status = 500
+                break
+            time.sleep(0.2)
+    ok = status < 400
+    recorder.add(route, time.time() - start, ok)
+    if not ok:
+        raise RuntimeError("{} {} failed with status {}".format(method, path, status))
+    return body
+
+def glacier_lines(center, rng, length=60., width=8., n=20):
+    """ middle, left and right lines (km) of a straight glacier flowing away from center
+    """
+    x0, y0 = center
+    angle = np.arctan2(y0 - CENTER[1]*1e-3, x0 - CENTER[0]*1e-3) + rng.uniform(-0.3, 0.3)
+    ux, uy = np.cos(angle), np.sin(angle)
+    s = np.linspace(-length/2, length/2, n)
+    lines = []
+    for id, offset in [('middle', 0.), ('left', width/2), ('right', -width/2)]:
+        xs = x0 + s*ux - offset*uy
+        ys = y0 + s*uy + offset*ux
+        lines.append({'id': id, 'values': [{'x': float(x), 'y': float(y)} for x, y in zip(xs, ys)]})
+    return lines
+
+def run_session(client, recorder, glaciers, rng, pans=3, maxpixels=200):
+    """ replay one typical user session
+    """
+    from outletglacierapp.models.greenmap import get_coords
+
+    glacier = rng.choice(glaciers)
+    l, r, b, t = get_coords(glacier)
+    query = {'dataset': 'bedrock - bamber2013', 'glacier': glacier, 'maxpixels': maxpixels,
+             'left': l, 'right': r, 'bottom': b, 'top': t}
+    timed(recorder, client, '/mapdata', 'GET', '/mapdata', query=query)
+
+    # pan and zoom around the glacier
+    for i in range(pans):
+        w = (r - l)*rng.uniform(0.3, 1.)
+        cx = (l + r)/2 + rng.uniform(-0.2, 0.2)*(r - l)
+        cy = (b + t)/2 + rng.uniform(-0.2, 0.2)*(t - b)
+        query.update(left=cx-w/2, right=cx+w/2, bottom=cy-w/2, top=cy+w/2)
+        timed(recorder, client, '/mapdata', 'GET', '/mapdata', query=query)
+
+    center = ((l + r)/2, (b + t)/2)
+    timed(recorder, client, '/flowline', 'GET', '/flowline',
+          query={'x': center[0], 'y': center[1], 'dx': 1, 'maxdist': 100, 'dataset': 'rignot_mouginot2012'})
+
+    timed(recorder, client, '/lines', 'POST', '/lines', json_data=glacier_lines(center, rng))
+    timed(recorder, client, '/mesh', 'POST', '/mesh',
+          data={'dx': 2e3, 'ny': 10, 'refine': 'none', 'dxmin': 1e3, 'dxmax': 10e3})
+    timed(recorder, client, '/glacier1d', 'POST', '/glacier1d',
+          data={'bedrock': 'bamber2013', 'velocity_mag': 'rignot_mouginot2012', 'smb': 'standard_dataset',
+                'smooth2d': 0, 'smooth1d': 0})
+    timed(recorder, client, '/figure/glacier1d', 'GET', '/figure/glacier1d',
+          query={'format': 'columnar', 'encoding': 'base64'})
+
+def report(recorder, elapsed, out=sys.stdout):
+    """ print throughput and latency percentiles per route
+    """
+    routes = defaultdict(list)
+    errors = defaultdict(int)
+    for route, latency, ok in recorder.records:
+        routes[route].append(latency)
+        errors[route] += not ok
+    fmt = "{:<20} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8}"
+    print(fmt.format("route", "count", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms"), file=out)
+    for route in sorted(routes):
+        lat = np.array(routes[route])*1e3
+        p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+        print(fmt.format(route, lat.size, errors[route], "{:.2f}".format(lat.size/elapsed),
+                         "{:.0f}".format(p50), "{:.0f}".format(p95), "{:.0f}".format(p99), "{:.0f}".format(lat.max())), file=out)
+    total = len(recorder.records)
+    print("{} requests in {:.1f} s: {:.2f} req/s".format(total, elapsed, total/elapsed), file=out)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=4, help="number of concurrent simulated users")
+    parser.add_argument("--sessions", type=int, default=3, help="number of sessions per user")
+    parser.add_argument("--pans", type=int, default=3, help="number of map pans/zooms per session")
+    parser.add_argument("--maxpixels", type=int, default=200, help="map size (pixels per side)")
+    parser.add_argument("--url", help="replay against a running server rather than in-process")
+    parser.add_argument("--real-data", action="store_true", help="in-process, use the real icedata instead of synthetic data")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary data directory")
+    arg = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='loadtest-')
+    try:
+        if not arg.real_data:
+            install_synthetic_icedata(tmpdir)
+
+        from outletglacierapp import app, config
+        from outletglacierapp.models.rastercache import set_cache
+        from outletglacierapp.models.store import set_store
+        glaciers = [nm for nm in config.glacier_choices if nm.lower() not in ('custom', 'greenland')] or ['Greenland']
+
+        if arg.url:
+            make_client = lambda : HTTPClient(arg.url)
+        else:
+            # keep test files away from the app's data
+            app.config['WTF_CSRF_ENABLED'] = False
+            config.workspacedir = os.path.join(tmpdir, 'sessions')
+            config.jobdir = os.path.join(tmpdir, 'jobs')
+            config.artifactdir = os.path.join(tmpdir, 'artifacts')
+            set_cache(os.path.join(tmpdir, 'rastercache'), config.rastercache_maxbytes)
+            set_store(os.path.join(tmpdir, 'store'), config.store_maxbytes)
+            make_client = lambda : TestClient(app)
+
+        recorder = Recorder()
+        failures = []
+
+        def user(i):
+            rng = random.Random(arg.seed + i)
+            client = make_client()
+            for k in range(arg.sessions):
+                try:
+                    run_session(client, recorder, glaciers, rng, pans=arg.pans, maxpixels=arg.maxpixels)
+                except Exception:
+                    failures.append(traceback.format_exc())
+
+        start = time.time()
+        threads = [threading.Thread(target=user, args=(i,)) for i in range(arg.users)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        elapsed = time.time() - start
+
+        report(recorder, elapsed)
+        if failures:
+            print("\n{} sessions failed, first error:\n{}".format(len(failures), failures[0]))
+            sys.exit(1)
+    finally:
+        if arg.keep:
+            print("data kept in", tmpdir)
+        else:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
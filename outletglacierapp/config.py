@@ -13,6 +13,55 @@ curdir = os.path.abspath(os.path.dirname(__name__)) # this directory
 datadir=os.path.join(curdir, 'appdata') # data directory above that one, for some reason no need for pardir...
 datadir=os.path.join(curdir, 'outletglacierapp', 'appdata') # data directory above that one, for some reason no need for pardir...
 
+# write intermediate datasets of glacier extraction (for debugging)
+debug_artifacts = False
+artifactdir = os.path.join(datadir, 'artifacts')
+
+# per-session workspaces (mesh, glacier1d and lines files of each user)
+workspacedir = os.path.join(datadir, 'sessions')
+workspace_ttl = 7*24*3600 # s, remove workspaces unused for that long
+workspace_quota = 2*1024**3 # bytes, remove least recently used workspaces beyond that
+workspace_gc_interval = 3600 # s, check for stale workspaces at most that often
+
+# line edits are logged as patches (see linestore.py)
+lines_history = 100 # number of edits which can be undone
+lines_compact = 500 # compact the log into a snapshot beyond that many edits
+
+# run /mesh and /glacier1d POST as background jobs: requests return a job id
+# to follow via /jobs/<id>, and identical concurrent jobs are coalesced
+background_jobs = False
+jobdir = os.path.join(datadir, 'jobs')
+job_processes = 2 # size of the process pool, in each server worker
+job_timeout = 3600 # s, running jobs without progress for that long are considered failed (queued jobs wait)
+job_ttl = 24*3600 # s, finished jobs and their results are kept that long
+
+# large json responses are streamed, and compressed if the client accepts it
+compress_min_size = 16*1024 # bytes, smaller responses are not compressed
+compress_level = 1 # zlib level: fast compression, for latency
+
+# rasters shared by the server processes (velocity for flowlines, map windows),
+# memory-mapped from this directory (preferably in memory), None to disable
+rastercachedir = '/dev/shm/outletglacierapp' if os.path.isdir('/dev/shm') else os.path.join(datadir, 'rastercache')
+rastercache_maxbytes = 2*1024**3 # bytes, least recently used rasters are evicted beyond that
+
+# expensive intermediate results (reprojected rasters, meshes, interpolated fields)
+# kept on disk across restarts, None to disable (see models/store.py)
+storedir = os.path.join(datadir, 'store')
+store_maxbytes = 10*1024**3 # bytes, least recently used entries are removed beyond that
+
+# profile single requests on demand (?profile or X-Profile header), see profiling.py
+profiling = False
+profile_hosts = ['127.0.0.1'] # addresses allowed to request profiles, None for any
+profile_token = None # if set, the profile parameter or header must have that value
+profiledir = os.path.join(datadir, 'profiles')
+profile_keep = 50 # number of reports kept
+
+# admission control of /mapdata and /mesh, from their predicted cost (see models/budget.py)
+budget_policy = 'clamp' # 'clamp': reduce the resolution to fit, 'reject': fail with 400, None: no limit
+request_maxbytes = 512*1024**2 # bytes, predicted peak memory of one request
+request_maxwork = 5e6 # number of points processed by one request
+memory_watermark = 4*1024**3 # bytes, max memory of a server process (503 beyond), None for no limit
+
 # get variables present in the standard_greenland dataset
 ds = nc.Dataset(NCFILESTD)
 stdvariables = [v for v in ds.variables.keys() \
@@ -84,8 +133,15 @@ maxpixels = 400
 #Flow line options
 dx = 1 # space between flowline elements
 maxdist = 200 # max distance (km)
+flowline_maxshape = (500, 500) # velocity data is loaded at that resolution, at most
 # resample = 50
 
 # mesh glacier
 mesh_dx = 10*1e3 # m
 mesh_ny = 10 # number of points along a cross-section
+extract_tilesize = 50e3 # m, load high-resolution bedrock by tiles of that size (None: whole glacier at once)
+extract_smooth2d = 0 # m, Gaussian smoothing of 2-D data prior to interpolation (0: none)
+extract_smooth1d = 0 # grid points, Gaussian smoothing of the glacier1d profiles (0: none)
+mesh_refine = 'none' # refine along-flow step from 'velocity' or 'thickness' gradients
+mesh_dxmin = 1*1e3 # m, min along-flow step when refining
+mesh_dxmax = 10*1e3 # m, max along-flow step when refining
@@ -59,6 +59,23 @@ class ExtractForm(Form):
             default=o.sources_default[v]
         )
 
+    smooth2d = FloatField('2-D smoothing (m)', default=o.extract_smooth2d)
+    smooth1d = FloatField('along-flow smoothing (grid points)', default=o.extract_smooth1d)
+
+def not_below(fieldname):
+    """ validator: field value is not smaller than that of another field of the form
+    """
+    def check(form, field):
+        other = form[fieldname]
+        if field.data is not None and other.data is not None and field.data < other.data:
+            raise ValidationError("must not be smaller than {}".format(other.label.text))
+    return check
+
 class MeshForm(Form):
     dx = FloatField('x grid step (m)',default=o.mesh_dx)
     ny = FloatField('number of cross-flow points',default=o.mesh_ny)
+    refine = SelectField('refine x grid from', 
+                         choices=[('none','none'),('velocity','velocity'),('thickness','thickness')],
+                         default=o.mesh_refine)
+    dxmin = FloatField('min x grid step (m)',default=o.mesh_dxmin, validators=[NumberRange(min=1.)])
+    dxmax = FloatField('max x grid step (m)',default=o.mesh_dxmax, validators=[NumberRange(min=1.), not_below('dxmin')])
@@ -0,0 +1,208 @@
+""" Background jobs: long computations run in a process pool, tracked in an on-disk job table
+
+The job table is a sqlite database shared by all worker processes of the app,
+so that a job submitted by one worker can be followed from any other. Jobs
+with the same input key which are queued or running are coalesced: a second
+submission returns the id of the job already in progress.
+
+Job functions are called in a pool process as func(progress, outdir, *args),
+where progress(fraction, message) reports progress to the job table and outdir
+is a directory private to the job. They return the path of the result file.
+Progress is also the heartbeat of running jobs: a running job without progress
+for longer than the timeout is considered failed (e.g. its process died).
+Queued jobs do not time out, however long they wait for a pool process.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import traceback
+from multiprocessing import Pool
+
+import config
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+PROGRESS_INTERVAL = 1. # s, progress is written to the job table at most that often
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT,
+    key TEXT,
+    status TEXT,
+    progress REAL,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    created REAL,
+    updated REAL
+)"""
+
+def _connect(dbpath):
+    # autocommit mode, transactions are explicit (see JobQueue.submit)
+    conn = sqlite3.connect(dbpath, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute(_SCHEMA)
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)")
+    return conn
+
+def input_key(kind, *inputs):
+    """ key identifying a job from its kind and (json-serializable) inputs
+    """
+    return hashlib.sha1(json.dumps([kind, inputs], sort_keys=True)).hexdigest()
+
+def file_hash(path):
+    """ sha1 of a file's content, to include input files in input_key
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1<<20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class JobQueue(object):
+    """ Submit jobs to a local process pool and follow them in the job table
+
+    Parameters
+    ----------
+    jobdir : directory for the job table (jobs.db) and the job output directories
+    processes : number of pool processes
+    timeout : running jobs without progress for that long (s) are considered failed
+    ttl : finished jobs and their results are removed after that long (s)
+    """
+    def __init__(self, jobdir, processes=None, timeout=3600, ttl=24*3600):
+        self.jobdir = jobdir
+        self.dbpath = os.path.join(jobdir, 'jobs.db')
+        self.processes = processes
+        self.timeout = timeout
+        self.ttl = ttl
+        self._pool = None
+        if not os.path.exists(jobdir):
+            os.makedirs(jobdir)
+        _connect(self.dbpath).close()
+
+    @property
+    def pool(self):
+        # created on first use, i.e. after the server has forked its workers
+        if self._pool is None:
+            self._pool = Pool(self.processes)
+        return self._pool
+
+    def submit(self, kind, func, args, key, prepare=None):
+        """ Submit a job, unless an identical one is already queued or running
+
+        Parameters
+        ----------
+        kind : job kind (e.g. 'mesh', 'glacier1d')
+        func : module-level function func(progress, outdir, *args), returns the result path
+        args : tuple of picklable arguments
+        key : input key (see input_key), identical jobs are coalesced
+        prepare : function prepare(outdir), called on submission of a new job
+            (e.g. to copy input files which may change before the job runs)
+
+        Returns
+        -------
+        id : job id
+        """
+        self.cleanup()
+        now = time.time()
+        conn = _connect(self.dbpath)
+        try:
+            conn.execute("BEGIN IMMEDIATE") # one submission at a time, across processes
+            row = conn.execute("SELECT id FROM jobs WHERE key=? AND (status=? OR (status=? AND updated>?)) ORDER BY created DESC",
+                               (key, QUEUED, RUNNING, now - self.timeout)).fetchone()
+            if row is not None:
+                conn.execute("COMMIT")
+                return row['id']
+            id = uuid.uuid4().hex
+            conn.execute("INSERT INTO jobs (id, kind, key, status, progress, message, created, updated) VALUES (?,?,?,?,?,?,?,?)",
+                         (id, kind, key, QUEUED, 0., '', now, now))
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        outdir = os.path.join(self.jobdir, id)
+        os.makedirs(outdir)
+        try:
+            if prepare: prepare(outdir)
+            self.pool.apply_async(_run, (self.dbpath, id, outdir, func, args))
+        except Exception:
+            _update(self.dbpath, id, status=FAILED, error=traceback.format_exc())
+            raise
+        return id
+
+    def status(self, id):
+        """ job status as a dict (None if unknown), with keys id, kind, status,
+        progress, message, error, result, created, updated
+        """
+        conn = _connect(self.dbpath)
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id=?", (id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = {k: row[k] for k in row.keys()}
+        if job['status'] == RUNNING and time.time() - job['updated'] > self.timeout:
+            _update(self.dbpath, id, status=FAILED, error="no progress for {} s".format(self.timeout))
+            job['status'] = FAILED
+        return job
+
+    def cleanup(self):
+        """ remove jobs finished for more than ttl seconds, and their results
+        """
+        conn = _connect(self.dbpath)
+        try:
+            expired = [row['id'] for row in conn.execute("SELECT id FROM jobs WHERE status IN (?,?) AND updated<?",
+                                                         (DONE, FAILED, time.time() - self.ttl))]
+            for id in expired:
+                conn.execute("DELETE FROM jobs WHERE id=?", (id,))
+        finally:
+            conn.close()
+        for id in expired:
+            shutil.rmtree(os.path.join(self.jobdir, id), ignore_errors=True)
+
+def _update(dbpath, id, **fields):
+    fields['updated'] = time.time()
+    names = sorted(fields.keys())
+    conn = _connect(dbpath)
+    try:
+        conn.execute("UPDATE jobs SET {} WHERE id=?".format(", ".join(nm+"=?" for nm in names)),
+                     [fields[nm] for nm in names] + [id])
+    finally:
+        conn.close()
+
+def _run(dbpath, id, outdir, func, args):
+    """ run a job in a pool process, recording its progress and result in the job table
+    """
+    last = [0.]
+    def progress(fraction, message=''):
+        # frequent calls (e.g. one per mesh section) are written at most every PROGRESS_INTERVAL
+        if time.time() - last[0] >= PROGRESS_INTERVAL:
+            _update(dbpath, id, progress=fraction, message=message)
+            last[0] = time.time()
+
+    _update(dbpath, id, status=RUNNING)
+    try:
+        result = func(progress, outdir, *args)
+    except Exception:
+        _update(dbpath, id, status=FAILED, error=traceback.format_exc())
+    else:
+        _update(dbpath, id, status=DONE, progress=1., result=result)
+
+_queue = None
+
+def get_queue():
+    """ job queue of this process, configured from config
+    """
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(config.jobdir, processes=config.job_processes,
+                          timeout=config.job_timeout, ttl=config.job_ttl)
+    return _queue
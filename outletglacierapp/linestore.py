@@ -0,0 +1,334 @@
+""" Versioned store of the glacier lines of a session, edited with small patches
+
+The lines of a workspace are a list of {'id': ..., 'values': [{'x':..., 'y':...}, ...]}.
+Rather than rewriting the whole list on every edit, clients send patches,
+i.e. lists of operations on one line at a time:
+
+    {'op': 'insert', 'line': id, 'index': i, 'points': [...]}  # insert points before index i
+    {'op': 'move', 'line': id, 'index': i, 'points': [...]}    # replace points from index i on
+    {'op': 'delete', 'line': id, 'index': i, 'count': n}       # delete n points from index i
+    {'op': 'set', 'line': id, 'points': [...], 'position': k}  # (re)place a whole line, at position k (optional)
+    {'op': 'remove', 'line': id}                               # remove a line
+
+Each patch increments the version of the lines. A patch is only applied if
+it was made against the current version (optimistic concurrency), otherwise
+VersionConflict is raised and the client has to merge with the current lines.
+
+Patches are appended to a log (lines.log, one JSON record per line) together
+with their inverse, so that saving costs O(changed points), edits can be
+undone and redone, and consumers (e.g. a mesh rebuild) can ask which
+operations were applied since a given version. The log is compacted into a
+snapshot (lines.json) every so often, keeping the most recent records for
+undo.
+"""
+import os
+import copy
+import json
+
+import config
+
+SNAPSHOT = 'lines.json'
+LOG = 'lines.log'
+
+OPS = ['insert', 'move', 'delete', 'set', 'remove']
+
+class VersionConflict(Exception):
+    """ patch made against an outdated version of the lines
+    """
+    def __init__(self, version, expected):
+        Exception.__init__(self, "lines are at version {}, patch made against version {}".format(version, expected))
+        self.version = version
+        self.expected = expected
+
+class LineStore(object):
+    """ Lines of one workspace, with version, patches and undo history
+
+    Parameters
+    ----------
+    workspace : Workspace instance (see workspace.py)
+    history : number of log records kept after compaction (undo depth)
+    compact : number of log records beyond which the log is compacted
+
+    Notes
+    -----
+    Methods which modify the lines take the workspace lock themselves.
+    """
+    def __init__(self, workspace, history=None, compact=None):
+        self.workspace = workspace
+        self.history = config.lines_history if history is None else history
+        self.compact = config.lines_compact if compact is None else compact
+
+    def load(self):
+        """ current lines and version
+
+        Returns
+        -------
+        lines : list of lines
+        version : int
+        """
+        with self.workspace.lock(shared=True):
+            lines, version, _, _ = self._read()
+        return lines, version
+
+    def patch(self, ops, version=None):
+        """ apply a list of operations, atomically
+
+        Parameters
+        ----------
+        ops : list of operations (see module documentation)
+        version : version the patch was made against (None to skip the check)
+
+        Returns
+        -------
+        lines : updated lines
+        version : new version
+        """
+        return self._commit('edit', lambda lines, version, records, base: ops, version)
+
+    def replace(self, lines, version=None):
+        """ replace all lines (e.g. uploaded file), as a patch of 'set' and 'remove' operations
+        """
+        def diff(current, version, records, base):
+            ids = [line['id'] for line in lines]
+            ops = [{'op': 'remove', 'line': line['id']} for line in current if line['id'] not in ids]
+            current = copy.deepcopy(current)
+            apply_ops(current, ops)
+            for k, line in enumerate(lines):
+                old = _find(current, line['id'])
+                if old != k or current[old]['values'] != _points(line['values']):
+                    op = {'op': 'set', 'line': line['id'], 'points': line['values'], 'position': k}
+                    apply_ops(current, [op])
+                    ops.append(op)
+            return ops
+        return self._commit('edit', diff, version)
+
+    def undo(self):
+        """ undo the last edit (lines unchanged if there is nothing to undo)
+        """
+        return self._commit('undo', self._undo_ops)
+
+    def redo(self):
+        """ redo the last undone edit (lines unchanged if there is nothing to redo)
+        """
+        return self._commit('redo', self._redo_ops)
+
+    def changes(self, since):
+        """ operations applied since a version, or None if not in the log anymore
+
+        Returns
+        -------
+        list of operations, in order (an empty list means no change)
+        """
+        with self.workspace.lock(shared=True):
+            lines, version, records, _ = self._read()
+        if since == version:
+            return []
+        versions = [r['version'] for r in records]
+        if since > version or since + 1 not in versions:
+            return None
+        return [op for r in records if r['version'] > since for op in r['ops']]
+
+    #
+    # undo / redo stacks, from the log
+    #
+    def _stacks(self, records, base):
+        """ versions of the edits which can be undone and redone
+        """
+        undo, redo = list(base['undo']), list(base['redo'])
+        for r in records:
+            if r['version'] <= base['version']:
+                continue # already in the snapshot's stacks
+            if r['kind'] == 'edit':
+                if r['ops']:
+                    undo.append(r['version'])
+                    redo = []
+            elif r['kind'] == 'undo' and undo and undo[-1] == r['target']:
+                redo.append(undo.pop())
+            elif r['kind'] == 'redo' and redo and redo[-1] == r['target']:
+                undo.append(redo.pop())
+        return undo, redo
+
+    def _undo_ops(self, lines, version, records, base):
+        undo, _ = self._stacks(records, base)
+        if not undo:
+            return [], None
+        target = undo[-1]
+        return _record(records, target)['inverse'], target
+
+    def _redo_ops(self, lines, version, records, base):
+        _, redo = self._stacks(records, base)
+        if not redo:
+            return [], None
+        target = redo[-1]
+        return _record(records, target)['ops'], target
+
+    #
+    # storage
+    #
+    def _commit(self, kind, make_ops, expected=None):
+        with self.workspace.lock():
+            lines, version, records, base = self._read()
+            if expected is not None and expected != version:
+                raise VersionConflict(version, expected)
+            result = make_ops(lines, version, records, base)
+            ops, target = result if kind != 'edit' else (result, None)
+            if not ops:
+                return lines, version
+            inverse = apply_ops(lines, ops)
+            version += 1
+            record = {'version': version, 'kind': kind, 'ops': ops, 'inverse': inverse}
+            if target is not None:
+                record['target'] = target
+            records.append(record)
+            with open(self.workspace.path(LOG), 'a') as f:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            if len(records) > self.compact:
+                self._compact(lines, version, records, base)
+        return lines, version
+
+    def _read(self):
+        """ lines, version, log records and snapshot undo/redo stacks (lock held)
+        """
+        snapshot = {'version': 0, 'lines': [], 'undo': [], 'redo': []}
+        path = self.workspace.path(SNAPSHOT)
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            if isinstance(stored, list):
+                snapshot['lines'] = stored # lines saved before versioning
+            else:
+                snapshot.update(stored)
+        lines = snapshot.pop('lines')
+        version = snapshot['version']
+
+        records = []
+        path = self.workspace.path(LOG)
+        if os.path.exists(path):
+            with open(path) as f:
+                for row in f:
+                    try:
+                        records.append(json.loads(row))
+                    except ValueError:
+                        break # incomplete last record (interrupted write)
+
+        # replay edits beyond the snapshot
+        for r in records:
+            if r['version'] == version + 1:
+                apply_ops(lines, r['ops'])
+                version += 1
+        records = [r for r in records if r['version'] <= version]
+        return lines, version, records, snapshot
+
+    def _compact(self, lines, version, records, base):
+        """ write a snapshot, and keep the log records needed for undo and recent changes (lock held)
+        """
+        undo, redo = self._stacks(records, base)
+        undo, redo = undo[max(0, len(undo)-self.history):], redo[max(0, len(redo)-self.history):]
+        needed = set(undo + redo)
+        records = [r for r in records if r['version'] in needed or r['version'] > version - self.history]
+
+        # snapshot first: if interrupted, the old log only has records up to version
+        with self.workspace.atomic(SNAPSHOT) as tmp:
+            with open(tmp, 'w') as f:
+                json.dump({'version': version, 'lines': lines, 'undo': undo, 'redo': redo}, f)
+        with self.workspace.atomic(LOG) as tmp:
+            with open(tmp, 'w') as f:
+                for r in records:
+                    f.write(json.dumps(r, separators=(',', ':')) + '\n')
+
+def apply_ops(lines, ops):
+    """ apply operations to lines in place, and return the inverse operations
+
+    Parameters
+    ----------
+    lines : list of lines, modified in place
+    ops : list of operations (see module documentation)
+
+    Returns
+    -------
+    inverse : list of operations which restore the lines
+    """
+    inverse = []
+    try:
+        for op in ops:
+            inverse.append(_apply(lines, op))
+    except:
+        # leave lines as they were
+        for inv in inverse[::-1]:
+            _apply(lines, inv)
+        raise
+    return inverse[::-1]
+
+def _apply(lines, op):
+    """ apply one operation and return its inverse
+    """
+    if not isinstance(op, dict) or op.get('op') not in OPS:
+        raise ValueError("invalid operation: {}, expected one of {}".format(op, OPS))
+    kind = op['op']
+    id = op.get('line')
+    k = _find(lines, id)
+
+    if kind == 'set':
+        points = _points(op['points'])
+        position = op.get('position')
+        if k is None:
+            inv = {'op': 'remove', 'line': id}
+        else:
+            inv = {'op': 'set', 'line': id, 'points': lines.pop(k)['values'], 'position': k}
+        if position is None:
+            position = len(lines) if k is None else k
+        lines.insert(min(position, len(lines)), {'id': id, 'values': points})
+        return inv
+
+    if k is None:
+        raise ValueError("no line with id {}".format(id))
+    values = lines[k]['values']
+
+    if kind == 'remove':
+        lines.pop(k)
+        return {'op': 'set', 'line': id, 'points': values, 'position': k}
+
+    index = op.get('index')
+    if not isinstance(index, int) or index < 0 or index > len(values):
+        raise ValueError("invalid index {} for line {} of {} points".format(index, id, len(values)))
+
+    if kind == 'insert':
+        points = _points(op['points'])
+        values[index:index] = points
+        return {'op': 'delete', 'line': id, 'index': index, 'count': len(points)}
+
+    if kind == 'move':
+        points = _points(op['points'])
+        if index + len(points) > len(values):
+            raise ValueError("cannot move points beyond the end of line {}".format(id))
+        old = values[index:index+len(points)]
+        values[index:index+len(points)] = points
+        return {'op': 'move', 'line': id, 'index': index, 'points': old}
+
+    # delete
+    count = op.get('count', 1)
+    if not isinstance(count, int) or count < 0 or index + count > len(values):
+        raise ValueError("cannot delete {} points from index {} of line {}".format(count, index, id))
+    old = values[index:index+count]
+    del values[index:index+count]
+    return {'op': 'insert', 'line': id, 'index': index, 'points': old}
+
+def _points(points):
+    """ validated list of {'x':..., 'y':...} points
+    """
+    try:
+        return [{'x': float(pt['x']), 'y': float(pt['y'])} for pt in points]
+    except (TypeError, KeyError, ValueError):
+        raise ValueError("points must be a list of {'x':..., 'y':...}, got: "+repr(points)[:100])
+
+def _find(lines, id):
+    for k, line in enumerate(lines):
+        if line['id'] == id:
+            return k
+    return None
+
+def _record(records, version):
+    for r in records:
+        if r['version'] == version:
+            return r
+    raise KeyError(version)
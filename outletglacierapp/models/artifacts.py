@@ -0,0 +1,76 @@
+""" Optional output of intermediate (debug) datasets, written in the background
+"""
+from __future__ import print_function
+import os
+import copy
+import uuid
+import threading
+import warnings
+
+try:
+    import Queue as queue # python 2
+except ImportError:
+    import queue
+
+class ArtifactWriter(object):
+    """ Write datasets to netCDF files from a background thread
+
+    Parameters
+    ----------
+    directory : directory where files are written (created if needed)
+    maxsize : max number of datasets waiting to be written. When the queue
+        is full, new artifacts are dropped with a warning rather than
+        slowing down the caller.
+
+    Examples
+    --------
+    >>> writer = ArtifactWriter('/tmp/artifacts')
+    >>> artifacts = writer.bind() # one per extraction
+    >>> artifacts("glacier2d.nc", glacier2d) # doctest: +SKIP
+    """
+    def __init__(self, directory, maxsize=10):
+        self.directory = directory
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="artifact-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, filename, dataset):
+        """ schedule a copy of dataset to be written to directory/filename
+        """
+        path = os.path.join(self.directory, filename)
+        try:
+            self._queue.put_nowait((path, copy.deepcopy(dataset)))
+        except queue.Full:
+            warnings.warn("artifact queue full, drop "+filename)
+
+    def bind(self, tag=None):
+        """ return a function artifacts(filename, dataset) for one extraction,
+        whose file names are prefixed with a unique tag so that concurrent
+        extractions do not overwrite each other's files
+        """
+        if tag is None:
+            tag = uuid.uuid4().hex[:12]
+        def artifacts(filename, dataset):
+            self.submit(tag+'_'+filename, dataset)
+        artifacts.tag = tag
+        return artifacts
+
+    def join(self):
+        """ wait until all scheduled artifacts are written
+        """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            path, dataset = self._queue.get()
+            try:
+                if not os.path.exists(self.directory):
+                    os.makedirs(self.directory)
+                tmp = path + '.tmp'
+                dataset.write_nc(tmp, 'w')
+                os.rename(tmp, path) # readers never see a partial file
+            except Exception as error:
+                warnings.warn("failed to write artifact {}: {}".format(path, error))
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,295 @@
+""" Cost estimates of requests, and admission within a memory budget
+
+Map windows and meshes are sized by the user (number of pixels, mesh step
+and number of cross-flow points), with no upper bound: a map of 5000 pixels
+per side, or a mesh with a 1 m step on a long glacier, would exhaust the
+memory of the server. The functions below predict the memory (bytes) and
+work (points processed) of such requests from their parameters only, before
+anything is loaded, and find the closest parameters which fit a budget
+(see views for the policy: clamp or reject).
+
+MemoryGuard bounds the memory of the whole process: each admitted request
+reserves its estimate until it completes, and requests which would push the
+process beyond a watermark are not admitted.
+"""
+import os
+import threading
+import numpy as np
+
+import icedata.greenland
+from greenmap import _resolve_variable
+
+# native resolution of the source datasets (m), by icedata module
+RESOLUTION = {
+    'presentday': 5e3,
+    'bamber2013': 1e3,
+    'morlighem2014': 150.,
+    'rignot_mouginot2012': 150.,
+}
+DEFAULT_RESOLUTION = 150. # m, for unknown datasets: assume high resolution
+
+# bytes per grid point of map data: float arrays (loaded, reprojected, copies in
+# get_dict_data) and python lists of the json response
+MAP_ARRAY_BYTES = 4*8
+MAP_LIST_BYTES = 40
+PROJECTION_FACTOR = 2 # a reprojected bounding box covers more points
+
+# bytes per mesh node: coordinate arrays and their copies, and Point objects
+# created along the cross-sections; and per cross-section (Line, Segment...)
+MESH_NODE_BYTES = 4*8 + 300
+MESH_SECTION_BYTES = 3000
+
+class Cost(object):
+    """ predicted cost of a request
+
+    Parameters
+    ----------
+    bytes : peak memory (bytes)
+    work : number of points processed
+    params : parameters the cost was computed for (dict)
+    """
+    def __init__(self, bytes, work, **params):
+        self.bytes = int(bytes)
+        self.work = int(work)
+        self.params = params
+
+    def fits(self, maxbytes=None, maxwork=None):
+        return (maxbytes is None or self.bytes <= maxbytes) and (maxwork is None or self.work <= maxwork)
+
+    def excess(self, maxbytes=None, maxwork=None):
+        """ ratio of the cost to the budget (> 1 if over budget), for positive bounds
+        """
+        _check_budget(maxbytes, maxwork)
+        ratios = [0.]
+        if maxbytes is not None: ratios.append(self.bytes/float(maxbytes))
+        if maxwork is not None: ratios.append(self.work/float(maxwork))
+        return max(ratios)
+
+    def todict(self):
+        return dict(self.params, bytes=self.bytes, work=self.work)
+
+    def __repr__(self):
+        return "Cost(bytes={}, work={}, {})".format(self.bytes, self.work,
+            ", ".join("{}={!r}".format(k, v) for k, v in sorted(self.params.items())))
+
+def _check_budget(maxbytes, maxwork):
+    """ ValueError unless the bounds are positive (or None)
+    """
+    for name, bound in [('maxbytes', maxbytes), ('maxwork', maxwork)]:
+        if bound is not None and not bound > 0:
+            raise ValueError("budget {} must be positive, got {}".format(name, bound))
+
+def source_resolution(dataset):
+    """ native resolution (m) of a dataset, as named in the app (e.g. bamber2013)
+    """
+    modname, _ = _resolve_variable(None, dataset)
+    return RESOLUTION.get(modname, DEFAULT_RESOLUTION)
+
+def _is_projected(dataset):
+    modname, _ = _resolve_variable(None, dataset)
+    mod = getattr(icedata.greenland, modname, None)
+    return mod is not None and mod.GRID_MAPPING != icedata.greenland.bamber2013.GRID_MAPPING
+
+def map_cost(coords, dataset, maxpixels):
+    """ cost of a map window (see greenmap.get_dict_data)
+
+    Parameters
+    ----------
+    coords : left, right, bottom, top in km
+    dataset : data source (e.g. bamber2013)
+    maxpixels : max number of pixels per side
+
+    Returns
+    -------
+    Cost
+    """
+    if not maxpixels > 0:
+        raise ValueError("number of pixels must be positive, got {}".format(maxpixels))
+    l, r, b, t = coords
+    res = source_resolution(dataset)*1e-3 # km
+    nx = max(1, np.ceil(abs(r - l)/res))
+    ny = max(1, np.ceil(abs(t - b)/res))
+    loaded = min(nx, maxpixels)*min(ny, maxpixels) # sub-sampled when loading
+    if _is_projected(dataset):
+        loaded *= PROJECTION_FACTOR
+    served = min(nx, maxpixels)*min(ny, maxpixels)
+    return Cost(loaded*MAP_ARRAY_BYTES + served*MAP_LIST_BYTES, loaded, maxpixels=int(maxpixels))
+
+def clamp_map(coords, dataset, maxpixels, maxbytes=None, maxwork=None, minpixels=10):
+    """ largest number of pixels up to maxpixels which fits the budget
+
+    Returns
+    -------
+    Cost, whose params['maxpixels'] is the clamped value (may not fit the budget if minpixels does not)
+
+    Raises
+    ------
+    ValueError if the bounds are not positive
+    """
+    _check_budget(maxbytes, maxwork)
+    cost = map_cost(coords, dataset, maxpixels)
+    while not cost.fits(maxbytes, maxwork) and maxpixels > minpixels:
+        factor = cost.excess(maxbytes, maxwork)
+        if not factor > 1:
+            break
+        # cost scales with the square of the number of pixels
+        maxpixels = max(minpixels, min(maxpixels - 1, int(maxpixels/np.sqrt(factor))))
+        cost = map_cost(coords, dataset, maxpixels)
+    return cost
+
+def line_length(points):
+    """ length of a line given as a list of {'x':..., 'y':...} (same units)
+    """
+    xy = np.array([[pt['x'], pt['y']] for pt in points], dtype=float).reshape(-1, 2)
+    return np.sqrt((np.diff(xy, axis=0)**2).sum(axis=1)).sum()
+
+def _min_step(dx, dxmin, dxmax, refine):
+    """ smallest along-flow step (see mesh.along_flow_positions)
+    """
+    if not refine:
+        return dx
+    if dxmin is not None and dxmax is not None and dxmin > dxmax:
+        raise ValueError("min step {} larger than max step {}".format(dxmin, dxmax))
+    step = dx if dxmin is None else dxmin
+    return step if dxmax is None else min(step, dxmax)
+
+def mesh_cost(length, dx, ny, dxmin=None, dxmax=None, refine=False, nside=100):
+    """ cost of a mesh (see mesh.make_2d_grid_from_contours)
+
+    Parameters
+    ----------
+    length : length of the middle line (m)
+    dx : along-flow step (m)
+    ny : number of cross-flow points
+    dxmin, dxmax : bounds of the along-flow step (m), if refine
+    refine : True if the step is refined from data (see mesh.refine_spacing),
+        in which case the finest step is assumed all along
+    nside : number of points of the side lines (each section is intersected with them)
+
+    Returns
+    -------
+    Cost
+    """
+    step = _min_step(dx, dxmin, dxmax, refine)
+    if not step > 0:
+        raise ValueError("mesh step must be positive, got {}".format(step))
+    if not ny >= 2:
+        raise ValueError("at least 2 cross-flow points expected, got {}".format(ny))
+    nx = max(2, np.ceil(length/step))
+    nodes = nx*ny
+    return Cost(nodes*MESH_NODE_BYTES + nx*MESH_SECTION_BYTES, nodes + nx*nside,
+                dx=dx, ny=ny, dxmin=dxmin, dxmax=dxmax)
+
+def clamp_mesh(length, dx, ny, dxmin=None, dxmax=None, refine=False, nside=100, maxbytes=None, maxwork=None):
+    """ finest mesh up to the requested one which fits the budget: coarser
+    along-flow step first, then fewer cross-flow points
+
+    Returns
+    -------
+    Cost, whose params are the clamped dx, ny, dxmin and dxmax (may not fit 
+    the budget if a mesh of 2 x 2 points does not)
+
+    Raises
+    ------
+    ValueError if the bounds are not positive
+    """
+    _check_budget(maxbytes, maxwork)
+    cost = mesh_cost(length, dx, ny, dxmin, dxmax, refine, nside)
+    while not cost.fits(maxbytes, maxwork):
+        factor = cost.excess(maxbytes, maxwork)
+        if not factor > 1:
+            break
+        step = _min_step(dx, dxmin, dxmax, refine)
+        if length/step > 2:
+            # cost scales with the number of sections
+            factor = min(factor, length/step/2.)
+            if refine:
+                dxmin = step*factor
+                dxmax = dxmax if dxmax is None else max(dxmax, dxmin)
+            dx = max(dx, step*factor)
+        elif ny > 2:
+            ny = max(2, int(ny/factor))
+        else:
+            break
+        cost = mesh_cost(length, dx, ny, dxmin, dxmax, refine, nside)
+    return cost
+
+#
+# Memory of the process
+#
+def rss():
+    """ resident memory of this process (bytes), None if unknown
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+class OverWatermark(Exception):
+    """ request not admitted: the process would exceed its memory watermark
+    """
+    def __init__(self, needed, available):
+        Exception.__init__(self, "server busy: request needs {:.0f} MB, {:.0f} MB available".format(needed/1024.**2, max(0, available)/1024.**2))
+        self.needed = needed
+        self.available = available
+
+class MemoryGuard(object):
+    """ admission of requests within a memory watermark of the process
+
+    Parameters
+    ----------
+    watermark : max resident memory of the process (bytes), None for no limit
+
+    Notes
+    -----
+    Memory already allocated by requests in progress counts both in the
+    resident memory and in their reservation: the admission is conservative.
+
+    Examples
+    --------
+    >>> guard = MemoryGuard(watermark=4*1024**3)
+    >>> with guard.reserve(200*1024**2):
+    ...     pass # load data
+    """
+    def __init__(self, watermark=None):
+        self.watermark = watermark
+        self.reserved = 0 # bytes reserved by requests in progress
+        self._lock = threading.Lock()
+
+    def available(self):
+        """ bytes which can still be reserved (None if no limit)
+        """
+        if self.watermark is None:
+            return None
+        with self._lock:
+            return self.watermark - (rss() or 0) - self.reserved
+
+    def reserve(self, nbytes):
+        """ context manager reserving memory for a request (OverWatermark if not available)
+        """
+        return _Reservation(self, nbytes)
+
+    def _acquire(self, nbytes):
+        with self._lock:
+            if self.watermark is not None:
+                available = self.watermark - (rss() or 0) - self.reserved
+                if nbytes > available:
+                    raise OverWatermark(nbytes, available)
+            self.reserved += nbytes
+
+    def _release(self, nbytes):
+        with self._lock:
+            self.reserved -= nbytes
+
+class _Reservation(object):
+    def __init__(self, guard, nbytes):
+        self.guard = guard
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.guard._acquire(self.nbytes)
+        return self
+
+    def __exit__(self, *exc):
+        self.guard._release(self.nbytes)
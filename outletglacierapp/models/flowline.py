@@ -14,7 +14,10 @@ import icedata
 from icedata.greenland.rignot_mouginot2012 import GRID_MAPPING as MAPPING_RM2012
 from icedata.greenland.presentday import GRID_MAPPING as MAPPING_SD
 
-from helper import keepincache
+from helper import memoize
+from rastercache import cached
+from store import stored
+from greenmap import dataset_identity
 
 # get equivalent cartopy transformations
 CRS_RM2012 = get_crs(MAPPING_RM2012)
@@ -46,11 +49,19 @@ PARAMS = dict(
 #     if dataset in DATA:
 #         return DATA[dataset]
 
-@keepincache
+@memoize(maxsize=4)
 def get_velocity_functions(dataset, maxshape=None):
-    vel = load_velocity(dataset=dataset, maxshape=maxshape) # RM2012 CRS
-    fx = naninterpReg(vel.x, vel.y, vel['vx'].values.T, kx=1, ky=1)
-    fy = naninterpReg(vel.x, vel.y, vel['vy'].values.T, kx=1, ky=1)
+    # velocity arrays are shared between server processes (see rastercache), 
+    # kept on disk across restarts (see store), and interpolated in place rather 
+    # than copied into spline coefficients.
+    # Concurrent first calls (e.g. server threads) wait for a single load.
+    # the source file identity is part of both keys: the shared cache survives restarts
+    identity = dataset_identity(dataset)
+    load = lambda : load_velocity(dataset=dataset, maxshape=maxshape)
+    vel = cached(('velocity', dataset, maxshape, repr(identity)), 
+                 lambda : stored('velocity', [dataset, maxshape, identity], load)) # RM2012 CRS
+    fx = naninterpLinear(vel.x, vel.y, vel['vx'].values)
+    fy = naninterpLinear(vel.x, vel.y, vel['vy'].values)
     return vel.x, vel.y, fx, fy
 
 # load velocity data
@@ -128,6 +139,45 @@ class naninterpReg(nanSplineBase, RectBivariateSpline):
     _init = RectBivariateSpline.__init__
     _call = RectBivariateSpline.__call__
 
+class naninterpLinear(object):
+    """ bilinear interpolation on a rectilinear grid, without copying the data
+
+    Same as naninterpReg(x, y, values.T, kx=1, ky=1) evaluated point-wise:
+    NaN if a node contributing to the result is NaN, and points outside 
+    the grid take the value at the nearest border.
+
+    Parameters
+    ----------
+    x, y : increasing grid coordinates
+    values : array of shape (len(y), len(x)), possibly read-only or memory-mapped
+    """
+    def __init__(self, x, y, values):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.values = values
+
+    def _locate(self, axis, v):
+        v = np.clip(v, axis[0], axis[-1])
+        i = np.clip(np.searchsorted(axis, v) - 1, 0, axis.size - 2)
+        return i, (v - axis[i]) / (axis[i+1] - axis[i])
+
+    def __call__(self, x, y):
+        i, tx = self._locate(self.x, np.asarray(x, dtype=float))
+        j, ty = self._locate(self.y, np.asarray(y, dtype=float))
+        z = 0.
+        invalid = False
+        for dj, wy in ((0, 1-ty), (1, ty)):
+            for di, wx in ((0, 1-tx), (1, tx)):
+                w = wx*wy
+                v = np.asarray(self.values[j+dj, i+di], dtype=float)
+                contributes = w > 0
+                invalid = invalid | (contributes & np.isnan(v))
+                z = z + np.where(contributes, w*np.nan_to_num(v), 0.)
+        z = np.where(invalid, np.nan, z)
+        if np.ndim(z) == 0:
+            return float(z)
+        return z
+
 def _drift(x0, y0, fx, fy, dx, sign = 1, maxstep = 10000, stopcond=None, straightness=0):
     """ let a point drift in a vector field with a given step
 
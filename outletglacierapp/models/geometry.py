@@ -407,14 +407,23 @@ class Line(object):
 
         return seg.draw_orthogonal(pt)
 
-    def resample(self, dx = None, n = None, nmax=None, verbose=False):
+    def resample(self, dx = None, n = None, nmax=None, s = None, verbose=False):
         """ resample a line with a particular grid step
+
+        dx : regular grid step
+        n : number of equally-spaced points
+        nmax : max number of points if dx is provided
+        s : explicit curvilinear coordinates of the new points (variable grid step)
         """
         pts = []
-        assert dx is not None or n is not None, "must provide either n or dx to reample a line"
+        assert dx is not None or n is not None or s is not None, "must provide either n, dx or s to reample a line"
+
+        # explicit along-line positions
+        if s is not None:
+            xx = np.asarray(s)
 
         # subdivide to maintain a given grid step
-        if dx is not None:
+        elif dx is not None:
             xx = np.arange(0,self.length(), dx)
 
             # if too many grid points, use a criterion based on max point number instead
@@ -422,7 +431,7 @@ class Line(object):
                 n = nmax
 
         # subdivide in a number of equally-spaced segments
-        if n is not None:
+        if n is not None and s is None:
             xx = np.linspace(0, self.length(), n) 
 
         for x in xx:
@@ -7,11 +7,12 @@ def massbalance_diag(glacier1d):
     to analyze the glacier equilibrium
     """
     # cumulative surface mass balance in m^3/s over whole catchment basin
-    dx = glacier1d.x[1]-glacier1d.x[0]
+    # (along-flow step may vary along the glacier)
+    dx = np.gradient(glacier1d.x)
     W = glacier1d['W']
     H = glacier1d['H']
     A = H*W # section area
-    smb_cum = glacier1d['smb'].cumsum()*W*dx
+    smb_cum = (glacier1d['smb']*dx).cumsum()*W
     smb_cum.units = 'meters^3 / second'
 
     glacier1d_diag = glacier1d.copy() # shallow copy
@@ -6,6 +6,7 @@ with a selection of :
         Box and Decker (2011) pre-defined glaciers
 """
 from __future__ import absolute_import
+import os
 import sys
 import hashlib
 import time
@@ -27,17 +28,66 @@ from icedata.common import transform_bbox
 # glacier regions
 from .outlet_glacier_region import get_region
 from . import boxdecker2011 as bd
+from .rastercache import cached
+from .helper import memoize
+from .store import stored, file_identity
 
 MAPPING = icedata.greenland.bamber2013.GRID_MAPPING
 CRS = get_crs(MAPPING) # coordinate system 
 
 def get_coords(nm):
     """ get coordinates of a glacier as left, right, bottom, top in km
+    (see outlet_glacier_region.RegionRegistry)
     """
     reg = get_region(nm)
     l,b,r,t = [round(c*1e-3) for c in reg]
     return l,r,b,t
 
+def _resolve_variable(variable, dataset):
+    """ icedata dataset (module) and variable names from the names used in the app
+    """
+    mapv = {
+        'bedrock': 'bedrock_elevation',
+        'surface': 'surface_elevation',
+        'bottom': 'bottom_elevation',
+        'velocity_mag': 'surface_velocity',
+        'thickness': 'ice_thickness',
+    }
+    if dataset == 'standard_dataset': dataset = "presentday"
+    if dataset == 'bamber2001': dataset = "presentday"
+    if dataset == 'joughin2010': dataset = "presentday"
+
+    if variable in mapv.keys():
+        variable = mapv[variable]
+
+    return dataset, variable
+
+def _dataset_files(mod):
+    """ source files of an icedata module: get_file() if the module defines it,
+    else its module-level file names (e.g. NCFILE), existing files only
+    """
+    try:
+        paths = [mod.get_file()]
+    except (AttributeError, TypeError):
+        paths = [getattr(mod, nm) for nm in sorted(dir(mod)) if nm.isupper() and nm.endswith('FILE')]
+    return [path for path in paths if isinstance(path, basestring) and os.path.isfile(path)]
+
+def dataset_identity(dataset):
+    """ identity of a dataset's source files (see store.file_identity), 
+    so that stored results are recomputed if the data changes
+
+    If no source file can be found for the dataset (module without get_file
+    or file name attribute), only the module name is returned: stored results
+    are then not invalidated by a change in the data, but only by a change
+    in the code (see store.code_version).
+    """
+    modname, _ = _resolve_variable(None, dataset)
+    mod = getattr(icedata.greenland, modname)
+    try:
+        return [modname] + [file_identity(path) for path in _dataset_files(mod)]
+    except OSError:
+        return [modname]
+
 def _load_data(coords, variable, dataset, maxshape=None, project_on_bamber=True):
     """ load data to be plotted, for a particular glacier 
     and a particular region
@@ -54,48 +104,96 @@ def _load_data(coords, variable, dataset, maxshape=None, project_on_bamber=True)
     -------
     DimArray instance
     """
-    mapv = {
-        'bedrock': 'bedrock_elevation',
-        'surface': 'surface_elevation',
-        'bottom': 'bottom_elevation',
-        'velocity_mag': 'surface_velocity',
-        'thickness': 'ice_thickness',
-    }
-    if dataset == 'standard_dataset': dataset = "presentday"
-    if dataset == 'bamber2001': dataset = "presentday"
-    if dataset == 'joughin2010': dataset = "presentday"
+    ds = _load_dataset(coords, {variable: (variable, dataset)}, maxshape=maxshape, 
+                       project_on_bamber=project_on_bamber)
+    return ds[variable]
 
-    if variable in mapv.keys():
-        oldv = variable
-        variable = mapv[variable]
+def _load_dataset(coords, variables, maxshape=None, project_on_bamber=True):
+    """ load several variables for a particular region, reading each file only once
 
+    Requested variables are grouped by source dataset, and each group
+    is read in one go (the bounding box is transformed once per dataset).
+
+    Parameter
+    ---------
+    coords : coordinate box in km (left, right, bottom, up)
+        in the coordinate system from STANDARD_DATASET
+    variables : dict of {name: (variable, dataset)}, with variable and dataset 
+        as in _load_data. Datasets must end up on the same grid (e.g. after 
+        projection on Bamber's grid, or from the same source file), otherwise 
+        use separate calls.
+    maxshape : maximum shape of laoded data (sub-sampling when loading to save time)
+    project_on_bamber : if True (default), data is reprojected onto Bamber et al 2013's
+        grid. If False, data is returned on its own grid, and coords must be 
+        provided in the dataset's own coordinate system.
+
+    Returns
+    -------
+    Dataset instance, whose keys are the names in variables
+    """
     bbox = np.asarray(coords)*1000 # back to meters
 
-    mod = getattr(icedata.greenland, dataset)
+    # group variables by source file
+    groups = {}
+    for name in sorted(variables.keys()):
+        modname, variable = _resolve_variable(*variables[name])
+        groups.setdefault(modname, []).append((name, variable))
+
+    dataset = da.Dataset()
+
+    for modname in sorted(groups.keys()):
+        mod = getattr(icedata.greenland, modname)
 
-    data_bbox = bbox
-    if project_on_bamber:
+        # transform the bounding box once per dataset
+        data_bbox = bbox
         crsSource = mod.GRID_MAPPING
         crsTarget = icedata.greenland.bamber2013.GRID_MAPPING
-        if crsSource != crsTarget:
+        project = project_on_bamber and crsSource != crsTarget # otherwise already the right CRS
+        if project:
             data_bbox = transform_bbox(bbox, crsTarget, crsSource)
-        else:
-            project_on_bamber = False  # already the right CRS
 
-    dima = mod.load(variable, bbox=data_bbox, maxshape=maxshape)
+        # read all variables from that file at once (each only once)
+        names = sorted(set(variable for name, variable in groups[modname]))
+        ds = mod.load(names, bbox=data_bbox, maxshape=maxshape)
 
-    if project_on_bamber:
-        dima = transform_dima(dima, from_crs=crsSource, to_crs=crsTarget)
+        projected = {}
+        for name, variable in groups[modname]:
+            dima = ds[variable]
 
-        # crop to required coordinate system...
-        dima = dima.ix[(dima.y >= bbox[2]) & 
-                       (dima.y <= bbox[3]),  
-                       (dima.x >= bbox[0]) & 
-                       (dima.x <= bbox[1])  
-                       ]
+            if project and variable in projected:
+                dima = projected[variable]
 
-    return dima 
+            elif project:
+                dima = transform_dima(dima, from_crs=crsSource, to_crs=crsTarget)
 
+                # crop to required coordinate system...
+                dima = dima.ix[(dima.y >= bbox[2]) & 
+                               (dima.y <= bbox[3]),  
+                               (dima.x >= bbox[0]) & 
+                               (dima.x <= bbox[1])  
+                               ]
+                projected[variable] = dima
+
+            dataset[name] = dima
+
+    return dataset
+
+
+# map windows recently served by this process
+MAP_WINDOWS_MAXSIZE = 50
+MAP_WINDOWS_MAXBYTES = 256*1024**2
+
+@memoize(maxsize=MAP_WINDOWS_MAXSIZE, maxbytes=MAP_WINDOWS_MAXBYTES)
+def _load_map_window(variable, dataset, coords, maxshape):
+    """ map data, shared between server processes (see rastercache), and kept in 
+    this process for repeated requests (e.g. several users on the same glacier).
+    Reprojected windows are also kept on disk across restarts (see store).
+    """
+    identity = dataset_identity(dataset) # the shared cache survives restarts
+    key = ('mapdata', variable, dataset, coords, maxshape, repr(identity))
+    inputs = [variable, dataset, coords, maxshape, identity]
+    return cached(key, lambda : stored('mapdata', inputs, 
+                                       lambda : _load_data(coords, variable, dataset, maxshape=maxshape)))
 
 def get_dict_data(variable, dataset, coords, zoom=300e3, maxshape=(200,200)):
     """ read data and return it as json format for the javascript plotting
@@ -104,8 +202,7 @@ def get_dict_data(variable, dataset, coords, zoom=300e3, maxshape=(200,200)):
     #coords = get_region(glacier, zoom)
     #session['coords'] = [float(c) for c in coords]
 
-    # load data
-    dim_a = _load_data(coords, variable, dataset, maxshape=maxshape)
+    dim_a = _load_map_window(variable, dataset, tuple(float(c) for c in coords), maxshape)
 
     if True:
         # subsample data to ease plotting?
@@ -144,7 +241,7 @@ def get_dict_data(variable, dataset, coords, zoom=300e3, maxshape=(200,200)):
     # numpy type not understood by json
     x = np.asarray(x, dtype=float)
     y = np.asarray(y, dtype=float)
-    z = np.asarray(z, dtype=float)
+    z = np.array(z, dtype=float) # copy: filled in below, and dim_a may be cached
 
     # replace missing values with a flag
     missing = -99.99 # missing data
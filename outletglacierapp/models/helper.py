@@ -1,27 +1,260 @@
 """ helper functions
 """
+import os
+import sys
+import time
+import errno
+import fcntl
+import inspect
 import hashlib
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict
+import numpy as np
+
+class LRUCache(object):
+    """ Thread-safe mapping which keeps the most recently used items, within bounds
+
+    Parameters
+    ----------
+    maxsize : max number of items (None for no limit)
+    maxbytes : max total size of the items (bytes, None for no limit), see nbytes
+    ttl : items are dropped that long (s) after they were stored (None to keep them)
+    sizeof : function returning the size of an item (bytes), nbytes by default
+    """
+    def __init__(self, maxsize=128, maxbytes=None, ttl=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.sizeof = sizeof or nbytes
+        self.data = OrderedDict() # key: value, least recently used first
+        self._meta = {} # key: (time stored, size)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.stats = dict(hits=0, misses=0, evictions=0, expired=0)
+
+    def get(self, key, default=None):
+        """ value stored under key (marked as most recently used), or default
+        """
+        with self._lock:
+            if key in self.data and self.ttl is not None and time.time() - self._meta[key][0] > self.ttl:
+                self._remove(key)
+                self.stats['expired'] += 1
+            if key not in self.data:
+                self.stats['misses'] += 1
+                return default
+            self.stats['hits'] += 1
+            value = self.data.pop(key)
+            self.data[key] = value
+            return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.data and (self.ttl is None or time.time() - self._meta[key][0] <= self.ttl)
+
+    def put(self, key, value):
+        """ store value under key, and evict least recently used items beyond bounds
+        """
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            if key in self.data:
+                self._remove(key)
+            self.data[key] = value
+            self._meta[key] = (time.time(), size)
+            self._bytes += size
+            while self.data and ((self.maxsize is not None and len(self.data) > self.maxsize) \
+                    or (self.maxbytes is not None and self._bytes > self.maxbytes)):
+                self._remove(next(iter(self.data)))
+                self.stats['evictions'] += 1
+
+    def _remove(self, key):
+        del self.data[key]
+        self._bytes -= self._meta.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self.data.clear()
+            self._meta.clear()
+            self._bytes = 0
+
+    def info(self):
+        """ dict of statistics: hits, misses, evictions, expired, size, bytes and bounds
+        """
+        with self._lock:
+            info = dict(self.stats, size=len(self.data), maxsize=self.maxsize, ttl=self.ttl)
+            if self.maxbytes is not None:
+                info.update(bytes=self._bytes, maxbytes=self.maxbytes)
+            return info
+
+def memoize(maxsize=128, maxbytes=None, ttl=None, key=None, sizeof=None):
+    """ decorator to cache the results of a function, per arguments
+
+    Arguments are matched to the function's signature, so that positional
+    and keyword arguments give the same key, and numpy arrays are hashed
+    by content (see make_key). Concurrent calls with the same arguments
+    are computed once: other threads wait for the result (single-flight).
+
+    Parameters
+    ----------
+    maxsize, maxbytes, ttl, sizeof : bounds of the cache (see LRUCache)
+    key : function key(*args, **kwargs) returning a hashable key,
+        for arguments make_key cannot handle (make_key by default)
+
+    Returns
+    -------
+    decorator. The decorated function has attributes cache (LRUCache),
+    cache_info() (statistics, including 'waits', the number of calls which
+    waited for a concurrent computation) and cache_clear().
+
+    Examples
+    --------
+    >>> @memoize(maxsize=10)
+    ... def square(a):
+    ...     return a**2
+    >>> square(np.arange(3))
+    array([0, 1, 4])
+    >>> square.cache_info()['misses']
+    1
+    """
+    def decorator(fun):
+        cache = LRUCache(maxsize=maxsize, maxbytes=maxbytes, ttl=ttl, sizeof=sizeof)
+        make = key or (lambda *args, **kwargs: make_key(fun, args, kwargs))
+        inflight = {} # key: _Flight of the thread computing it
+        lock = threading.Lock()
+        waits = [0]
+        missing = object()
+
+        @wraps(fun)
+        def memoized(*args, **kwargs):
+            k = make(*args, **kwargs)
+            with lock:
+                value = cache.get(k, missing)
+                if value is not missing:
+                    return value
+                flight = inflight.get(k)
+                owner = flight is None
+                if owner:
+                    flight = inflight[k] = _Flight()
+                else:
+                    waits[0] += 1
+            if not owner:
+                flight.done.wait()
+                if flight.error is not None:
+                    raise flight.error
+                return flight.value
+            try:
+                flight.value = fun(*args, **kwargs)
+            except BaseException as error:
+                flight.error = error
+                raise
+            else:
+                cache.put(k, flight.value)
+            finally:
+                with lock:
+                    del inflight[k]
+                flight.done.set()
+            return flight.value
+
+        memoized.cache = cache
+        memoized.DATA = cache.data # access it from outside, as with keepincache
+        memoized.cache_info = lambda : dict(cache.info(), waits=waits[0])
+        memoized.cache_clear = cache.clear
+        return memoized
+    return decorator
+
+class _Flight(object):
+    """ computation in progress, awaited by concurrent calls
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
 
 def keepincache(fun):
-    """ decorator to prevent a function from being called twice with the 
-    same arguments.
+    """ decorator to prevent a function from being called twice with the
+    same arguments (unbounded, see memoize for bounds).
+    """
+    return memoize(maxsize=None)(fun)
+
+def make_key(fun, args, kwargs):
+    """ hashable key for a call fun(*args, **kwargs)
+
+    Arguments are matched to fun's signature (defaults included), and
+    converted by freeze: arrays and array-like objects (e.g. DimArray) are
+    hashed by content, lists and dicts converted to tuples.
     """
-    DATA = {}
-    def get_id_for_dict(dict_):
-        " create a unique id for any dict"
-        unique_str = ''.join(["'%s':'%s';"%(key, val) for (key, val) in sorted(dict_.items())])
-        return hashlib.sha1(unique_str).hexdigest()
+    try:
+        callargs = inspect.getcallargs(fun, *args, **kwargs)
+    except TypeError:
+        callargs = {'args': args, 'kwargs': kwargs} # let fun raise the error
+    return freeze(callargs)
 
-    def fun2(*args, **kwargs):
-        loc = locals()
-        id_ = get_id_for_dict(loc)
-        if id_ not in DATA:
-            res = fun(*args, **kwargs)
-            DATA[id_] = res
-            # print "result:",res
-        return DATA[id_]
+def freeze(obj):
+    """ hashable version of obj (see make_key)
+    """
+    if isinstance(obj, np.ndarray):
+        return ('ndarray', array_hash(obj))
+    if isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    if isinstance(getattr(obj, 'values', None), np.ndarray) and hasattr(obj, 'axes'):
+        # DimArray: values and axes
+        return (type(obj).__name__, array_hash(obj.values, *[ax.values for ax in obj.axes]), tuple(obj.dims))
+    if isinstance(obj, np.generic):
+        return obj.item()
+    hash(obj) # raise TypeError if not hashable
+    return obj
+
+def nbytes(obj):
+    """ approximate memory size of arrays, DimArrays, Datasets and containers thereof (bytes)
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(v) for v in obj)
+    values = getattr(obj, 'values', None)
+    if isinstance(values, np.ndarray):
+        return values.nbytes + sum(nbytes(ax.values) for ax in getattr(obj, 'axes', []))
+    if hasattr(obj, '__dict__'):
+        # e.g. interpolators: count their array attributes
+        return sys.getsizeof(obj) + sum(v.nbytes for v in vars(obj).values() if isinstance(v, np.ndarray))
+    return sys.getsizeof(obj)
 
-    fun2.DATA = DATA # access it from outside
+def array_hash(*arrays):
+    """ unique id for a sequence of arrays, based on their content, shape and type
+    """
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(repr((a.dtype.str, a.shape)).encode('utf-8'))
+        h.update(a.view(np.uint8))
+    return h.hexdigest()
 
-    return fun2
+@contextmanager
+def flock(lockfile, shared=False, blocking=True):
+    """ hold an advisory lock on a file (created if needed), exclusive unless shared
 
+    With blocking=False, IOError (EAGAIN or EACCES) is raised if the lock is taken.
+    """
+    with open(lockfile, 'a') as f:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        fcntl.flock(f, flags)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def makedirs(directory):
+    """ create a directory and its parents, if they do not exist yet
+    """
+    try:
+        os.makedirs(directory)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
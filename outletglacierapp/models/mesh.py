@@ -3,19 +3,22 @@
 """
 from __future__ import division, print_function
 
-import os, sys, copy, warnings
+import os, sys, copy, warnings, json
 import datetime
 
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.path import Path
 
 import dimarray.geo as da
-from dimarray.compat.basemap import interp
 from dimarray.geo.crs import get_crs, LatitudeLongitude
 
 # local module to create the mesh
 from geometry import Line, Segment, prolonge_line, Point
-from greenmap import _load_data, MAPPING
+import icedata.greenland
+from greenmap import _load_data, _load_dataset, _resolve_variable, MAPPING, dataset_identity
+from helper import array_hash, memoize, LRUCache
+from store import get_store, store_key
 
 # # load greenland data
 # from greenland_data.standard_dataset import MAPPING
@@ -28,11 +31,116 @@ TODAY = datetime.date.today().strftime("%Y%m%d")
 AUTHOR = "mahe.perrette@pik-potsdam.de"
 WORK = 'work' # work directory
 
-def make_2d_grid_from_contours(middle, left, right, dx, ny):
+# fields which may be used to refine the along-flow mesh spacing: 
+# variable and dataset as understood by greenmap's _load_data
+REFINE = {
+    'velocity': ('velocity_mag', 'rignot_mouginot2012'),
+    'thickness': ('thickness', 'bamber2013'),
+}
+
+def along_flow_positions(length, dx, dxmin=None, dxmax=None):
+    """ Along-flow distances of the cross-sections on the middle line
+
+    Parameters
+    ----------
+    length : length of the middle line (m)
+    dx : along-flow step (m), or a function of along-flow distance 
+        which returns the local step
+    dxmin, dxmax : bounds for the local step, optional
+
+    Returns
+    -------
+    s : 1-D array of along-flow distances, starting from 0.
+    """
+    if not callable(dx):
+        return np.arange(0, length, dx)
+
+    s = [0.]
+    while True:
+        step = dx(s[-1])
+        if dxmin is not None: step = max(step, dxmin)
+        if dxmax is not None: step = min(step, dxmax)
+        if not step > 0:
+            raise ValueError("along-flow step must be positive, got {} at {:.0f} km".format(step, s[-1]*1e-3))
+        if s[-1] + step >= length:
+            break
+        s.append(s[-1] + step)
+
+    return np.array(s)
+
+def spacing_from_gradient(middle, xin, yin, values, dxmin, dxmax, ds=None):
+    """ Derive a variable along-flow step from the gradient of a field along the middle line
+
+    The step is dxmin where the along-flow gradient of the field is the largest,
+    dxmax where it vanishes, and varies linearly with gradient magnitude in between.
+    The step at a given position is the smallest one found within dxmax downstream,
+    so that refinement starts before the high-gradient region is reached.
+
+    Parameters
+    ----------
+    middle : Line instance (middle line)
+    xin, yin : 1-D coordinates of the field (increasing)
+    values : 2-D field (e.g. velocity magnitude or thickness), first dimension is y
+    dxmin, dxmax : min and max along-flow step (m)
+    ds : sampling step along the middle line, by default dxmin
+
+    Returns
+    -------
+    dx : function of along-flow distance, to be passed to make_2d_grid_from_contours
+    """
+    if ds is None: ds = dxmin
+    line = middle.resample(dx=ds)
+    x, y = line.array()
+    z = InterpWeights(xin, yin, x, y)(values)
+    s = np.asarray(line.s)
+
+    # normalized gradient magnitude, robust to a few outliers
+    grad = np.abs(np.gradient(z, ds))
+    valid = np.isfinite(grad)
+    if not np.any(valid):
+        warnings.warn("no valid data along the middle line, use dxmax")
+        return lambda x: dxmax
+    gmax = np.percentile(grad[valid], 95)
+    grad[~valid] = 0.
+    ratio = np.clip(grad / gmax, 0, 1) if gmax > 0 else np.zeros_like(grad)
+    steps = dxmax - (dxmax - dxmin)*ratio
+
+    def dx(x):
+        window = (s >= x) & (s <= x + dxmax)
+        if not np.any(window):
+            return dxmax
+        return steps[window].min()
+
+    return dx
+
+def refine_spacing(middle, field, dxmin, dxmax, dataset=None):
+    """ Along-flow step function from velocity or thickness gradients
+
+    Parameters
+    ----------
+    middle : Line instance (middle line)
+    field : "velocity" or "thickness" (see REFINE)
+    dxmin, dxmax : min and max along-flow step (m)
+    dataset : data source, by default as indicated in REFINE
+
+    Returns
+    -------
+    dx : function of along-flow distance (see spacing_from_gradient)
+    """
+    variable, default = REFINE[field]
+    if dataset is None: dataset = default
+    x, y = middle.array()
+    m = 10e3 # margin (m)
+    coords = [(x.min()-m)*1e-3, (x.max()+m)*1e-3, (y.min()-m)*1e-3, (y.max()+m)*1e-3]
+    data = _load_data(coords, variable, dataset)
+    return spacing_from_gradient(middle, data.axes[1].values, data.axes[0].values, data.values, dxmin, dxmax)
+
+def make_2d_grid_from_contours(middle, left, right, dx, ny, dxmin=None, dxmax=None, progress=None):
     """ Transform glacier contours (middle line and side walls) into a 2-D grid
     
-    The middle line is used as guide to draw regularly-spaced orthogonal 
-    cross-sections, whose intersections with the walls delimit the end points.
+    The middle line is used as guide to draw orthogonal cross-sections, 
+    regularly-spaced or with a variable spacing, whose intersections with 
+    the walls delimit the end points.
     The segment defined by the two end points is then resampled with a
     regular interval.
 
@@ -42,8 +150,12 @@ def make_2d_grid_from_contours(middle, left, right, dx, ny):
         This delimits the glacier domain.
     xdata : 2-D array of x-coordinates (lon.)
     ydata : 2-D array of y-coordinates (lat.)
-    dx : along-flow step on the middle-line
+    dx : along-flow step on the middle-line, or function of along-flow 
+        distance returning the local step (see spacing_from_gradient)
     ny : number of cross-flow points
+    dxmin, dxmax : bounds for the along-flow step, if dx is a function
+    progress : function progress(fraction, message), optional
+        called for each cross-section (e.g. background jobs, see jobs.py)
 
     Returns
     -------
@@ -65,7 +177,8 @@ def make_2d_grid_from_contours(middle, left, right, dx, ny):
     assert right.is_valid()
 
     # Resample middle line with appropriate spacing
-    midline = middle.resample(dx=dx, verbose=True) # resample middle line
+    s = along_flow_positions(middle.length(), dx, dxmin, dxmax)
+    midline = middle.resample(s=s, verbose=True) # resample middle line
     s = midline.s
     pts = midline.pts
 
@@ -81,6 +194,7 @@ def make_2d_grid_from_contours(middle, left, right, dx, ny):
     #for i, pt in enumerate(pts):
     for i, pt in enumerate(pts):
         print( '\rDiscretize: slice {} / {}'.format(i, len(pts)),)
+        if progress: progress(i/float(nx), 'cross-section {} / {}'.format(i, nx))
 
         # determine a local segment to draw an orthogonal line from
         if i == 0:
@@ -131,9 +245,91 @@ def make_2d_grid_from_contours(middle, left, right, dx, ny):
     return glacier_grid
 
 
+class InterpWeights(object):
+    """ Bilinear interpolation from a regular grid onto arbitrary points
+
+    Same algorithm as basemap's interp (order=1, no bounds check: outside
+    points are extrapolated), but indices and weights are computed once
+    and can be applied to any number of fields defined on the same grid.
+
+    Parameters
+    ----------
+    xin, yin : 1-D coordinates of the source grid (increasing)
+    xout, yout : coordinates of the points to interpolate on (any shape)
+    """
+    def __init__(self, xin, yin, xout, yout):
+        xin = np.asarray(xin, dtype=float)
+        yin = np.asarray(yin, dtype=float)
+        xout = np.asarray(xout, dtype=float)
+        yout = np.asarray(yout, dtype=float)
+        if xin[-1]-xin[0] < 0 or yin[-1]-yin[0] < 0:
+            raise ValueError('xin and yin must be increasing!')
+        if xout.shape != yout.shape:
+            raise ValueError('xout and yout must have same shape!')
+
+        nx, ny = len(xin), len(yin)
+        regular = self._is_regular(xin) and self._is_regular(yin)
+        xc = self._fractional_index(xin, xout.ravel(), regular)
+        yc = self._fractional_index(yin, yout.ravel(), regular)
+
+        xi = np.clip(xc.astype(np.int32), 0, nx-1)
+        yi = np.clip(yc.astype(np.int32), 0, ny-1)
+        xip1 = np.clip(xc.astype(np.int32)+1, 0, nx-1)
+        yip1 = np.clip(yc.astype(np.int32)+1, 0, ny-1)
+        delx = xc - xi
+        dely = yc - yi
+
+        # flat indices and weights of the four neighbours, shape (4, npoints)
+        self.indices = np.array([yi*nx + xi, yi*nx + xip1, yip1*nx + xi, yip1*nx + xip1])
+        self.weights = np.array([(1.-delx)*(1.-dely), delx*(1.-dely), (1.-delx)*dely, delx*dely])
+        self.shape_in = (ny, nx)
+        self.shape_out = xout.shape
+
+    @staticmethod
+    def _is_regular(xin):
+        delx = np.diff(xin)
+        return len(delx) == 0 or delx.max() - delx.min() < 1.e-4
+
+    @staticmethod
+    def _fractional_index(xin, xout, regular):
+        """ fractional index of xout in xin, like basemap's interp
+        """
+        if len(xin) < 2:
+            return np.zeros_like(xout)
+        if regular:
+            return (len(xin)-1)*(xout-xin[0])/(xin[-1]-xin[0])
+        i = np.searchsorted(xin, xout) - 1
+        ii = np.clip(i, 0, len(xin)-2)
+        coords = ii + (xout - xin[ii])/(xin[ii+1] - xin[ii])
+        coords[i < 0] = -1 # outside of range (lower end)
+        coords[i >= len(xin)-1] = len(xin) # outside of range (upper end)
+        return coords
+
+    def __call__(self, values):
+        """ interpolate values of shape (ny, nx) or stacked as (nvar, ny, nx)
+        """
+        values = np.asarray(values)
+        if values.shape[-2:] != self.shape_in:
+            raise ValueError("expected data of shape {}, got {}".format(self.shape_in, values.shape[-2:]))
+        flat = values.reshape(values.shape[:-2]+(-1,))
+        out = (flat[..., self.indices] * self.weights).sum(axis=-2)
+        return out.reshape(values.shape[:-2]+self.shape_out)
+
+# interpolation weights, per (mesh, source grid) pair
+INTERP_WEIGHTS_MAXSIZE = 20
+
+@memoize(maxsize=INTERP_WEIGHTS_MAXSIZE)
+def get_interp_weights(xin, yin, xout, yout):
+    """ Return cached InterpWeights for a (source grid, mesh) pair
+    """
+    return InterpWeights(xin, yin, xout, yout)
+
 def interpolate_data_on_glacier_grid(dataset, glacier2d):
     """ Interpolate all useful data 
 
+    Interpolation weights are computed once for all variables, 
+    and re-used for later calls on the same mesh and source grid.
+
     Parameters
     ----------
     dataset : dimarray.Dataset instance containing data
@@ -157,8 +353,11 @@ def interpolate_data_on_glacier_grid(dataset, glacier2d):
     xin = dataset.axes[1].values
     yin = dataset.axes[0].values
 
-    for nm in dataset.keys():
-        tmp = interp(dataset[nm].values, xin, yin, xout, yout)
+    names = dataset.keys()
+    weights = get_interp_weights(xin, yin, xout, yout)
+    stacked = weights(np.array([dataset[nm].values for nm in names], dtype=float))
+
+    for nm, tmp in zip(names, stacked):
         glacier2d[nm] = da.DimArray(tmp, glacier2d.axes)
         glacier2d[nm]._metadata(dataset[nm]._metadata()) # copy metadata
 
@@ -168,6 +367,82 @@ def interpolate_data_on_glacier_grid(dataset, glacier2d):
 
     return glacier2d
 
+def interpolate_tiled(load, bbox, glacier2d, tilesize=None, halo=2e3, progress=None):
+    """ Interpolate data onto the glacier grid, loading the bounding box tile by tile
+
+    Each tile is loaded (with a halo), only the mesh nodes falling into it
+    are interpolated, and the tile is released before loading the next one:
+    peak memory is bounded by the tile size rather than by the glacier size.
+
+    Parameters
+    ----------
+    load : function load(bbox) returning a Dataset of 2-D data, 
+        with bbox as [left, right, bottom, top] in meters, in the 
+        same coordinate system as glacier2d
+    bbox : [left, right, bottom, top] in meters, enclosing the glacier grid
+    glacier2d : dimarray.Dataset
+        contains at least x_coord and y_coord variables on which to interpolate
+    tilesize : tile side (m), by default the whole bounding box is loaded at once
+    halo : margin (m) loaded around each tile, should be larger than 
+        the data resolution (only used with tilesize)
+    progress : function progress(fraction, message), optional, called for each tile
+
+    Returns
+    -------
+    glacier2d : Dataset instance
+        glacier2d augmented with interpolated data
+    """
+    l, r, b, t = bbox
+    if tilesize is None:
+        return interpolate_data_on_glacier_grid(load([l, r, b, t]), glacier2d)
+
+    xout = glacier2d['x_coord'].values
+    yout = glacier2d['y_coord'].values
+
+    # tile index of each mesh node
+    nx = max(1, int(np.ceil((r - l) / tilesize)))
+    ny = max(1, int(np.ceil((t - b) / tilesize)))
+    ix = np.clip(np.floor((xout - l) / tilesize).astype(int), 0, nx-1)
+    iy = np.clip(np.floor((yout - b) / tilesize).astype(int), 0, ny-1)
+
+    results = {}
+    metadata = {}
+    for i in range(nx):
+        for j in range(ny):
+            inside = (ix == i) & (iy == j)
+            if not np.any(inside):
+                continue
+            if progress: progress((i*ny + j)/float(nx*ny), 'tile {} / {}'.format(i*ny + j + 1, nx*ny))
+            x0, y0 = l + i*tilesize, b + j*tilesize
+            tile = load([x0 - halo, x0 + tilesize + halo, y0 - halo, y0 + tilesize + halo])
+            names = tile.keys()
+            weights = get_interp_weights(tile.axes[1].values, tile.axes[0].values, xout[inside], yout[inside])
+            stacked = weights(np.array([tile[nm].values for nm in names], dtype=float))
+            for nm, values in zip(names, stacked):
+                if nm not in results:
+                    results[nm] = np.empty(xout.shape)
+                    results[nm].fill(np.nan)
+                    metadata[nm] = tile[nm]._metadata()
+                results[nm][inside] = values
+            del tile, stacked
+
+    for nm in results:
+        glacier2d[nm] = da.DimArray(results[nm], glacier2d.axes)
+        glacier2d[nm]._metadata(metadata[nm]) # copy metadata
+
+    glacier2d.description = "Greenland data interpolated onto the glacier domain"
+    glacier2d.author = AUTHOR
+    glacier2d.creation_date = TODAY
+
+    return glacier2d
+
+def _subprogress(progress, start, stop, prefix=''):
+    """ progress function of a stage spanning [start, stop] of the whole progress (None if progress is None)
+    """
+    if progress is None:
+        return None
+    return lambda fraction, message='': progress(start + (stop - start)*fraction, prefix + message)
+
 def glacier_crossflow_average(glacier2d, skipna=False):
     """ Average 2-D glacier data into a flowline glacier
 
@@ -207,9 +482,9 @@ def glacier_crossflow_average(glacier2d, skipna=False):
     # add lon/lat info based on back-transformed x_coord, y_coord
     # from cartopy.crs import PlateCarree
     CRS = get_crs(MAPPING)
-    pts_xyz = LatitudeLongitude().transform_points(CRS, glacier1d['x_coord'].values, glacier1d['y_coord'].values)
-    glacier1d['lon'] = da.DimArray(pts_xyz[...,0], glacier1d.axes)
-    glacier1d['lat'] = da.DimArray(pts_xyz[...,1], glacier1d.axes)
+    lon, lat = transform_points(LatitudeLongitude(), CRS, glacier1d['x_coord'].values, glacier1d['y_coord'].values)
+    glacier1d['lon'] = da.DimArray(lon, glacier1d.axes)
+    glacier1d['lat'] = da.DimArray(lat, glacier1d.axes)
 
     glacier1d.author = "mahe.perrette@pik-potsdam.de"
     glacier1d.creation_date = TODAY
@@ -217,6 +492,258 @@ def glacier_crossflow_average(glacier2d, skipna=False):
 
     return glacier1d
 
+def interpolate_fields(glacier2d, fields, maxshape=None, prepare=None, halo=0, progress=None):
+    """ Load fields from their source datasets and interpolate them onto the glacier grid
+
+    Data is never reprojected from one grid to another. For datasets defined 
+    in another coordinate system, the mesh points are transformed instead 
+    (see _prepare_load_prj), and data is interpolated in the dataset's own 
+    coordinate system. Each dataset is read once (see _load_dataset).
+
+    Parameters
+    ----------
+    glacier2d : Dataset with x_coord and y_coord, in MAPPING coordinate system
+    fields : dict {name: (variable, dataset)}, as in _load_dataset
+    maxshape : maximum shape of loaded data
+    prepare : function prepare(dataset) to modify loaded data in place 
+        prior to interpolation (e.g. fill NaNs, convert units), optional
+    halo : margin (m) to load around the glacier bounding box (e.g. for smoothing)
+    progress : function progress(fraction, message), optional, called when 
+        loading and interpolating each dataset
+
+    Returns
+    -------
+    glacier2d : Dataset instance
+        glacier2d augmented with the interpolated fields
+    """
+    groups = {}
+    for nm in fields:
+        modname = _resolve_variable(*fields[nm])[0]
+        groups.setdefault(modname, {})[nm] = fields[nm]
+
+    for k, modname in enumerate(sorted(groups.keys())):
+        mod = getattr(icedata.greenland, modname)
+        if progress: progress(k/float(len(groups)), 'load '+modname)
+
+        if mod.GRID_MAPPING == MAPPING:
+            coords = np.array(_get_glacier_bbox(glacier2d)) + np.array([-1, 1, -1, 1])*halo*1e-3
+            ds = _load_dataset(coords, groups[modname], maxshape=maxshape)
+            if prepare: prepare(ds)
+            if progress: progress((k+.5)/len(groups), 'interpolate '+modname)
+            interpolate_data_on_glacier_grid(ds, glacier2d)
+            continue
+
+        # transform the mesh onto the dataset's grid
+        glacier2d_prj, coords_prj = _prepare_load_prj(glacier2d, get_crs(mod.GRID_MAPPING), get_crs(MAPPING))
+        coords_prj = np.array(coords_prj) + np.array([-1, 1, -1, 1])*halo*1e-3
+        ds = _load_dataset(coords_prj, groups[modname], maxshape=maxshape, project_on_bamber=False)
+        if prepare: prepare(ds)
+        if progress: progress((k+.5)/len(groups), 'interpolate '+modname)
+        interpolate_data_on_glacier_grid(ds, glacier2d_prj)
+        for nm in groups[modname]:
+            glacier2d[nm] = da.DimArray(glacier2d_prj[nm].values, axes=glacier2d.axes) # just keep the values
+            glacier2d[nm]._metadata(glacier2d_prj[nm]._metadata())
+
+    return glacier2d
+
+def _rasterize_strips(x2d, y2d, xin, yin):
+    """ Label source pixels with the index of the mesh strip their centre falls into
+
+    Strip i extends from half-way between sections i-1 and i to half-way 
+    between sections i and i+1 (the first and last strips stop at the 
+    first and last sections). 
+
+    Parameters
+    ----------
+    x2d, y2d : 2-D mesh coordinates (along-flow, cross-flow)
+    xin, yin : 1-D source grid coordinates (increasing)
+
+    Returns
+    -------
+    labels : integer array of shape (len(yin), len(xin)), -1 outside the mesh
+    """
+    labels = np.empty((len(yin), len(xin)), dtype=int)
+    labels.fill(-1)
+
+    # strip boundaries, shape (nx+1, ny)
+    bx = np.concatenate([x2d[:1], 0.5*(x2d[1:]+x2d[:-1]), x2d[-1:]])
+    by = np.concatenate([y2d[:1], 0.5*(y2d[1:]+y2d[:-1]), y2d[-1:]])
+
+    for i in range(x2d.shape[0]):
+        px = np.concatenate([bx[i], bx[i+1][::-1]])
+        py = np.concatenate([by[i], by[i+1][::-1]])
+
+        # only test pixels within the strip's bounding box
+        j0, j1 = np.searchsorted(xin, px.min()), np.searchsorted(xin, px.max(), side='right')
+        k0, k1 = np.searchsorted(yin, py.min()), np.searchsorted(yin, py.max(), side='right')
+        if j0 >= j1 or k0 >= k1:
+            continue
+        xx, yy = np.meshgrid(xin[j0:j1], yin[k0:k1])
+        inside = Path(np.array([px, py]).T).contains_points(np.array([xx.ravel(), yy.ravel()]).T)
+        inside = inside.reshape(xx.shape)
+
+        # pixels on a shared boundary belong to the first strip
+        sub = labels[k0:k1, j0:j1]
+        sub[inside & (sub == -1)] = i
+
+    return labels
+
+def zonal_statistics(glacier_grid, dataset, skipna=False):
+    """ Average source data along each cross-section from all source pixels
+
+    Alternative to interpolate_data_on_glacier_grid + glacier_crossflow_average.
+    Each section is represented by the mesh strip around it (see _rasterize_strips),
+    and all source pixels falling into the strip contribute to an area-weighted 
+    mean. Pixels are rasterized once, and statistics for all sections and variables 
+    are computed in one vectorized pass: the cost depends on the number of source
+    pixels, not on the number of cross-flow points.
+
+    Parameters
+    ----------
+    glacier_grid : Dataset with x_coord and y_coord, in the same coordinate system as dataset
+    dataset : Dataset of 2-D source data (first dimension y, second x)
+    skipna : if False (default), any NaN pixel within a strip makes its mean NaN
+
+    Returns
+    -------
+    stats : Dataset along the first mesh axis, with area-weighted means of
+        all variables in dataset, the number of source pixels per section 
+        ('npixels'), and the fraction of NaN pixels per variable ('<name>_nanfrac')
+    """
+    x2d = glacier_grid['x_coord'].values
+    y2d = glacier_grid['y_coord'].values
+    xin = dataset.axes[1].values
+    yin = dataset.axes[0].values
+    n = x2d.shape[0]
+
+    labels = _rasterize_strips(x2d, y2d, xin, yin)
+    inside = labels >= 0
+    lab = labels[inside]
+
+    # pixel area
+    area = np.abs(np.gradient(yin))[:, None] * np.abs(np.gradient(xin))[None, :]
+    area = area[inside]
+
+    names = dataset.keys()
+    values = np.array([dataset[nm].values[inside] for nm in names], dtype=float) # (nvar, npixels)
+    isnan = np.isnan(values)
+    values[isnan] = 0.
+
+    # one bincount for all variables and sections
+    nvar = len(names)
+    index = (np.arange(nvar)[:, None]*n + lab[None, :]).ravel()
+    def _sum(weights):
+        return np.bincount(index, weights=weights.ravel(), minlength=nvar*n).reshape(nvar, n)
+    valid_area = _sum(np.where(isnan, 0., area[None, :]))
+    weighted_sum = _sum(values * area[None, :])
+    nancount = _sum(isnan.astype(float))
+    npixels = np.bincount(lab, minlength=n)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = weighted_sum / valid_area
+        nanfrac = nancount / npixels[None, :]
+    if not skipna:
+        means[nancount > 0] = np.nan
+
+    if np.any(npixels == 0):
+        warnings.warn("{} sections do not contain any source pixel".format(np.sum(npixels == 0)))
+
+    axes = [glacier_grid.axes[0]]
+    stats = da.Dataset()
+    for k, nm in enumerate(names):
+        stats[nm] = da.DimArray(means[k], axes)
+        stats[nm]._metadata(dataset[nm]._metadata())
+        stats[nm+'_nanfrac'] = da.DimArray(nanfrac[k], axes)
+        stats[nm+'_nanfrac'].long_name = "fraction of NaN source pixels for "+nm
+    stats['npixels'] = da.DimArray(npixels, axes)
+    stats['npixels'].long_name = "number of source pixels in the section"
+
+    return stats
+
+#
+# Smoothing
+#
+SMOOTH_TRUNCATE = 4. # Gaussian kernels are truncated at that many standard deviations
+SMOOTH_FFT_SIGMA = 30. # grid cells, use FFT convolution for larger kernels
+
+def _gaussian_filter1d(values, sigma, axis):
+    """ Gaussian filter along one axis, with zero padding
+    """
+    if sigma <= SMOOTH_FFT_SIGMA:
+        from scipy.ndimage import gaussian_filter1d
+        return gaussian_filter1d(values, sigma, axis=axis, mode='constant', cval=0., truncate=SMOOTH_TRUNCATE)
+
+    from scipy.signal import fftconvolve
+    radius = int(SMOOTH_TRUNCATE*sigma + 0.5)
+    kernel = np.exp(-0.5*(np.arange(-radius, radius+1)/sigma)**2)
+    shape = [1]*values.ndim
+    shape[axis] = kernel.size
+    return fftconvolve(values, (kernel/kernel.sum()).reshape(shape), mode='same')
+
+def nan_gaussian_filter(values, sigma, axes=None):
+    """ NaN-aware, separable Gaussian smoothing
+
+    Normalized convolution: NaNs get a zero weight and the result is divided 
+    by the smoothed weights, so that NaNs do not spread and values near the 
+    array border are not biased. The kernel is applied one axis at a time, 
+    with FFT convolution for large kernels (see SMOOTH_FFT_SIGMA).
+
+    Parameters
+    ----------
+    values : array
+    sigma : standard deviation of the Gaussian kernel, in grid cells, 
+        scalar or one per axis
+    axes : axes to smooth along, by default all
+
+    Returns
+    -------
+    smoothed : float array, NaN where values are NaN
+    """
+    values = np.asarray(values, dtype=float)
+    if axes is None:
+        axes = range(values.ndim)
+    if np.isscalar(sigma):
+        sigma = [sigma]*len(axes)
+
+    valid = np.isfinite(values)
+    num = np.where(valid, values, 0.)
+    den = valid.astype(float)
+    for axis, sig in zip(axes, sigma):
+        if sig <= 0: continue
+        num = _gaussian_filter1d(num, sig, axis)
+        den = _gaussian_filter1d(den, sig, axis)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        smoothed = num / den
+    smoothed[~valid] = np.nan
+    return smoothed
+
+def smoothing_halo(sigma):
+    """ margin (m) to load around a bounding box, for smoothing with sigma (m)
+    """
+    return SMOOTH_TRUNCATE*sigma
+
+def _smooth2d(dataset, sigma):
+    """ Smooth 2-D variables of a loaded window in place, sigma in meters
+
+    The window should extend smoothing_halo(sigma) beyond the area of interest.
+    """
+    for k in dataset.keys():
+        a = dataset[k]
+        if a.ndim != 2: continue
+        sig = [sigma/np.abs(np.diff(ax.values)).mean() if ax.size > 1 else 0 for ax in a.axes]
+        dataset[k] = da.DimArray(nan_gaussian_filter(a.values, sig), a.axes)
+        dataset[k]._metadata(a._metadata())
+
+def _smooth1d(glacier1d, sigma):
+    """ Smooth glacier1d variables along the flow in place, sigma in grid points
+    """
+    for k in glacier1d.keys():
+        if k in ('x_coord', 'y_coord', 'lon', 'lat'): continue
+        a = glacier1d[k]
+        glacier1d[k] = da.DimArray(nan_gaussian_filter(a.values, sigma, axes=[a.ndim-1]), a.axes)
+        glacier1d[k]._metadata(a._metadata())
+
 def _get_glacier_bbox(glacier_grid):
     m = 0*1e3 # margin
     return [glacier_grid['x_coord'].min()*1e-3 - m,
@@ -224,77 +751,219 @@ def _get_glacier_bbox(glacier_grid):
             glacier_grid['y_coord'].min()*1e-3 - m,
             glacier_grid['y_coord'].max()*1e-3 + m]
 
+def _elevation_variables(dataset):
+    """ bedrock, surface and thickness variables to load via _load_dataset
+    """
+    return {'zb':('bedrock', dataset), 'hs':('surface', dataset), 'H':('thickness', dataset)}
+
 #
 # Another version of extractglacier1d, should be faster...
 #
-def extractglacier1d(glacier_grid, datasets):
+TILESIZE = 50e3 # m, tiles of about 330 x 330 points at morlighem2014 resolution
+
+def mesh_hash(glacier_grid):
+    """ unique id for a mesh, based on its coordinates
     """
+    return array_hash(glacier_grid['x_coord'].values, glacier_grid['y_coord'].values)
+
+# interpolated 2-D fields, per (mesh, source, variable)
+FIELD_CACHE_MAXSIZE = 100
+_FIELD_CACHE = LRUCache(maxsize=FIELD_CACHE_MAXSIZE)
+
+def _cached_fields(glacier2d, mesh_key, sources, compute):
+    """ Add interpolated fields to glacier2d, computing only those not found in cache
+
+    Parameters
+    ----------
+    glacier2d : Dataset on the mesh identified by mesh_key
+    mesh_key : mesh id (see mesh_hash)
+    sources : dict {name: source} of fields to add to glacier2d, 
+        source being any hashable which identifies the data source
+    compute : function compute(names) which adds (at least) the 
+        missing fields to glacier2d
+
+    Fields are also kept on disk across restarts, if the persistent store 
+    is configured (see store).
+    """
+    keys = {nm: (mesh_key, sources[nm], nm) for nm in sources}
+    found = {nm: _FIELD_CACHE.get(keys[nm]) for nm in sources}
+
+    store = get_store()
+    stored_keys = {nm: store_key('field', keys[nm], code=(_cached_fields,)) for nm in sources} if store else {}
+    for nm in sources:
+        if found[nm] is None and store is not None:
+            dima = store.get(stored_keys[nm])
+            if dima is not None:
+                found[nm] = (np.asarray(dima.values), dima._metadata())
+                _FIELD_CACHE.put(keys[nm], found[nm])
+
+    missing = [nm for nm in sorted(sources) if found[nm] is None]
+
+    if missing:
+        compute(missing)
+        for nm in missing:
+            _FIELD_CACHE.put(keys[nm], (glacier2d[nm].values.copy(), glacier2d[nm]._metadata()))
+            if store is not None:
+                store.put(stored_keys[nm], glacier2d[nm], kind='field', description=repr(keys[nm][1:]))
+
+    for nm in sources:
+        if nm in missing:
+            continue
+        values, metadata = found[nm]
+        glacier2d[nm] = da.DimArray(values.copy(), glacier2d.axes)
+        glacier2d[nm]._metadata(metadata)
+
+def _per_second(dima):
+    """ convert a rate from per year to per second, in place
+    """
+    dima.values /= 3600*24*365.25
+    dima.units = "meters / second"
+
+def extractglacier1d(glacier_grid, datasets, artifacts=None, tilesize=TILESIZE, progress=None):
+    """ Extract a 1-D glacier from various datasets, on a 2-D glacier mesh
+
+    Interpolated fields are cached per mesh, source and variable, so that 
+    a new extraction on the same mesh only recomputes the fields whose 
+    source changed.
+
+    Parameters
+    ----------
+    glacier_grid : Dataset with x_coord and y_coord (see make_2d_grid_from_contours)
+    datasets : dict of data sources for 'bedrock', 'velocity_mag' and 'smb', 
+        and optionally 'smooth2d' (m) and 'smooth1d' (grid points), the 
+        standard deviations of Gaussian kernels to smooth the data prior 
+        to interpolation and the glacier1d profiles (see nan_gaussian_filter)
+    artifacts : function artifacts(filename, dataset), optional
+        called with intermediate datasets (interpolated data) 
+        for debugging, e.g. ArtifactWriter.bind(). No intermediate 
+        file is written by default.
+    tilesize : tile side (m) to load high-resolution bedrock data (morlighem2014)
+        piece-wise, which bounds memory use for large glaciers (see interpolate_tiled).
+        If None, the whole glacier bounding box is loaded at once.
+    progress : function progress(fraction, message), optional
+        called at each stage: loading each dataset, interpolation (by tile 
+        for high-resolution data), averaging (e.g. background jobs, see jobs.py)
+
+    Returns
+    -------
+    glacier1d : Dataset
     """
     # Interpolate various datasets onto the grid
     glacier2d = copy.copy(glacier_grid) # just to keep glacier_grid clean
+    mesh_key = mesh_hash(glacier_grid)
 
     # determine bounding box that encloses the glacier data
     coords = _get_glacier_bbox(glacier_grid)
 
+    # smoothing requires loading a halo around the glacier
+    smooth2d = datasets.get('smooth2d') or 0
+    smooth1d = datasets.get('smooth1d') or 0
+    halo = smoothing_halo(smooth2d)
+
+    def source(*names):
+        """ cache key for fields from data sources (see _cached_fields),
+        including the identity of the source files
+        """
+        return tuple(names) + (smooth2d, tuple(map(repr, map(dataset_identity, names))))
+
+    def prepare(ds):
+        """ prepare loaded data prior to interpolation: fill NaNs, convert units
+        """
+        if 'H' in ds.keys():
+            # replace NaN in thickness with zero
+            ds['H'][np.isnan(ds['H'])] = 0.
+        if 'U' in ds.keys():
+            assert ds['U'].units.strip() in ('meter/year','meters/year'), "check out velocity units: "+repr(ds['U'].units)
+        if 'smb' in ds.keys():
+            assert ds['smb'].units.strip() == 'meters/year', "check out smb units"
+        if 'dhdt' in ds.keys():
+            assert ds['dhdt'].units.strip() == 'meters/year', "check out dhdt units"
+        for nm in ds.keys():
+            if nm not in ('zb', 'hs', 'H'):
+                _per_second(ds[nm])
+        if smooth2d > 0:
+            _smooth2d(ds, smooth2d)
+
+    def load_fields(fields, maxshape=None, progress=None):
+        """ return compute function for _cached_fields, for fields loaded via interpolate_fields
+        """
+        def compute(names):
+            interpolate_fields(glacier2d, {nm: fields[nm] for nm in names}, maxshape=maxshape, prepare=prepare, 
+                               halo=halo, progress=progress)
+        return compute
+
     # Elevation
+    if progress: progress(0., 'elevation from '+datasets['bedrock'])
+    elevation_sources = [datasets['bedrock']]
+    if datasets['bedrock'] == "morlighem2014":
+        elevation_sources.append('bamber2013') # fill values
+    elevation = {nm: source(*elevation_sources) for nm in ('zb', 'hs', 'H')}
+
     if datasets['bedrock'] == "morlighem2014":
         # ...special treatment for Morlighem, which is on a different grid
         # ==> instead of loading a large grid and making the projections, 
         # just project the coords onto Morlighem grid.
         # also load Bamber et al 2013 as fill values
 
-        from icedata.greenland import morlighem2014
-        crs_disk = get_crs(morlighem2014.GRID_MAPPING)
-        crs_target = get_crs(MAPPING)
-        glacier2d_prj, coords_prj = _prepare_load_prj(glacier_grid, crs_disk, crs_target)
-
-        # load data
-        l,r,b,t = [v*1e3 for v in coords_prj] # km => m
-        # indexer = {'x':slice(l,r), 'y':slice(b,t)}
-        ds_prj = morlighem2014.load(['bed', 'surface', 'thickness'], bbox=[l,r,b,t]) # 1000 m tolerance, since 150 res
-        # ds_prj = morlighem2014.load(['bed', 'surface', 'thickness'], indexer, tol=1e3) # 1000 m tolerance, since 150 res
-        ds_prj.rename_keys({'bed':'zb', 'surface':'hs','thickness':'H'}, inplace=True)
-        ds_prj['H'][np.isnan(ds_prj['H'])] = 0.
-        ds_prj.write_nc("test_morlighem_raw.nc")
-        glacier2d_prj = interpolate_data_on_glacier_grid(ds_prj, glacier2d_prj)
-        glacier2d_prj.write_nc("test_morlighem_interp.nc")
-
-        # complement NaN values with bamber2013 dataset?
-        # load Bamber et al 2013
-        zb = _load_data(coords, 'bedrock', 'bamber2013') 
-        hs = _load_data(coords, 'surface', 'bamber2013') 
-        H = _load_data(coords, 'thickness', 'bamber2013') 
-        H[np.isnan(H)] = 0.
-        dataset = da.Dataset({'zb':zb, 'hs':hs, 'H':H}) 
-        dataset.write_nc("test_bamber_raw.nc")
-        glacier2d = interpolate_data_on_glacier_grid(dataset, glacier2d)
-        glacier2d.write_nc("test_bamber_interp.nc")
-
-        # fill nan values
-        # ...determine grid boxes to be filled with Bamber
-        null = np.zeros_like(glacier2d['H'], dtype=bool)
-        for k in glacier2d_prj.keys():
-            if k in ('x_coord','y_coord'): continue
-            null = null | np.isnan(glacier2d_prj[k].values)
-
-        # ...fill values
-        for k in glacier2d_prj.keys():
-            if k in ('x_coord','y_coord'): continue
-            # take Morlighem, fill NaNs with Bamber et al 2013
-            values = glacier2d_prj[k].values
-            fill_values = glacier2d[k].values
-            values[null] = fill_values[null]
-            glacier2d[k] = da.DimArray(values, axes=glacier2d.axes)
+        def compute_morlighem(names):
+            from icedata.greenland import morlighem2014
+            crs_disk = get_crs(morlighem2014.GRID_MAPPING)
+            crs_target = get_crs(MAPPING)
+            glacier2d_prj, coords_prj = _prepare_load_prj(glacier_grid, crs_disk, crs_target)
+
+            def load_morlighem(bbox):
+                ds_prj = morlighem2014.load(['bed', 'surface', 'thickness'], bbox=bbox)
+                ds_prj.rename_keys({'bed':'zb', 'surface':'hs','thickness':'H'}, inplace=True)
+                ds_prj['H'][np.isnan(ds_prj['H'])] = 0.
+                if smooth2d > 0:
+                    _smooth2d(ds_prj, smooth2d)
+                return ds_prj
+
+            # load data at native (150 m) resolution, tile by tile
+            # (tiles are smoothed separately, hence the halo)
+            l,r,b,t = [v*1e3 for v in coords_prj] # km => m
+            glacier2d_prj = interpolate_tiled(load_morlighem, [l-halo,r+halo,b-halo,t+halo], glacier2d_prj, 
+                                              tilesize=tilesize, halo=max(2e3, halo), 
+                                              progress=_subprogress(progress, 0., 0.3, 'morlighem2014 '))
+            if artifacts: artifacts("morlighem_interp.nc", glacier2d_prj)
+
+            # complement NaN values with bamber2013 dataset?
+            # load Bamber et al 2013
+            def load_bamber(bbox):
+                dataset = _load_dataset(np.asarray(bbox)*1e-3, _elevation_variables('bamber2013'))
+                dataset['H'][np.isnan(dataset['H'])] = 0.
+                if smooth2d > 0:
+                    _smooth2d(dataset, smooth2d)
+                return dataset
+
+            l,r,b,t = [v*1e3 for v in coords] # km => m
+            interpolate_tiled(load_bamber, [l-halo,r+halo,b-halo,t+halo], glacier2d, 
+                              tilesize=tilesize, halo=max(2e3, halo), 
+                              progress=_subprogress(progress, 0.3, 0.4, 'bamber2013 '))
+            if artifacts: artifacts("bamber_interp.nc", glacier2d)
+
+            # fill nan values
+            # ...determine grid boxes to be filled with Bamber
+            null = np.zeros_like(glacier2d['H'], dtype=bool)
+            for k in glacier2d_prj.keys():
+                if k in ('x_coord','y_coord'): continue
+                null = null | np.isnan(glacier2d_prj[k].values)
+
+            # ...fill values
+            for k in glacier2d_prj.keys():
+                if k in ('x_coord','y_coord'): continue
+                # take Morlighem, fill NaNs with Bamber et al 2013
+                values = glacier2d_prj[k].values
+                fill_values = glacier2d[k].values
+                values[null] = fill_values[null]
+                glacier2d[k] = da.DimArray(values, axes=glacier2d.axes)
+
+        _cached_fields(glacier2d, mesh_key, elevation, compute_morlighem)
 
     else:
         # just load the data normally
-        zb = _load_data(coords, 'bedrock', datasets['bedrock'])
-        hs = _load_data(coords, 'surface', datasets['bedrock'])
-        H = _load_data(coords, 'thickness', datasets['bedrock'])
-        # replace NaN in thickness with zero
-        H[np.isnan(H)] = 0.
-        dataset = da.Dataset({'zb':zb, 'hs':hs, 'H':H}) 
-        glacier2d = interpolate_data_on_glacier_grid(dataset, glacier2d)
+        fields = _elevation_variables(datasets['bedrock'])
+        _cached_fields(glacier2d, mesh_key, elevation, load_fields(fields, progress=_subprogress(progress, 0., 0.4)))
 
     glacier2d['hb'] = glacier2d['hs'] - glacier2d['H']
 
@@ -316,61 +985,57 @@ def extractglacier1d(glacier_grid, datasets):
         glacier2d['zb'][bad] = glacier2d['hb'][bad]
 
     # Velocity
+    if progress: progress(0.4, 'velocity from '+datasets['velocity_mag'])
+    velocity = {'U': source(datasets['velocity_mag'])}
+
     if datasets['velocity_mag'] == 'rignot_mouginot2012':
-        # transform bounding box and new grid in own coordinate system
-        from icedata.greenland import rignot_mouginot2012
-        crs_disk = get_crs(rignot_mouginot2012.GRID_MAPPING)
-        crs_target = get_crs(MAPPING)
-        glacier2d_prj, coords_prj = _prepare_load_prj(glacier_grid, crs_disk, crs_target)
-        l,r,b,t = [v*1e3 for v in coords_prj] # km => m
-        # load data  on own grid
-        # ds_prj = rignot_mouginot2012.load(bbox=(l,b,r,t))
-        ds_prj = rignot_mouginot2012.load(['vx','vy'], bbox=[l,r,b,t]) # 1000 m tolerance, since 150 res
-        v =  np.sqrt(ds_prj['vx']**2 + ds_prj['vy']**2)
-        glacier2d_prj = interpolate_data_on_glacier_grid(da.Dataset(v=v), glacier2d_prj)
-        # set bamber 2013 coordinates and join the other datasets
-        velocity = da.DimArray(glacier2d_prj["v"].values, axes=glacier2d.axes) # just keep the values
-        velocity.values /= 3600*24*365.25
-        velocity.units = "meters / second"
-        glacier2d["U"] = velocity
+        def compute_rignot(names):
+            # transform bounding box and new grid in own coordinate system
+            from icedata.greenland import rignot_mouginot2012
+            crs_disk = get_crs(rignot_mouginot2012.GRID_MAPPING)
+            crs_target = get_crs(MAPPING)
+            glacier2d_prj, coords_prj = _prepare_load_prj(glacier_grid, crs_disk, crs_target)
+            l,r,b,t = [v*1e3 for v in coords_prj] # km => m
+            # load data  on own grid
+            # ds_prj = rignot_mouginot2012.load(bbox=(l,b,r,t))
+            ds_prj = rignot_mouginot2012.load(['vx','vy'], bbox=[l-halo,r+halo,b-halo,t+halo]) # 1000 m tolerance, since 150 res
+            v =  da.Dataset(v=np.sqrt(ds_prj['vx']**2 + ds_prj['vy']**2))
+            if smooth2d > 0:
+                _smooth2d(v, smooth2d)
+            if progress: progress(0.5, 'interpolate rignot_mouginot2012')
+            glacier2d_prj = interpolate_data_on_glacier_grid(v, glacier2d_prj)
+            # set bamber 2013 coordinates and join the other datasets
+            U = da.DimArray(glacier2d_prj["v"].values, axes=glacier2d.axes) # just keep the values
+            _per_second(U)
+            glacier2d["U"] = U
+
+        _cached_fields(glacier2d, mesh_key, velocity, compute_rignot)
     else:
-        velocity = _load_data(coords, 'velocity_mag', datasets['velocity_mag'], maxshape=(300,300))  # load data at lower resolution : TODO: see Morlighem et al 2012
-        assert velocity.units.strip() in ('meter/year','meters/year'), "check out velocity units: "+repr(velocity.units)
-        velocity.values /= 3600*24*365.25
-        velocity.units = "meters / second"
-        dataset = da.Dataset({'U':velocity})
-        glacier2d = interpolate_data_on_glacier_grid(dataset, glacier2d)
-
-    # also add surf / basal velocity /and runoff from the standard dataset.
-    ds = da.Dataset()
-    for nm in ['surfvelmag','balvelmag','runoff']:
-    # for nm in ['runoff']:
-        a = _load_data(coords, nm, 'standard_dataset')
-        a.values /= 3600*24*365.25
-        a.units = "meters / second"
-        ds[nm] = a
-    glacier2d = interpolate_data_on_glacier_grid(ds, glacier2d)
-
-    # Surface mass balance
-    smb = _load_data(coords, 'smb', datasets['smb'])
-    assert smb.units.strip() == 'meters/year', "check out smb units"
-    smb.values /= 3600*24*365.25
-    smb.units = "meters / second"
-    dataset = da.Dataset({'smb':smb})
-    glacier2d = interpolate_data_on_glacier_grid(dataset, glacier2d)
-
-    # Thinning rate
-    dhdt = _load_data(coords, 'dhdt', 'standard_dataset')
-    assert dhdt.units.strip() == 'meters/year', "check out smb units"
-    dhdt.values /= 3600*24*365.25
-    dhdt.units = "meters / second"
-    dataset = da.Dataset({'dhdt':dhdt})
-    glacier2d = interpolate_data_on_glacier_grid(dataset, glacier2d)
-
-    glacier2d.write_nc("outletglacierapp/appdata/glacier2d.nc")
+        # load data at lower resolution : TODO: see Morlighem et al 2012
+        fields = {'U': ('velocity_mag', datasets['velocity_mag'])}
+        _cached_fields(glacier2d, mesh_key, velocity, load_fields(fields, maxshape=(300,300), 
+                                                                   progress=_subprogress(progress, 0.4, 0.6)))
+
+    # also add surf / basal velocity /and runoff from the standard dataset,
+    # surface mass balance and thinning rate, reading each file only once
+    fields = {
+        'surfvelmag': ('surfvelmag', 'standard_dataset'),
+        'balvelmag': ('balvelmag', 'standard_dataset'),
+        'runoff': ('runoff', 'standard_dataset'),
+        'smb': ('smb', datasets['smb']),
+        'dhdt': ('dhdt', 'standard_dataset'),
+    }
+    if progress: progress(0.6, 'mass balance and standard dataset')
+    _cached_fields(glacier2d, mesh_key, {nm: source(fields[nm][1]) for nm in fields}, 
+                   load_fields(fields, progress=_subprogress(progress, 0.6, 0.9)))
+
+    if artifacts: artifacts("glacier2d.nc", glacier2d)
 
     # Export to 1-D glacier
+    if progress: progress(0.9, 'cross-flow average')
     glacier1d = glacier_crossflow_average(glacier2d)
+    if smooth1d > 0:
+        _smooth1d(glacier1d, smooth1d)
 
     return glacier1d
 
@@ -383,15 +1048,428 @@ def transform_grid(glacier_grid, source, target):
     glacier2d_prj, bbox_prj = _prepare_load_prj(glacier_grid, src, tar)
     return glacier2d_prj, np.array(bbox_prj)*1000 # _Get_glacier_bbox makes it in km
 
+TRANSFORM_CHUNKSIZE = 50000 # points per chunk when transforming large meshes
+TRANSFORM_THREADS = 4
+
+def transform_points(crs_to, crs_from, x, y, chunksize=TRANSFORM_CHUNKSIZE, threads=TRANSFORM_THREADS):
+    """ Same as crs_to.transform_points(crs_from, x, y), but large arrays are 
+    transformed by chunks in parallel threads
+
+    Returns
+    -------
+    x, y : transformed coordinates, same shape as input
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.size <= chunksize or threads <= 1:
+        pts = crs_to.transform_points(crs_from, x, y)
+        return pts[...,0], pts[...,1]
+
+    from multiprocessing.pool import ThreadPool
+    xf, yf = x.ravel(), y.ravel()
+    def _transform(i):
+        pts = crs_to.transform_points(crs_from, xf[i:i+chunksize], yf[i:i+chunksize])
+        return pts[:,0], pts[:,1]
+    pool = ThreadPool(threads)
+    try:
+        chunks = pool.map(_transform, range(0, xf.size, chunksize))
+    finally:
+        pool.close()
+    xt = np.concatenate([c[0] for c in chunks]).reshape(x.shape)
+    yt = np.concatenate([c[1] for c in chunks]).reshape(y.shape)
+    return xt, yt
+
+# reprojected mesh coordinates, per (mesh, source CRS, target CRS)
+PROJECTED_MESHES_MAXSIZE = 20
+
+@memoize(maxsize=PROJECTED_MESHES_MAXSIZE, 
+         key=lambda x, y, crs_disk, crs_target: (array_hash(x, y), crs_disk.proj4_init, crs_target.proj4_init))
+def _project_mesh(x, y, crs_disk, crs_target):
+    return transform_points(crs_disk, crs_target, x, y)
+
 def _prepare_load_prj(glacier_grid, crs_disk, crs_target):
-    pts = crs_disk.transform_points(crs_target, glacier_grid['x_coord'].values, glacier_grid['y_coord'].values)
-    x, y = pts[...,0], pts[...,1] # grid 
+    """ Transform the glacier grid from crs_target (the grid's) to crs_disk (the data's)
+
+    Transformed coordinates are cached for later calls on the same 
+    mesh and coordinate systems.
+
+    Returns
+    -------
+    glacier2d_prj : copy of glacier_grid with transformed x_coord and y_coord
+    coords_prj : bounding box of the transformed grid, in km
+    """
+    x, y = _project_mesh(glacier_grid['x_coord'].values, glacier_grid['y_coord'].values, crs_disk, crs_target)
+
     glacier2d_prj = glacier_grid.copy()
-    glacier2d_prj['x_coord'] = da.DimArray(x, glacier2d_prj.axes)
-    glacier2d_prj['y_coord'] =  da.DimArray(y, glacier2d_prj.axes)
+    glacier2d_prj['x_coord'] = da.DimArray(x.copy(), glacier2d_prj.axes)
+    glacier2d_prj['y_coord'] =  da.DimArray(y.copy(), glacier2d_prj.axes)
     coords_prj = _get_glacier_bbox(glacier2d_prj) # bbox for morlighem2014
     return glacier2d_prj, coords_prj
 
+#
+# Building blocks for the command-line utility
+#
+def read_lines(fname):
+    """ Read glacier outlines from a json file, as saved by the web app
+
+    Returns
+    -------
+    dict of Line instances with keys 'middle', 'left', 'right' (in meters)
+    """
+    with open(fname) as f:
+        lines = json.load(f)
+    linedict = {}
+    for key in ['middle', 'left', 'right']:
+        line = [line for line in lines if line['id'].lower() == key][0]
+        linedict[key] = Line([Point(pt['x']*1e3, pt['y']*1e3) for pt in line['values']])
+    return linedict
+
+def make_grid_from_lines(lines, dx, ny, refine=None, dxmin=None, dxmax=None):
+    """ Make the glacier grid from a lines file (see read_lines), with optional 
+    refinement of the along-flow step (see refine_spacing)
+    """
+    linedict = read_lines(lines)
+    if dxmin is None: dxmin = dx/10.
+    if dxmax is None: dxmax = dx
+    if refine:
+        print("Refine mesh from", refine, "gradients, between", dxmin, "and", dxmax, "m")
+        dx = refine_spacing(linedict['middle'], refine, dxmin, dxmax)
+    return make_2d_grid_from_contours(linedict['middle'], linedict['left'], linedict['right'], 
+                                      dx=dx, ny=ny, dxmin=dxmin, dxmax=dxmax)
+
+# source windows loaded in this process, per (domain, dataset, variable, bbox, maxshape)
+WINDOWS_MAXSIZE = 20
+_WINDOWS = LRUCache(maxsize=WINDOWS_MAXSIZE)
+
+def load_window(dataset, variables, bbox, maxshape=None, domain="greenland"):
+    """ Load variables from an icedata dataset, keeping loaded windows in memory
+
+    Windows are kept (per process) for later calls with the same bounding 
+    box, and only variables not loaded yet are read from disk.
+
+    Parameters
+    ----------
+    dataset : icedata dataset name (e.g. presentday, bamber2013)
+    variables : list of variable names
+    bbox : [left, right, bottom, top] in meters, in the dataset's coordinate system
+    maxshape : maximum shape of loaded data
+    domain : icedata domain
+
+    Returns
+    -------
+    Dataset instance (copy)
+    """
+    import icedata
+    mod = getattr(getattr(icedata, domain), dataset)
+    window = (domain, dataset, tuple(np.round(bbox, 3)), maxshape)
+    found = {v: _WINDOWS.get(window+(v,)) for v in variables}
+    missing = [v for v in variables if found[v] is None]
+    if missing:
+        loaded = mod.load(missing, bbox=np.asarray(bbox), maxshape=maxshape)
+        for v in missing:
+            found[v] = loaded[v]
+            _WINDOWS.put(window+(v,), loaded[v])
+
+    ds = da.Dataset()
+    for v in variables:
+        ds[v] = found[v].copy()
+
+    return ds
+
+def _fill_nans(dataset, val):
+    """ fill nan values ?
+    """
+    for k in dataset.keys():
+        dataset[k].values[np.isnan(dataset[k].values)] = val
+
+def extract_dataset(glacier_grid, dataset, variables, domain="greenland", maxshape=None, 
+                    fill_nans=None, smooth2d=0, average="points", skipna=False):
+    """ Load variables from an icedata dataset and bring them onto the glacier grid
+
+    Parameters
+    ----------
+    glacier_grid : Dataset with x_coord and y_coord, in BA2013 coordinate system
+    dataset : icedata dataset name
+    variables : list of variable names
+    domain : icedata domain
+    maxshape : max size of box side to be loaded
+    fill_nans : fill nans with this value before interpolation, optional
+    smooth2d : standard deviation (m) of the Gaussian kernel to smooth 2-D fields 
+        prior to interpolation (see nan_gaussian_filter), 0 for no smoothing
+    average : "points" to interpolate on the grid, "zonal" to average 
+        directly from source pixels (see zonal_statistics)
+    skipna : skip nans when averaging (zonal only)
+
+    Returns
+    -------
+    glacier2d : Dataset of variables interpolated on the grid (empty if average is "zonal")
+    stats : cross-flow averaged Dataset if average is "zonal", None otherwise
+    """
+    import icedata
+
+    l,r,b,t = _get_glacier_bbox(glacier_grid)
+    bbox = np.array([l,r,b,t])*1e3 # in meters
+
+    # load relevant icedata module
+    mod = getattr(getattr(icedata, domain), dataset)
+    if maxshape is not None and np.isscalar(maxshape):
+        maxshape = (maxshape, maxshape)
+
+    # check the need for projection (grid is assumed to be in BA2013)
+    grid_mapping = icedata.greenland.bamber2013.GRID_MAPPING
+    transform = mod.GRID_MAPPING != grid_mapping
+
+    # If data is defined on another grid, just transform the target glacier_grid to that other
+    # coordinate system and work on it
+    grid = da.Dataset(x_coord=glacier_grid['x_coord'], y_coord=glacier_grid['y_coord'])
+    if transform:
+        grid, bbox = transform_grid(grid, grid_mapping, mod.GRID_MAPPING)
+
+    if smooth2d > 0:
+        halo = smoothing_halo(smooth2d)
+        bbox = bbox + np.array([-halo, halo, -halo, halo])
+
+    data = load_window(dataset, variables, bbox, maxshape=maxshape, domain=domain)
+    if fill_nans is not None:
+        _fill_nans(data, fill_nans)
+    if smooth2d > 0:
+        _smooth2d(data, smooth2d)
+
+    glacier2d = da.Dataset()
+    stats = None
+    if average == "zonal":
+        stats = zonal_statistics(grid, data, skipna=skipna)
+    else:
+        # interpolate on glacier grid
+        interpolate_data_on_glacier_grid(data, grid)
+        # now copy values on original glacier grid
+        for k in variables:
+            glacier2d[k] = da.DimArray(grid[k].values, axes=glacier_grid.axes)
+            glacier2d[k].attrs.update(grid[k].attrs)
+
+    return glacier2d, stats
+
+def rename_variables(ds, short=False, prefix="", suffix=""):
+    """ Rename variables in place, with short names (H, W, U...) and/or prefix and suffix
+    """
+    if short:
+        mapshort = {
+            "surface_elevation":"hs",
+            "bottom_elevation":"hb",
+            "bedrock_elevation":"zb",
+            "ice_thickness":"H",
+            "glacier_width":"W",
+            "surface_velocity":"U",
+        }
+        ds.rename_keys({k:mapshort.get(k,k) for k in ds.keys()}, inplace=True)
+        print (ds.keys())
+    if suffix or prefix:
+        ds.rename_keys({k:prefix+k+suffix for k in ds.keys() if k not in ['x_coord','y_coord']}, inplace=True)
+
+def _average_fields(glacier_grid, fields, skipna=False):
+    """ cross-flow average of 2-D fields, without grid information
+    """
+    grid = da.Dataset(x_coord=glacier_grid['x_coord'], y_coord=glacier_grid['y_coord'])
+    for k in fields.keys():
+        grid[k] = fields[k]
+    glacier1d = glacier_crossflow_average(grid, skipna=skipna)
+    return da.Dataset({k:glacier1d[k] for k in fields.keys()})
+
+def extract_ensemble(glacier_grid, datasets, variables, skipna=False, **kwargs):
+    """ Extract the same variables from several datasets, in one pass
+
+    Work shared between datasets on the same grid (mesh transformation, 
+    interpolation weights, loaded windows) is only done once, since it 
+    is cached (see _prepare_load_prj, get_interp_weights and load_window).
+
+    Parameters
+    ----------
+    glacier_grid : Dataset with x_coord and y_coord, in BA2013 coordinate system
+    datasets : list of icedata dataset names
+    variables : list of variable names, present in all datasets
+    skipna : skip nans when averaging
+    **kwargs : passed to extract_dataset (domain, maxshape, average...)
+
+    Returns
+    -------
+    ensemble : cross-flow averaged Dataset, whose variables have a 
+        "source" dimension in addition to the along-flow dimension
+    """
+    values = {v: [] for v in variables}
+    metadata = {}
+    for dataset in datasets:
+        fields, stats = extract_dataset(glacier_grid, dataset, variables, skipna=skipna, **kwargs)
+        if stats is None:
+            stats = _average_fields(glacier_grid, fields, skipna=skipna)
+        for v in variables:
+            values[v].append(stats[v].values)
+            metadata[v] = stats[v]._metadata()
+
+    axes = [da.Axis(list(datasets), 'source', long_name="data source"), glacier_grid.axes[0]]
+    ensemble = da.Dataset()
+    for v in variables:
+        ensemble[v] = da.DimArray(np.array(values[v]), axes)
+        ensemble[v]._metadata(metadata[v])
+    return ensemble
+
+def run_extractions(glacier_grid, extractions, domain="greenland", maxshape=None, short=False, 
+                    fill_nans=None, skipna=False, smooth2d=0, smooth1d=0, average="points"):
+    """ Apply a sequence of extractions on a glacier grid
+
+    Parameters
+    ----------
+    glacier_grid : Dataset with x_coord and y_coord
+    extractions : list of dict with keys "dataset", "variables" (list or comma-separated), 
+        and optionally "suffix", "prefix", and any keyword argument of this function, 
+        to override the defaults for that extraction. If "datasets" (list) is provided 
+        instead of "dataset", the variables are extracted from all of them, and written 
+        to glacier1d only, with a "source" dimension (see extract_ensemble).
+    domain, maxshape, short, fill_nans, skipna, smooth2d, average : default 
+        options for all extractions (see extract_dataset and rename_variables)
+    smooth1d : standard deviation (in grid points) of the Gaussian kernel to 
+        smooth the averaged variables along the flow, 0 for no smoothing
+
+    Returns
+    -------
+    glacier2d : glacier_grid with all interpolated variables
+    glacier1d : cross-flow averaged glacier
+    """
+    defaults = dict(domain=domain, maxshape=maxshape, short=short, fill_nans=fill_nans, 
+                    skipna=skipna, smooth2d=smooth2d, smooth1d=smooth1d, average=average, 
+                    prefix="", suffix="")
+    glacier2d = da.Dataset(x_coord=glacier_grid['x_coord'], y_coord=glacier_grid['y_coord'])
+    glacier1d = glacier_crossflow_average(glacier2d)
+
+    for extraction in extractions:
+        opt = dict(defaults, **extraction)
+        variables = opt['variables']
+        if not isinstance(variables, list):
+            variables = variables.split(",")
+
+        if 'datasets' in opt:
+            ensemble = extract_ensemble(glacier2d, opt['datasets'], variables, domain=opt['domain'], 
+                                        maxshape=opt['maxshape'], fill_nans=opt['fill_nans'], 
+                                        smooth2d=opt['smooth2d'], average=opt['average'], skipna=opt['skipna'])
+            rename_variables(ensemble, short=opt['short'], prefix=opt['prefix'], suffix=opt['suffix'])
+            if opt['smooth1d'] > 0:
+                _smooth1d(ensemble, opt['smooth1d'])
+            for k in ensemble.keys():
+                glacier1d[k] = ensemble[k]
+            continue
+
+        fields, stats = extract_dataset(glacier2d, opt['dataset'], variables, domain=opt['domain'], 
+                                        maxshape=opt['maxshape'], fill_nans=opt['fill_nans'], 
+                                        smooth2d=opt['smooth2d'], average=opt['average'], skipna=opt['skipna'])
+        rename_variables(fields, short=opt['short'], prefix=opt['prefix'], suffix=opt['suffix'])
+
+        if stats is None:
+            # average newly interpolated variables
+            stats = _average_fields(glacier2d, fields, skipna=opt['skipna'])
+        else:
+            rename_variables(stats, short=opt['short'], prefix=opt['prefix'], suffix=opt['suffix'])
+
+        if opt['smooth1d'] > 0:
+            _smooth1d(stats, opt['smooth1d'])
+
+        for k in fields.keys():
+            glacier2d[k] = fields[k]
+        for k in stats.keys():
+            glacier1d[k] = da.DimArray(stats[k].values, axes=glacier1d.axes)
+            glacier1d[k].attrs.update(stats[k].attrs)
+
+    return glacier2d, glacier1d
+
+def _run_manifest_glacier(task):
+    """ Make the grid and run all extractions for one glacier of a manifest (see run_manifest)
+    """
+    glacier, extractions, options = task
+    name = glacier['name']
+    try:
+        if glacier.get('grid') and os.path.exists(glacier['grid']) and not glacier.get('lines'):
+            glacier_grid = da.read_nc(glacier['grid'], ["x_coord", "y_coord"])
+        else:
+            glacier_grid = make_grid_from_lines(glacier['lines'], dx=glacier.get('dx', 100), ny=glacier.get('ny', 20),
+                                                refine=glacier.get('refine'), dxmin=glacier.get('dx_min'), dxmax=glacier.get('dx_max'))
+            if glacier.get('grid'):
+                glacier_grid.write_nc(glacier['grid'], 'w')
+
+        glacier2d, glacier1d = run_extractions(glacier_grid, extractions, **options)
+
+        if glacier.get('glacier2d'):
+            glacier2d.write_nc(glacier['glacier2d'], 'w')
+        glacier1d.write_nc(glacier['glacier1d'], 'w')
+
+    except Exception as error:
+        return name, "{}: {}".format(type(error).__name__, error)
+
+    return name, None
+
+def run_manifest(manifest, jobs=None):
+    """ Build the grids and extract all datasets for several glaciers, as described in a manifest
+
+    Glaciers are processed in parallel with a local process pool. Each worker
+    keeps the source windows it loaded (see load_window).
+
+    Parameters
+    ----------
+    manifest : json file name, with the following structure (paths relative to the manifest)
+
+        {
+            "options": {"short": true, "maxshape": 500},
+            "glaciers": [
+                {"name": "petermann", "lines": "lines-petermann.json", "dx": 100, "ny": 20, 
+                 "grid": "petermann-grid.nc", "glacier2d": "petermann-2d.nc", "glacier1d": "petermann-1d.nc"},
+                ...
+            ],
+            "extractions": [
+                {"dataset": "rignot_mouginot2012", "variables": ["surface_velocity"], "suffix": "_R12"},
+                {"dataset": "bamber2013", "variables": ["surface_elevation", "bedrock_elevation"], "suffix": "_B13"},
+                ...
+            ]
+        }
+
+        "options" are passed to run_extractions. For each glacier, "lines" or an 
+        existing "grid" must be provided, "glacier1d" defaults to <name>-glacier1d.nc.
+    jobs : number of worker processes, by default the number of CPUs
+
+    Returns
+    -------
+    failed : dict of {glacier name: error message}
+    """
+    import multiprocessing
+
+    with open(manifest) as f:
+        config = json.load(f)
+    root = os.path.dirname(os.path.abspath(manifest))
+
+    tasks = []
+    for glacier in config['glaciers']:
+        glacier = dict(glacier)
+        glacier.setdefault('glacier1d', glacier['name']+'-glacier1d.nc')
+        for k in ['lines', 'grid', 'glacier2d', 'glacier1d']:
+            if glacier.get(k):
+                glacier[k] = os.path.join(root, glacier[k])
+        tasks.append((glacier, config['extractions'], config.get('options', {})))
+
+    if jobs == 1 or len(tasks) <= 1:
+        results = [_run_manifest_glacier(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes=jobs)
+        try:
+            results = pool.map(_run_manifest_glacier, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    failed = {}
+    for name, error in results:
+        if error is None:
+            print("Done", name)
+        else:
+            print("Failed", name, error)
+            failed[name] = error
+    return failed
+
 #
 # Define a main script for modular use of the code
 #
@@ -403,6 +1481,9 @@ def main():
     # Make grid and save it to file
     mesh -l lines-petermann.json --write-grid petermann-grid.nc --dx 100 --ny 20
 
+    # ...with a finer step where velocity changes rapidly (e.g. near the terminus)
+    mesh -l lines-petermann.json --write-grid petermann-grid.nc --dx 1000 --ny 20 --refine velocity --dx-min 100
+
     # Add velocity data on it (--short for U instead of surface_velocity)
     mesh --glacier1d glacier1d.nc --grid petermann-grid.nc --dataset rignot_mouginot2012 -v surface_velocity --short --suffix '_R12'
     mesh --glacier1d glacier1d.nc --grid petermann-grid.nc --dataset presentday -v surface_velocity --short --suffix '_J10'
@@ -415,10 +1496,13 @@ def main():
     mesh --glacier1d glacier1d.nc --grid petermann-grid.nc --dataset presentday -v smb --short --suffix '_E09'
     mesh --glacier1d glacier1d.nc --grid petermann-grid.nc --dataset presentday -v dhdt --short --suffix '_C09'
     mesh --glacier1d glacier1d.nc --grid petermann-grid.nc --dataset presentday -v runoff --short --suffix '_C09'
-    """
-    # This should be used for loading data instead of greenmap's _load_data
-    import icedata
 
+    # Compare several velocity datasets: glacier1d variables with a "source" dimension
+    mesh --glacier1d glacier1d.nc --grid petermann-grid.nc --dataset rignot_mouginot2012,presentday -v surface_velocity --short --ensemble
+
+    # All of the above, for several glaciers at once (see run_manifest for the file format)
+    mesh --manifest glaciers.json --jobs 4
+    """
     # =====================
     # Parse input arguments
     # =====================
@@ -430,17 +1514,22 @@ def main():
     # ...provided as user-input
     group.add_argument("-g","--grid", help="netCDF file containing the grid, if already computed (in BA2014 CRS)")
     group.add_argument("-l","--lines", help="json file containing the lines (labelled with left, middle, right) in BA2013 coordinate system")
+    group.add_argument("--manifest", help="json file describing several glaciers and extractions to process in one go (batch mode, see run_manifest)")
     # ...create grid from outlines
     group = parser.add_argument_group("create mesh from lines")
     group.add_argument("--dx", type=float, default=100, help="resolution along main line")
     group.add_argument("--ny", type=int, default=20, help="number of points cross-flow")
+    group.add_argument("--refine", choices=sorted(REFINE.keys()), help="variable along-flow step derived from velocity or thickness gradients")
+    group.add_argument("--dx-min", type=float, help="min resolution along main line, with --refine (default dx/10)")
+    group.add_argument("--dx-max", type=float, help="max resolution along main line, with --refine (default dx)")
 
     # input data to interpolate on the grid
     group = parser.add_argument_group("Input data to grid")
     # group.add_argument("-d","--data",help="netCDF file of input data")
     group.add_argument("--domain", default="greenland",help="domain (to load from icedata)")
     group.add_argument("--maxshape", default=500, type=int, help="max size of box side to be loaded")
-    group.add_argument("-d","--dataset",help="dataset name (to load from icedata)")
+    group.add_argument("-d","--dataset",help="dataset name (to load from icedata), or comma-separated names with --ensemble")
+    group.add_argument("--ensemble", action="store_true", help="extract variables from all datasets provided in --dataset, into glacier1d variables with a 'source' dimension")
     # group.add_argument("-m","--mapping",default="BA2013",choices=["BA2013","RM2012"], help="grid mapping, from which to projected onto BA2013")
     group.add_argument("-v","--variable",help="variable(s) as -v 'name' or -v 'nm1,nm2,nm3'")
     # group.add_argument("--prefix", action="store_true", help="prefix variable name with dataset name - useful for dataset comparison")
@@ -451,10 +1540,11 @@ def main():
     group = parser.add_mutually_exclusive_group()
     group.add_argument("--fill-nans",type=float, help="fill nans with this value before averaging?")
     group.add_argument("--skip-nans", action="store_true", help="skip nans when averaging?")
+    parser.add_argument("--average", choices=["points","zonal"], default="points", help="cross-flow averaging: mean of the ny interpolated points (default), or area-weighted mean of all source pixels in each section (zonal, also writes pixel counts and NaN fractions; glacier2d then only contains the grid)")
 
     group = parser.add_argument_group("Smoothing")
-    parser.add_argument("--smooth1d", type=int, default=0, help="half-window size of a Gaussian kernel to smooth glacier1d, default 0, no smoothing")
-    group.add_argument("--smooth2d",type=int, default=0, help="number of grid cells to use for smoothing 2-D field prior to interpolation. By default 0, no smoothing.")
+    group.add_argument("--smooth1d", type=float, default=0, help="standard deviation (in grid points) of a Gaussian kernel to smooth glacier1d, default 0, no smoothing")
+    group.add_argument("--smooth2d",type=float, default=0, help="standard deviation (in meters) of a Gaussian kernel to smooth 2-D fields prior to interpolation (NaN-aware, only a halo around the glacier is loaded). By default 0, no smoothing.")
 
     # outputs
     group = parser.add_argument_group("Outputs")
@@ -463,8 +1553,18 @@ def main():
     group.add_argument("--glacier1d",help="file name to write the averaged glacier1d")
     group.add_argument("-O","--overwrite", action="store_true", help="append by default, unless this is on") 
 
+    group = parser.add_argument_group("Batch mode")
+    group.add_argument("-j","--jobs", type=int, help="number of worker processes with --manifest (default: number of CPUs)")
+
     arg = parser.parse_args()
 
+    # =====================
+    # Batch mode
+    # =====================
+    if arg.manifest:
+        failed = run_manifest(arg.manifest, jobs=arg.jobs)
+        sys.exit(1 if failed else 0)
+
     # =====================
     # Create the mesh if not provided
     # =====================
@@ -487,13 +1587,7 @@ def main():
         sys.exit()
 
     if arg.lines is not None:
-        lines = json.load(open(arg.lines))
-        def _getl(key):
-            " get a line "
-            line = filter(lambda line: line['id'].lower() == key, lines)[0]
-            return Line([Point(pt['x']*1e3, pt['y']*1e3) for pt in line['values']])
-    # def make_2d_grid_from_contours(middle, left, right, dx, ny):
-        glacier_grid = make_2d_grid_from_contours(_getl('middle'), _getl('left'), _getl('right'), dx=arg.dx, ny=arg.ny)
+        glacier_grid = make_grid_from_lines(arg.lines, dx=arg.dx, ny=arg.ny, refine=arg.refine, dxmin=arg.dx_min, dxmax=arg.dx_max)
         # write to output
         if arg.write_grid:
             print("Write grid to", arg.write_grid)
@@ -511,82 +1605,22 @@ def main():
     # ===========================
     # Load (and interpolate) data
     # ===========================
-    l,r,b,t = _get_glacier_bbox(glacier_grid)
-    bbox = np.array([l,r,b,t])*1e3 # in meters
-
-    # load relevant icedata module
-    mod = getattr(icedata, arg.domain)
-    mod = getattr(mod, arg.dataset)
-
-    # check the need for projection (grid is assumed to be in BA2013)
-    grid_mapping = icedata.greenland.bamber2013.GRID_MAPPING
-    print(mod,arg.dataset)
-    transform = mod.GRID_MAPPING != grid_mapping
-    # transform = arg.mapping != 'BA2013'
-
-    def _fill_nans(dataset, val):
-        """ fill nan values ?
-        """
-        for k in dataset.keys():
-            dataset.values[np.isnan(dataset.values)] = val
-
-    def _smooth2d(dataset, val):
-            raise NotImplementedError("No Smoothing Yet")
-
-    variables = arg.variable.split(",")
-
-    # If data is defined on another grid, just transform the target glacier_grid to that other
-    # coordinate system and work on it
-    if transform:
-        # bbox2 = transform_bbox(bbox, grid_mapping, mod.GRID_MAPPING)
-        print("Transform grid from", grid_mapping, " to ",mod.GRID_MAPPING)
-        glacier_grid2, bbox2 = transform_grid(glacier_grid, grid_mapping, mod.GRID_MAPPING)
-        dataset = mod.load(variables, bbox=np.asarray(bbox2), maxshape=(arg.maxshape,arg.maxshape))
-        if arg.fill_nans is not None:
-            _fill_nans(dataset, arg.fill_nans)
-        # smooth2d ?
-        if arg.smooth2d > 0:
-            _smooth2d(dataset, arg.smooth2d)
-        # interpolate on glacier grid
-        interpolate_data_on_glacier_grid(dataset, glacier_grid2)
-        # now copy values on original glacier grid
-        for k in variables:
-            glacier_grid[k] = da.DimArray(glacier_grid2[k].values, axes=glacier_grid.axes)
-            glacier_grid[k].attrs.update(glacier_grid2[k].attrs)
-
-    else:
-        dataset = mod.load(variables, bbox=bbox, maxshape=(arg.maxshape,arg.maxshape))
-        if arg.fill_nans is not None:
-            _fill_nans(dataset, arg.fill_nans)
-        if arg.smooth2d > 0:
-            _smooth2d(dataset, arg.smooth2d)
-        interpolate_data_on_glacier_grid(dataset, glacier_grid)
-
-    # Rename variables?
-    if arg.short:
-        mapshort = {
-            "surface_elevation":"hs",
-            "bottom_elevation":"hb",
-            "bedrock_elevation":"zb",
-            "ice_thickness":"H",
-            "glacier_width":"W",
-            "surface_velocity":"U",
-        }
-        glacier_grid.rename_keys({k:mapshort.pop(k,k) for k in glacier_grid.keys()}, inplace=True)
-        print (glacier_grid.keys())
-    if arg.suffix or arg.prefix:
-        glacier_grid.rename_keys({k:arg.prefix+k+arg.suffix for k in glacier_grid.keys() if k not in ['x_coord','y_coord']}, inplace=True)
+    extraction = dict(dataset=arg.dataset, variables=arg.variable, prefix=arg.prefix, suffix=arg.suffix)
+    if arg.ensemble:
+        extraction['datasets'] = arg.dataset.split(",")
+    glacier2d, glacier1d = run_extractions(glacier_grid, [extraction], domain=arg.domain, maxshape=arg.maxshape, 
+                                           short=arg.short, fill_nans=arg.fill_nans, skipna=arg.skip_nans, 
+                                           smooth2d=arg.smooth2d, smooth1d=arg.smooth1d, average=arg.average)
 
     # Write grid data to disk (append to existing file by default)
     mode = "w" if arg.overwrite else "a+"
     if arg.glacier2d:
         print("Write glacier2d (interpolated, for debug) to", arg.glacier2d)
-        glacier_grid.write_nc(arg.glacier2d, mode=mode)
+        glacier2d.write_nc(arg.glacier2d, mode=mode)
 
     # Average toward a glacier1d?
     if arg.glacier1d:
         print("Write glacier1d to", arg.glacier1d)
-        glacier1d = glacier_crossflow_average(glacier_grid, skipna=arg.skip_nans)
         glacier1d.write_nc(arg.glacier1d, mode=mode)
 
     print("Done")
@@ -1,6 +1,7 @@
 """ Module to load outlet glacier regions
 """
 from __future__ import absolute_import, division
+import os
 import numpy as np
 
 # for the projections
@@ -9,6 +10,8 @@ from dimarray.geo.crs import get_crs
 
 # from . import cresis
 from . import boxdecker2011
+from .helper import memoize
+from .store import stored, file_identity
 
 # from .standard_dataset import MAPPING as MAPPING_SD
 from icedata.greenland.presentday import GRID_MAPPING as MAPPING_SD
@@ -58,11 +61,16 @@ def get_region(glacier=None, zoom=None, crs=None, **kwargs):
             urx, ury = crs.transform_point(urx, ury, crs0)
         return llx, lly, urx, ury
 
+    if zoom is None: zoom = ZOOM
+
+    # centres in the standard coordinate system are in the registry
+    if crs is None and not kwargs:
+        x, y = get_registry().center(glacier)
+        return np.array([x-zoom, y-zoom, x+zoom, y+zoom])
+
     if crs is None:
         crs = get_crs(MAPPING_SD)
 
-    if zoom is None: zoom = ZOOM
-
     # Return the box based on CRESIS grids
     if glacier in cresis.glaciers():
         return get_region_cresis(glacier, zoom, crs=crs)
@@ -71,6 +79,73 @@ def get_region(glacier=None, zoom=None, crs=None, **kwargs):
     else:
         return get_region_box(glacier, zoom=zoom, crs=crs, **kwargs)
 
+class RegionRegistry(object):
+    """ Centres of the glacier regions, indexed by name
+
+    Centres are projected on the standard grid (MAPPING_SD) once for all 
+    glaciers, and names normalized ahead of time, so that lookups do not 
+    load or transform anything (see get_registry).
+
+    Parameters
+    ----------
+    cresis : dict of {name: (x, y)} for CRESIS glaciers
+    boxdecker : dict of {normalized name: (x, y)} for Box and Decker 2011 
+        glaciers (see _strip_bd)
+    """
+    def __init__(self, cresis, boxdecker):
+        self.cresis = cresis
+        self.boxdecker = boxdecker
+
+    @classmethod
+    def build(cls):
+        """ load CRESIS grids and Box and Decker 2011 table, and project the centres
+        """
+        crs = get_crs(MAPPING_SD)
+
+        # CRESIS: centre of the grid
+        cresis_centers = {}
+        for nm in cresis.glaciers():
+            x0, y0, x1, y1 = get_region_cresis(nm, zoom=0., crs=crs)
+            cresis_centers[nm] = (float(x0), float(y0))
+
+        # Box and Decker 2011: all glaciers in one transform
+        table = _boxdecker2011_table()
+        lon = -np.asarray(table['Longitude_W'], dtype=float)
+        lat = np.asarray(table['Latitude_N'], dtype=float)
+        xyz = crs.transform_points(ccrs.Geodetic(), lon, lat)
+        boxdecker_centers = {_strip_bd(nm): (float(x), float(y)) for nm, x, y in zip(table.index, xyz[:,0], xyz[:,1])}
+
+        return cls(cresis_centers, boxdecker_centers)
+
+    def __contains__(self, name):
+        return name in self.cresis or _strip_bd(name) in self.boxdecker
+
+    def center(self, name):
+        """ x, y centre of a glacier region, in the standard coordinate system (KeyError if unknown)
+        """
+        # CRESIS grids first, as in get_region
+        if name in self.cresis:
+            return self.cresis[name]
+        return self.boxdecker[_strip_bd(name)]
+
+def regions_identity():
+    """ identity of the glacier regions table (Box and Decker 2011, see store.file_identity)
+    """
+    try:
+        return file_identity(os.path.join(os.path.dirname(boxdecker2011.__file__), 'boxdecker2011.json'))
+    except OSError:
+        return None
+
+@memoize(maxsize=1)
+def get_registry():
+    """ registry of glacier regions, built once (kept on disk across restarts, see store)
+    """
+    def build():
+        registry = RegionRegistry.build()
+        return registry.cresis, registry.boxdecker # plain data, to store
+    inputs = [regions_identity(), sorted(cresis.glaciers())]
+    return RegionRegistry(*stored('regions', inputs, build, code=(cresis,)))
+
 def _cresis_to_standard(xc, yc):
     """ convert cresis projection coordinate to standard projection coordinates
     """
@@ -142,12 +217,23 @@ def _strip_bd(nm):
         nm = nm[:nm.find('(')-1]
     return nm.lower().replace(' ','_')
 
+@memoize(maxsize=1)
+def _boxdecker2011_table():
+    """ Box and Decker 2011 data, loaded once
+    """
+    return boxdecker2011.load()
+
+@memoize(maxsize=1)
+def _boxdecker2011_names():
+    """ normalized names (see _strip_bd) to names in Box and Decker 2011 data
+    """
+    return {_strip_bd(k):k for k in _boxdecker2011_table().T.keys()}
+
 def get_boxdecker2011(name):
     """ return glacier from box and decker 2011
     """
-    box2011 = boxdecker2011.load() # load Box and Decker 2011 data
-    name_table = {_strip_bd(k):k for k in box2011.T.keys()}
-    bname = name_table[_strip_bd(name)]
+    box2011 = _boxdecker2011_table() # load Box and Decker 2011 data
+    bname = _boxdecker2011_names()[_strip_bd(name)]
     gl = box2011.ix[bname] # extract particular glacier
     return gl
 
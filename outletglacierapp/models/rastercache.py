@@ -0,0 +1,248 @@
+""" Raster cache shared by the server worker processes
+
+Rasters are stored as float32 .npy files in a cache directory (preferably on
+a memory file system such as /dev/shm), and memory-mapped read-only by every
+process which needs them: the operating system keeps a single copy in memory,
+however many workers attach to it. A small JSON index records the size of
+each entry, and the modification time of its directory its last use (updated
+without lock, at most every ATIME_INTERVAL seconds), so that the least recently
+used entries are evicted beyond a size limit. Loading a missing entry is done
+by one process only, others wait for it and attach to the result.
+
+The cache is off until configured with set_cache (see views), in which case
+cached() just calls the loading function.
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import warnings
+from contextlib import contextmanager
+
+import numpy as np
+import dimarray as da
+
+from helper import flock, makedirs
+
+INDEX = 'index.json'
+ATIME_INTERVAL = 60 # s, the last use of an entry is recorded at most that often
+
+class RasterCache(object):
+    """ Directory of memory-mapped arrays, shared between processes
+
+    Parameters
+    ----------
+    directory : cache directory, created if needed
+    maxbytes : max total size of the cached arrays (bytes)
+    """
+    def __init__(self, directory, maxbytes=2*1024**3):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        makedirs(directory)
+
+    def _entry(self, key):
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    def get(self, key):
+        """ arrays and metadata stored under key, or None
+
+        Returns
+        -------
+        arrays : dict of read-only memory-mapped arrays
+        meta : dict (json-serializable)
+        """
+        entry = self._entry(key)
+        path = os.path.join(self.directory, entry)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                stored = json.load(f)
+            arrays = {nm: np.load(os.path.join(path, fname), mmap_mode='r')
+                      for nm, fname in stored['arrays'].items()}
+        except (IOError, OSError, ValueError):
+            return None # missing, or evicted meanwhile
+        _touch(path)
+        return arrays, stored['meta']
+
+    def put(self, key, arrays, meta=None):
+        """ store arrays (floating-point rasters as float32) and metadata under key
+        """
+        entry = self._entry(key)
+        path = os.path.join(self.directory, entry)
+        tmp = os.path.join(self.directory, '.tmp-'+uuid.uuid4().hex)
+        os.makedirs(tmp)
+        stored = {'key': repr(key), 'meta': meta or {}, 'arrays': {}}
+        nbytes = 0
+        for i, nm in enumerate(sorted(arrays)):
+            a = np.asarray(arrays[nm])
+            if a.ndim >= 2 and np.issubdtype(a.dtype, np.floating):
+                a = a.astype(np.float32)
+            fname = '{}.npy'.format(i)
+            np.save(os.path.join(tmp, fname), a)
+            stored['arrays'][nm] = fname
+            nbytes += a.nbytes
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(stored, f)
+        try:
+            os.rename(tmp, path) # atomic: readers see all files or none
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True) # stored meanwhile by another process
+            return
+        with self._index() as index:
+            index[entry] = {'key': stored['key'], 'nbytes': nbytes, 'atime': time.time()}
+            self._evict(index, keep=entry)
+
+    def get_or_load(self, key, load):
+        """ arrays and metadata under key, calling load() -> (arrays, meta) if missing
+
+        Only one process loads a given key at a time, the others wait and
+        attach to the stored arrays.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        with flock(os.path.join(self.directory, '.'+self._entry(key)+'.lock')):
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            arrays, meta = load()
+            self.put(key, arrays, meta)
+        cached = self.get(key)
+        if cached is None:
+            warnings.warn("raster cache too small for "+repr(key))
+            return arrays, meta
+        return cached
+
+    def _evict(self, index, keep=None):
+        """ remove least recently used entries beyond maxbytes (index lock held)
+        """
+        total = sum(e['nbytes'] for e in index.values())
+        for entry in sorted(index, key=lambda e: self._atime(e, index)):
+            if total <= self.maxbytes:
+                break
+            if entry == keep:
+                continue
+            total -= index.pop(entry)['nbytes']
+            # processes which mapped the files keep them until they are done
+            path = os.path.join(self.directory, entry)
+            trash = os.path.join(self.directory, '.trash-'+uuid.uuid4().hex)
+            try:
+                os.rename(path, trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+
+    def _atime(self, entry, index):
+        """ last use of an entry (see _touch), or its creation if unknown
+        """
+        try:
+            return os.path.getmtime(os.path.join(self.directory, entry))
+        except OSError:
+            return index[entry]['atime']
+
+    @contextmanager
+    def _index(self):
+        """ read-modify-write the index, under lock
+        """
+        path = os.path.join(self.directory, INDEX)
+        with flock(path + '.lock'):
+            try:
+                with open(path) as f:
+                    index = json.load(f)
+            except (IOError, ValueError):
+                index = {}
+            yield index
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.rename(tmp, path)
+
+def _touch(path, interval=ATIME_INTERVAL):
+    """ record the use of an entry as the modification time of its directory,
+    if older than interval seconds: no lock nor write on most cache hits
+    """
+    try:
+        if time.time() - os.path.getmtime(path) > interval:
+            os.utime(path, None)
+    except OSError:
+        pass # evicted meanwhile
+
+_cache = None
+
+def set_cache(directory, maxbytes=2*1024**3):
+    """ configure the shared raster cache of this process (None to disable)
+    """
+    global _cache
+    _cache = RasterCache(directory, maxbytes) if directory else None
+
+def get_cache():
+    return _cache
+
+def cached(key, load):
+    """ DimArray or Dataset returned by load(), via the shared raster cache if configured
+
+    Parameters
+    ----------
+    key : hashable key with a stable repr (e.g. tuple of strings and numbers),
+        including the identity of the source files (see greenmap.dataset_identity):
+        the cache outlives the app, and is not invalidated otherwise
+    load : function returning a DimArray or a Dataset of 2-D arrays
+
+    Returns
+    -------
+    DimArray or Dataset, whose values are read-only memory-mapped float32
+    arrays if the cache is configured (copy before modifying in place)
+    """
+    if _cache is None:
+        return load()
+
+    def load_arrays():
+        return _to_arrays(load())
+
+    arrays, meta = _cache.get_or_load(key, load_arrays)
+    return _from_arrays(arrays, meta)
+
+def _to_arrays(obj):
+    """ flatten a DimArray or Dataset into arrays and json metadata
+    """
+    dataset = isinstance(obj, da.Dataset)
+    variables = obj if dataset else {'__dimarray__': obj}
+    arrays = {}
+    meta = {'dataset': dataset, 'variables': {}}
+    for nm in variables.keys():
+        dima = variables[nm]
+        arrays[nm] = dima.values
+        for ax in dima.axes:
+            arrays[nm+'/'+ax.name] = ax.values
+        meta['variables'][nm] = {'dims': list(dima.dims), 'attrs': _jsonable(dima.attrs)}
+    return arrays, meta
+
+def _from_arrays(arrays, meta):
+    variables = {}
+    for nm, info in meta['variables'].items():
+        axes = [da.Axis(arrays[nm+'/'+dim], dim) for dim in info['dims']]
+        dima = da.DimArray(arrays[nm], axes)
+        dima.attrs.update(info['attrs'])
+        variables[nm] = dima
+    if not meta['dataset']:
+        return variables['__dimarray__']
+    dataset = da.Dataset()
+    for nm in sorted(variables):
+        dataset[nm] = variables[nm]
+    return dataset
+
+def _jsonable(attrs):
+    """ attributes which survive a json round trip
+    """
+    out = {}
+    for k, v in attrs.items():
+        if isinstance(v, np.generic):
+            v = v.item()
+        try:
+            json.dumps(v)
+        except (TypeError, ValueError):
+            v = str(v)
+        out[k] = v
+    return out
@@ -0,0 +1,445 @@
+""" Persistent, content-addressed store of expensive intermediate results
+
+Results (reprojected rasters, velocity fields, meshes, interpolated fields...)
+are stored on disk under a key computed from everything they depend on: the
+identity of the source files (path, size and modification time, see
+file_identity), the bounding box and parameters of the computation, and the
+version of the code which computed it (see code_version). Unlike the raster
+cache, which lives in memory, stored results survive restarts.
+
+Entries are written to a temporary directory and renamed into place, so that
+readers never see partial entries. An index (sqlite) records the size and
+last use of each entry (at most every ATIME_INTERVAL seconds), and the least recently used entries are removed
+beyond a size limit. Any pipeline stage can opt in via stored() or the
+persistent decorator; the store is off until configured with set_store
+(see views), in which case results are just computed.
+
+Command line (list, inspect and prune the store):
+
+    python outletglacierapp/models/store.py list
+    python outletglacierapp/models/store.py prune --maxbytes 1e9 --older-than 30
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import uuid
+import shutil
+import pickle
+import sqlite3
+import hashlib
+import inspect
+import warnings
+from functools import wraps
+
+import numpy as np
+
+from helper import array_hash, flock, makedirs
+from rastercache import _to_arrays, _from_arrays, _jsonable, ATIME_INTERVAL
+
+# bump to invalidate all entries (e.g. storage format change)
+STORE_VERSION = 1
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    kind TEXT,
+    nbytes INTEGER,
+    created REAL,
+    atime REAL,
+    description TEXT
+)"""
+
+def _connect(dbpath):
+    conn = sqlite3.connect(dbpath, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute(_SCHEMA)
+    return conn
+
+#
+# Keys
+#
+def file_identity(path):
+    """ identity of a source file: absolute path, size and modification time
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return [path, st.st_size, st.st_mtime]
+
+_CODE_VERSIONS = {}
+
+def code_version(*objs):
+    """ hash of the source files defining functions, classes or modules
+
+    Any change in these files gives a new version, and invalidates the
+    entries computed with the previous one.
+    """
+    h = hashlib.sha1(str(STORE_VERSION).encode('utf-8'))
+    for obj in objs:
+        code = getattr(obj, '__code__', None)
+        try:
+            path = code.co_filename if code is not None else inspect.getsourcefile(obj)
+            if path.endswith('.pyc'):
+                path = path[:-1]
+            stamp = (path, os.path.getmtime(path))
+        except (TypeError, OSError):
+            # no source file (e.g. interactive session): the function's own bytecode
+            h.update(code.co_code if code is not None else repr(obj).encode('utf-8'))
+            continue
+        if stamp not in _CODE_VERSIONS:
+            with open(path, 'rb') as f:
+                _CODE_VERSIONS[stamp] = hashlib.sha1(f.read()).hexdigest()
+        h.update(_CODE_VERSIONS[stamp].encode('utf-8'))
+    return h.hexdigest()
+
+def _canonical(obj):
+    """ json-serializable version of obj, arrays replaced by their hash
+    """
+    if isinstance(obj, np.ndarray):
+        return {'__array__': array_hash(obj)}
+    if isinstance(getattr(obj, 'values', None), np.ndarray) and hasattr(obj, 'axes'):
+        return {'__dimarray__': array_hash(obj.values, *[ax.values for ax in obj.axes]), 'dims': list(obj.dims)}
+    if isinstance(obj, dict):
+        return [[str(k), _canonical(obj[k])] for k in sorted(obj)]
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if obj is None or isinstance(obj, (bool, int, long, float, str, unicode)):
+        return obj
+    return repr(obj)
+
+def store_key(kind, inputs, code=()):
+    """ key of a result from its kind, inputs and code (see code_version)
+
+    Parameters
+    ----------
+    kind : kind of result (e.g. 'mapdata', 'mesh')
+    inputs : anything the result depends on: parameters, bounding box,
+        file identities (see file_identity), arrays (hashed)...
+    code : functions or modules whose source defines the computation
+    """
+    text = json.dumps([kind, _canonical(inputs), code_version(*code)], sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+#
+# Store
+#
+class PersistentStore(object):
+    """ On-disk store of results (DimArray, Dataset, arrays, or any picklable object)
+
+    Parameters
+    ----------
+    directory : store directory, created if needed
+    maxbytes : max total size of the entries (bytes)
+    """
+    def __init__(self, directory, maxbytes=10*1024**3):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.dbpath = os.path.join(directory, 'index.db')
+        makedirs(os.path.join(directory, 'objects'))
+        makedirs(os.path.join(directory, 'tmp'))
+        _connect(self.dbpath).close()
+
+    def path(self, key):
+        return os.path.join(self.directory, 'objects', key[:2], key)
+
+    def get(self, key):
+        """ value stored under key, or None
+        """
+        path = self.path(key)
+        try:
+            value = _read(path)
+        except (IOError, OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None # missing, or removed meanwhile
+        now = time.time()
+        conn = _connect(self.dbpath)
+        try:
+            row = conn.execute("SELECT atime FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None:
+                # entry without index record (e.g. index removed): adopt it
+                conn.execute("INSERT OR IGNORE INTO entries VALUES (?,?,?,?,?,?)",
+                             (key, '', _du(path), now, now, ''))
+            elif now - row['atime'] > ATIME_INTERVAL:
+                # most hits only read the index: no write lock
+                conn.execute("UPDATE entries SET atime=? WHERE key=?", (now, key))
+        finally:
+            conn.close()
+        return value
+
+    def put(self, key, value, kind='', description=''):
+        """ store value under key, and remove least recently used entries beyond maxbytes
+        """
+        tmp = os.path.join(self.directory, 'tmp', uuid.uuid4().hex)
+        os.makedirs(tmp)
+        try:
+            nbytes = _write(tmp, value)
+            path = self.path(key)
+            makedirs(os.path.dirname(path))
+            try:
+                os.rename(tmp, path) # atomic: readers see the whole entry or nothing
+            except OSError:
+                return # stored meanwhile by another process
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        now = time.time()
+        conn = _connect(self.dbpath)
+        try:
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?)",
+                         (key, kind, nbytes, now, now, description[:200]))
+        finally:
+            conn.close()
+        self.prune(self.maxbytes, keep=key)
+
+    def get_or_compute(self, key, compute, kind='', description=''):
+        """ value under key, calling compute() and storing the result if missing
+
+        Only one process computes a given key at a time, the others wait.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with flock(os.path.join(self.directory, 'tmp', key+'.lock')):
+            value = self.get(key)
+            if value is not None:
+                return value
+            value = compute()
+            try:
+                self.put(key, value, kind=kind, description=description)
+            except (IOError, OSError, TypeError, pickle.PicklingError) as error:
+                warnings.warn("failed to store {} result: {}".format(kind, error))
+        return value
+
+    def entries(self, kind=None):
+        """ list of index records (dicts), least recently used first
+        """
+        conn = _connect(self.dbpath)
+        try:
+            if kind is None:
+                rows = conn.execute("SELECT * FROM entries ORDER BY atime").fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM entries WHERE kind=? ORDER BY atime", (kind,)).fetchall()
+        finally:
+            conn.close()
+        return [{k: row[k] for k in row.keys()} for row in rows]
+
+    def remove(self, key):
+        """ remove an entry (index record and files)
+        """
+        conn = _connect(self.dbpath)
+        try:
+            conn.execute("DELETE FROM entries WHERE key=?", (key,))
+        finally:
+            conn.close()
+        try:
+            os.remove(os.path.join(self.directory, 'tmp', key+'.lock'))
+        except OSError:
+            pass
+        path = self.path(key)
+        trash = os.path.join(self.directory, 'tmp', 'trash-'+uuid.uuid4().hex)
+        try:
+            os.rename(path, trash) # processes which mapped the files keep them
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def prune(self, maxbytes=None, older_than=None, kind=None, keep=None):
+        """ remove entries unused for more than older_than seconds, then the least
+        recently used ones until the total size is below maxbytes
+
+        Returns
+        -------
+        removed : list of removed index records
+        """
+        entries = self.entries()
+        total = sum(e['nbytes'] for e in entries)
+        now = time.time()
+        removed = []
+        for e in entries:
+            too_old = older_than is not None and now - e['atime'] > older_than
+            too_big = maxbytes is not None and total > maxbytes
+            if not too_old and not too_big:
+                continue
+            if e['key'] == keep or (kind is not None and e['kind'] != kind):
+                continue
+            self.remove(e['key'])
+            total -= e['nbytes']
+            removed.append(e)
+        return removed
+
+def _write(path, value):
+    """ write value into directory path, return its size (bytes)
+    """
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        arrays, meta, format = {'array': value}, {}, 'array'
+    elif hasattr(value, 'axes') or hasattr(value, 'dims'):
+        arrays, meta = _to_arrays(value) # DimArray or Dataset
+        meta['attrs'] = _jsonable(getattr(value, 'attrs', {}))
+        format = 'dimarray'
+    else:
+        arrays, meta, format = {}, {}, 'pickle'
+    if any(np.asarray(a).dtype == object for a in arrays.values()):
+        arrays, meta, format = {}, {}, 'pickle'
+
+    stored = {'format': format, 'meta': meta, 'arrays': {}}
+    for i, nm in enumerate(sorted(arrays)):
+        fname = '{}.npy'.format(i)
+        np.save(os.path.join(path, fname), np.asarray(arrays[nm]))
+        stored['arrays'][nm] = fname
+    if format == 'pickle':
+        with open(os.path.join(path, 'value.pkl'), 'wb') as f:
+            pickle.dump(value, f, protocol=2)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(stored, f)
+    return _du(path)
+
+def _read(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        stored = json.load(f)
+    if stored['format'] == 'pickle':
+        with open(os.path.join(path, 'value.pkl'), 'rb') as f:
+            return pickle.load(f)
+    arrays = {nm: np.load(os.path.join(path, fname), mmap_mode='r') for nm, fname in stored['arrays'].items()}
+    if stored['format'] == 'array':
+        return arrays['array']
+    value = _from_arrays(arrays, stored['meta'])
+    value.attrs.update(stored['meta'].get('attrs', {}))
+    return value
+
+def _du(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+#
+# Opt-in for pipeline stages
+#
+_store = None
+
+def set_store(directory, maxbytes=10*1024**3):
+    """ configure the persistent store of this process (None to disable)
+    """
+    global _store
+    _store = PersistentStore(directory, maxbytes) if directory else None
+
+def get_store():
+    return _store
+
+def stored(kind, inputs, compute, code=()):
+    """ result of compute(), via the persistent store if configured
+
+    Parameters
+    ----------
+    kind : kind of result (e.g. 'mapdata')
+    inputs : everything the result depends on (see store_key)
+    compute : function returning the result
+    code : functions or modules defining the computation (see code_version),
+        in addition to the module defining compute
+
+    Returns
+    -------
+    result, whose arrays are read-only memory-mapped if loaded from the
+    store (copy before modifying in place)
+    """
+    if _store is None:
+        return compute()
+    key = store_key(kind, inputs, code=(compute,)+tuple(code))
+    description = json.dumps(_canonical(inputs))[:200]
+    return _store.get_or_compute(key, compute, kind=kind, description=description)
+
+def persistent(kind, inputs=None, code=()):
+    """ decorator to keep the results of a function in the persistent store
+
+    Parameters
+    ----------
+    kind : kind of result
+    inputs : function inputs(*args, **kwargs) returning what the result
+        depends on, by default the arguments themselves
+    code : see stored
+
+    Examples
+    --------
+    >>> @persistent('velocity') # doctest: +SKIP
+    ... def load_velocity(dataset, maxshape=None):
+    ...     ...
+    """
+    def decorator(fun):
+        @wraps(fun)
+        def wrapper(*args, **kwargs):
+            deps = inputs(*args, **kwargs) if inputs is not None else [args, kwargs]
+            return stored(kind, deps, lambda : fun(*args, **kwargs), code=(fun,)+tuple(code))
+        return wrapper
+    return decorator
+
+#
+# Command line
+#
+def _size(nbytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if nbytes < 1024:
+            return "{:.0f} {}".format(nbytes, unit)
+        nbytes /= 1024.
+    return "{:.1f} TB".format(nbytes)
+
+def _age(t):
+    days = (time.time() - t)/(24*3600.)
+    return "{:.1f} d".format(days) if days >= 1 else "{:.1f} h".format(days*24)
+
+def main(argv=None):
+    import argparse
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'appdata', 'store')
+    parser = argparse.ArgumentParser(description="Inspect and prune the persistent store of intermediate results")
+    parser.add_argument("--directory", default=os.path.normpath(default), help="store directory (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    sub = subparsers.add_parser("list", help="list entries, least recently used first")
+    sub.add_argument("--kind", help="only entries of that kind")
+
+    subparsers.add_parser("info", help="number and size of entries per kind")
+
+    sub = subparsers.add_parser("prune", help="remove old entries, or least recently used ones beyond a size")
+    sub.add_argument("--maxbytes", type=float, help="remove least recently used entries beyond that size")
+    sub.add_argument("--older-than", type=float, help="remove entries unused for that many days")
+    sub.add_argument("--kind", help="only entries of that kind")
+    sub.add_argument("--dry-run", action="store_true", help="only show what would be removed")
+
+    sub = subparsers.add_parser("clear", help="remove all entries")
+    sub.add_argument("--kind", help="only entries of that kind")
+
+    o = parser.parse_args(argv)
+    store = PersistentStore(o.directory)
+
+    if o.command == "list":
+        for e in store.entries(o.kind):
+            print(e['key'][:12], "{:<10} {:>8} {:>8} {:>8}".format(e['kind'], _size(e['nbytes']),
+                  _age(e['created']), _age(e['atime'])), e['description'][:80])
+
+    elif o.command == "info":
+        kinds = {}
+        for e in store.entries():
+            count, nbytes = kinds.get(e['kind'], (0, 0))
+            kinds[e['kind']] = (count + 1, nbytes + e['nbytes'])
+        for kind in sorted(kinds):
+            print("{:<10} {:>6} entries {:>10}".format(kind, kinds[kind][0], _size(kinds[kind][1])))
+        print("total      {:>6} entries {:>10}".format(sum(c for c, _ in kinds.values()),
+                                                       _size(sum(n for _, n in kinds.values()))))
+
+    elif o.command == "prune":
+        if o.maxbytes is None and o.older_than is None:
+            parser.error("prune needs --maxbytes and/or --older-than")
+        older_than = o.older_than*24*3600 if o.older_than is not None else None
+        if o.dry_run:
+            entries = store.entries(o.kind)
+            total = sum(e['nbytes'] for e in store.entries())
+            for e in entries:
+                if (older_than is not None and time.time() - e['atime'] > older_than) \
+                        or (o.maxbytes is not None and total > o.maxbytes):
+                    total -= e['nbytes']
+                    print("would remove", e['key'][:12], e['kind'], _size(e['nbytes']))
+            return
+        removed = store.prune(o.maxbytes, older_than=older_than, kind=o.kind)
+        print("removed {} entries ({})".format(len(removed), _size(sum(e['nbytes'] for e in removed))))
+
+    elif o.command == "clear":
+        removed = store.prune(0, kind=o.kind)
+        print("removed {} entries ({})".format(len(removed), _size(sum(e['nbytes'] for e in removed))))
+
+if __name__ == '__main__':
+    main()
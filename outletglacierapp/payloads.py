@@ -0,0 +1,161 @@
+""" Compact JSON payloads for large arrays (mesh, glacier profiles)
+
+By default, routes return one {'x':..., 'y':...} object per point. With
+?format=columnar, they return shared coordinate arrays and one array per
+variable instead, and with &encoding=base64 each array is sent as binary
+little-endian float32 (a javascript Float32Array), which is several times
+smaller than its decimal representation.
+
+Large responses are encoded incrementally and, if the client accepts it,
+compressed on the fly with gzip or deflate (see json_response).
+"""
+import json
+import zlib
+import base64
+import numpy as np
+from flask import Response
+
+FORMATS = ['points', 'columnar']
+ENCODINGS = ['list', 'base64']
+
+def get_format(args):
+    """ payload format and array encoding requested in the query string
+
+    Parameters
+    ----------
+    args : request.args
+
+    Returns
+    -------
+    format : 'points' (default) or 'columnar'
+    encoding : 'list' (default) or 'base64', only used with 'columnar'
+    """
+    format = args.get('format', 'points')
+    encoding = args.get('encoding', 'list')
+    if format not in FORMATS:
+        raise ValueError("format must be one of {}, got {}".format(FORMATS, format))
+    if encoding not in ENCODINGS:
+        raise ValueError("encoding must be one of {}, got {}".format(ENCODINGS, encoding))
+    return format, encoding
+
+def encode_array(values, encoding='list'):
+    """ json-serializable representation of a numerical array
+
+    Parameters
+    ----------
+    values : array-like
+    encoding : 'list' for (nested) lists of numbers, NaN as null, or 'base64'
+        for a dict with 'dtype', 'shape' and 'data', the base64-encoded
+        bytes of the little-endian float32 array in C order (NaN preserved)
+
+    Returns
+    -------
+    list or dict
+    """
+    values = np.asarray(values, dtype=float)
+    if encoding == 'base64':
+        data = np.ascontiguousarray(values, dtype='<f4')
+        return {'dtype': 'float32', 'shape': list(data.shape), 'data': base64.b64encode(data.tostring())}
+    if encoding != 'list':
+        raise ValueError("unknown encoding: "+repr(encoding))
+    if np.all(np.isfinite(values)):
+        return values.tolist()
+    values = values.astype(object)
+    values[~np.isfinite(values.astype(float))] = None
+    return values.tolist()
+
+# content codings, by order of preference, with their zlib wbits
+CODINGS = [('gzip', 16 + zlib.MAX_WBITS), ('deflate', zlib.MAX_WBITS)]
+CHUNKSIZE = 64*1024 # bytes, passed to the compressor at once
+
+def accepted_coding(accept_encoding):
+    """ preferred content coding accepted by the client, among CODINGS
+
+    Parameters
+    ----------
+    accept_encoding : value of the Accept-Encoding request header
+
+    Returns
+    -------
+    'gzip', 'deflate' or None
+    """
+    accepted = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        q = 1.
+        for param in parts[1:]:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.
+        accepted[name] = q
+    for name, _ in CODINGS:
+        if accepted.get(name, accepted.get('*', 0.)) > 0:
+            return name
+    return None
+
+def _iter_chunks(pieces, chunksize=CHUNKSIZE):
+    """ group many small strings into chunks of about chunksize bytes
+    """
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunksize:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+def _compress(chunks, coding, level):
+    wbits = dict(CODINGS)[coding]
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def json_response(data, accept_encoding='', min_size=16*1024, level=1, status=200):
+    """ JSON response encoded incrementally, and compressed if large enough
+
+    The JSON text is produced piece by piece (json.JSONEncoder.iterencode)
+    and streamed, rather than built as one string. Responses of at least 
+    min_size bytes are compressed on the fly if the client accepts gzip or 
+    deflate; smaller ones are sent as is, since compression would not pay off.
+
+    Parameters
+    ----------
+    data : json-serializable object
+    accept_encoding : value of the Accept-Encoding request header
+    min_size : minimum size (bytes) of the JSON text to compress
+    level : zlib compression level, low values favour latency
+    status : HTTP status code
+
+    Returns
+    -------
+    flask Response
+    """
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    # the first chunk is only shorter than min_size if it is the whole text
+    chunks = _iter_chunks(encoder.iterencode(data), chunksize=max(min_size, CHUNKSIZE))
+    first = next(chunks, '')
+    headers = {'Vary': 'Accept-Encoding'}
+
+    coding = accepted_coding(accept_encoding) if len(first) >= min_size else None
+    if coding is None:
+        if len(first) < min_size:
+            return Response(first, status=status, mimetype='application/json', headers=headers)
+        body = _chain(first, chunks)
+    else:
+        body = _compress(_chain(first, chunks), coding, level)
+        headers['Content-Encoding'] = coding
+    return Response(body, status=status, mimetype='application/json', headers=headers)
+
+def _chain(first, rest):
+    yield first
+    for chunk in rest:
+        yield chunk
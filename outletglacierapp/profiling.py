@@ -0,0 +1,157 @@
+""" Opt-in profiling of single requests
+
+A request is profiled if config.profiling is on, and the request has a
+`profile` query parameter or an `X-Profile` header, from an allowed address
+(config.profile_hosts) and with the right token if one is configured
+(config.profile_token). It then runs under cProfile (deterministic), and a
+report is written to config.profiledir: total time, own time spent in I/O,
+waiting (locks, sleep) and compute, top functions, and the call tree below
+the most expensive ones, together with the raw statistics (.prof, to open
+with pstats or snakeviz). The response links to the report in the
+X-Profile-Report header. Other requests are not affected.
+"""
+import os
+import re
+import time
+import uuid
+import pstats
+import cProfile
+
+try:
+    from StringIO import StringIO # python 2
+except ImportError:
+    from io import StringIO
+
+import config
+
+# own time of functions is classified by file (python functions) or name (built-ins)
+IO_FILES = re.compile(r'netCDF4|npyio|numpy/lib/format|socket|ssl|sqlite3|pickle|json|gzip|shutil|codecs|/io\.py|tempfile')
+IO_BUILTINS = re.compile(r"netCDF4|'read|'write|readline|open|stat|listdir|rename|remove|unlink|flush|fsync|recv|send|'load'|'dump'|mmap")
+WAIT_BUILTINS = re.compile(r"acquire|sleep|flock|'wait'|select|poll|lockf")
+
+_VALID_ID = re.compile(r'^[0-9a-z-]+$')
+
+def requested(request):
+    """ True if the request asks to be profiled
+    """
+    return 'profile' in request.args or 'X-Profile' in request.headers
+
+def allowed(request):
+    """ True if the request may be profiled (see config)
+    """
+    if not config.profiling:
+        return False
+    if config.profile_hosts is not None and request.remote_addr not in config.profile_hosts:
+        return False
+    if config.profile_token is not None:
+        token = request.headers.get('X-Profile') or request.args.get('profile')
+        if token != config.profile_token:
+            return False
+    return True
+
+class RequestProfile(object):
+    """ Profile of one request, saved as a report
+
+    Parameters
+    ----------
+    name : description of the request (e.g. method and url)
+    directory : where reports are written, by default config.profiledir
+    """
+    def __init__(self, name, directory=None):
+        self.name = name
+        self.directory = directory or config.profiledir
+        self.id = time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:8]
+        self.profiler = cProfile.Profile()
+        self.start = time.time()
+        self.finished = False
+
+    def enable(self):
+        self.profiler.enable()
+
+    def disable(self):
+        self.profiler.disable()
+
+    def wrap(self, iterable):
+        """ profile the production of a streamed response, and finish when done
+        """
+        iterator = iter(iterable)
+        try:
+            while True:
+                self.enable()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    self.disable()
+                yield chunk
+        finally:
+            self.finish()
+
+    def finish(self):
+        """ stop profiling and write the report (once)
+        """
+        if self.finished:
+            return
+        self.finished = True
+        self.disable()
+        wall = time.time() - self.start
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.profiler.dump_stats(os.path.join(self.directory, self.id+'.prof'))
+        with open(os.path.join(self.directory, self.id+'.txt'), 'w') as f:
+            f.write(report(self.profiler, self.name, wall))
+        _prune(self.directory, config.profile_keep)
+
+def report(profiler, name, wall, top=25):
+    """ text report of a profile: time per category, top functions and call tree
+    """
+    stream = StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+
+    categories = {'compute': 0., 'io': 0., 'wait': 0.}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        categories[_category(func)] += tt
+    total = sum(categories.values()) or 1.
+
+    stream.write("{}\n\n".format(name))
+    stream.write("wall time: {:.3f} s, profiled: {:.3f} s\n".format(wall, stats.total_tt))
+    stream.write("own time by category:\n")
+    for cat in ['compute', 'io', 'wait']:
+        stream.write("    {:<8} {:8.3f} s {:5.1f} %\n".format(cat, categories[cat], 100*categories[cat]/total))
+
+    stream.write("\n=== top functions by own time ===\n")
+    stats.sort_stats('tottime').print_stats(top)
+    stream.write("\n=== top functions by cumulative time ===\n")
+    stats.sort_stats('cumulative').print_stats(top)
+    stream.write("\n=== call tree: callees of the top functions by cumulative time ===\n")
+    stats.sort_stats('cumulative').print_callees(top//2)
+    return stream.getvalue()
+
+def _category(func):
+    filename, lineno, funcname = func
+    if filename == '~': # built-in
+        if WAIT_BUILTINS.search(funcname):
+            return 'wait'
+        if IO_BUILTINS.search(funcname):
+            return 'io'
+        return 'compute'
+    return 'io' if IO_FILES.search(filename.replace(os.sep, '/')) else 'compute'
+
+def report_path(id, ext='.txt'):
+    """ path of a saved report (ValueError if the id is invalid)
+    """
+    if not _VALID_ID.match(id):
+        raise ValueError("invalid report id: "+repr(id))
+    return os.path.join(config.profiledir, id+ext)
+
+def _prune(directory, keep):
+    """ keep the most recent reports
+    """
+    reports = sorted(f[:-4] for f in os.listdir(directory) if f.endswith('.txt'))
+    for id in reports[:max(0, len(reports)-keep)]:
+        for ext in ['.txt', '.prof']:
+            try:
+                os.remove(os.path.join(directory, id+ext))
+            except OSError:
+                pass
@@ -975,9 +975,11 @@ drawing.meshglacier = function() {
     console.log('meshform')
     console.log(form)
     $.post('/mesh', form, function(json) {
-      console.log('mesh ok. fetch it')
+      jobs.follow(json, function(json) {
+        console.log('mesh ok. fetch it')
         console.log(json)
         window.open('/viewmesh', '_self') 
+      })
     })
   })
 }
@@ -1009,36 +1011,120 @@ drawing.downloadLines = function() {
 drawing.linesURL = '/lines';
 
 drawing.getLinesFromServer = function() {
-  $.getJSON(drawing.linesURL, function(json) { drawing.addLines(json.lines) })
+  $.getJSON(drawing.linesURL, function(json) { 
+    drawing.addLines(json.lines);
+    drawing.setSynced(json.lines, json.version);
+  })
+}
+
+// lines as last saved on the server, and their version: only changes are sent
+drawing.synced = null;
+
+drawing.setSynced = function(lines, version) {
+  drawing.synced = {
+    version: version,
+    lines: lines.map(function(line) {
+      return {id: line.id, values: line.values.map(function(pt) {return {x:pt.x, y:pt.y};})};
+    })
+  };
+}
+
+// operations (see linestore.py) which turn old lines into new lines,
+// or null if the line order changed (send all lines instead)
+drawing.diffLines = function(oldlines, newlines) {
+  var ops = [];
+  var newids = newlines.map(function(line) {return line.id;});
+  var kept = oldlines.filter(function(line) {return newids.indexOf(line.id) !== -1;});
+  var keptids = kept.map(function(line) {return line.id;});
+  oldlines.forEach(function(line) {
+    if (newids.indexOf(line.id) === -1) ops.push({op:'remove', line:line.id});
+  });
+  var existing = newids.filter(function(id) {return keptids.indexOf(id) !== -1;});
+  if (existing.join('\n') !== keptids.join('\n')) return null;
+
+  var same = function(a, b) {return a.x === b.x && a.y === b.y;};
+
+  newlines.forEach(function(line, k) {
+    var i = keptids.indexOf(line.id);
+    if (i === -1) {
+      ops.push({op:'set', line:line.id, points:line.values, position:k});
+      return;
+    }
+    // only send the points between the common start and end of the line
+    var a = kept[i].values, b = line.values;
+    var p = 0, q = 0;
+    while (p < a.length && p < b.length && same(a[p], b[p])) p++;
+    while (q < a.length-p && q < b.length-p && same(a[a.length-1-q], b[b.length-1-q])) q++;
+    var na = a.length-p-q, nb = b.length-p-q;
+    if (na === nb) {
+      if (nb) ops.push({op:'move', line:line.id, index:p, points:b.slice(p, p+nb)});
+    } else {
+      if (na) ops.push({op:'delete', line:line.id, index:p, count:na});
+      if (nb) ops.push({op:'insert', line:line.id, index:p, points:b.slice(p, p+nb)});
+    }
+  });
+  return ops;
+}
+
+function onLinesError( xhr, status, errorThrown ) {
+  var w = window.open(null, "_self")
+  w.document.write(xhr.responseText)
+  w.document.close()
+  console.log( "Error: " + errorThrown );
+  console.log( "Status: " + status );
+  console.dir( xhr );
+  alert( "Error when saving lines to server." );
 }
 
 drawing.postLinesToServer = function(success) {
   console.log("===>>>> post lines to server")
-  console.log(drawing)
-  console.log(drawing.getLines)
   var data = drawing.getLines();
-  // save lines on validation
+  var ops = drawing.synced && drawing.diffLines(drawing.synced.lines, data);
+
+  if (!ops) {
+    // save all lines
+    $.ajax({
+      url: drawing.linesURL,
+      data: JSON.stringify(data),
+      type: "POST",
+      // dataType : "json",
+      contentType:'application/json',
+      accepts : ["text/html","application/json"], // so that html is also accepted as a response
+      success: function(json) {
+        drawing.setSynced(data, json.version);
+        if (success) success(json);
+      },
+      error: onLinesError
+    });
+    return;
+  }
+
+  if (!ops.length) {
+    if (success) success();
+    return;
+  }
+
+  // save changes only
   $.ajax({
     url: drawing.linesURL,
-    data: JSON.stringify(data),
-    type: "POST",
-    // dataType : "json",
+    data: JSON.stringify({version: drawing.synced.version, ops: ops}),
+    type: "PATCH",
     contentType:'application/json',
-    accepts : ["text/html","application/json"], // so that html is also accepted as a response
-    // contentType:'text/html',
-    success: success,
+    success: function(json) {
+      drawing.setSynced(data, json.version);
+      if (success) success(json);
+    },
     error: function( xhr, status, errorThrown ) {
-      var w = window.open(null, "_self")
-      w.document.write(xhr.responseText)
-      w.document.close()
-      console.log( "Error: " + errorThrown );
-      console.log( "Status: " + status );
-      console.dir( xhr );
-      alert( "Error when saving lines to server." );
+      if (xhr.status !== 409) return onLinesError(xhr, status, errorThrown);
+      // lines were saved meanwhile from another window
+      if (confirm("Lines were modified in another window. Overwrite them with these ones?")) {
+        drawing.synced = null; // save all lines
+        drawing.postLinesToServer(success);
+      } else {
+        window.location.reload();
+      }
     }
   });
-  // console.log(data)
-  // $.post('/lines', JSON.stringify(data), success);
 }
     
 
@@ -24,7 +24,7 @@ glacier1d.makeit = function(callback) {
     data: formdata,
     type: "POST",
     dataType : "json",
-    success: function( json ) {
+    success: function( json ) { jobs.follow(json, function( json ) {
       console.log('glacier data received OK');
       $('#refresh-glacier1d').button('reset')
       glacier1d.json = json;
@@ -32,7 +32,7 @@ glacier1d.makeit = function(callback) {
       // if (map) {
       //   glacier1d.focusMap();
       // }
-    },
+    })},
     error: function( xhr, status, errorThrown ) {
       $('#refresh-glacier1d').button('reset')
       var w = window.open(null, "_self")
@@ -49,8 +49,9 @@ glacier1d.makeit = function(callback) {
 
 glacier1d.vizualizeit = function() {
   // normally not used, vizualize currently stored glacier1d
-  d3.json("/figure/glacier1d", function(error, json) {
+  d3.json("/figure/glacier1d?" + $.param(payload.params), function(error, json) {
     if (error) return console.warn(error);
+    json = payload.glacier1d(json);
     glacier1d.json = json;
     glacier1d.subplots = glacier1d.GlacierChart(json);
     // if (map) {
@@ -29,6 +29,7 @@ function initialize() {
   // get line data 
   lines = [];
   $.getJSON('/lineslonglat', function(json) {
+    drawing.setSynced(json.longlatlines, json.version);
     json.longlatlines.forEach(function(line) {
       var gpoints = line.values.map(function(pt) {
         return new google.maps.LatLng(pt.y, pt.x);
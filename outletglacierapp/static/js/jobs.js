@@ -0,0 +1,24 @@
+/*******************************************************
+ * Follow background jobs (server option background_jobs)
+ *******************************************************/
+var jobs = {};
+jobs.interval = 1000; // ms between status requests
+
+// Call callback with the response of a POST: directly if the server
+// computed it synchronously, or once the background job is done.
+jobs.follow = function(json, callback, onprogress) {
+  if (json === undefined || json.job === undefined) {
+    return callback(json);
+  }
+  $.getJSON(json.status_url, function(status) {
+    if (onprogress) onprogress(status);
+    if (status.status === 'done') {
+      $.getJSON(status.result_url, callback);
+    } else if (status.status === 'failed') {
+      console.log(status.error);
+      alert("Job failed on the server: " + status.error);
+    } else {
+      setTimeout(function() { jobs.follow(json, callback, onprogress); }, jobs.interval);
+    }
+  });
+}
@@ -16,9 +16,9 @@ var mesh = {}; // deal with mesh
 
 mesh.init = function() {
   mesh.chart = mesh.MeshChart(map.chart.svg, map.chart.x, map.chart.y, {zoom:map.chart.zoom});
-  $.getJSON('/mesh', function(json) {
+  $.getJSON('/mesh', payload.params, function(json) {
     console.log('received mesh data')
-    mesh.chart.data(json.mesh)
+    mesh.chart.data(payload.mesh(json).mesh)
       .call()
   })
   mesh.add_UI();
@@ -153,10 +153,12 @@ mesh.remesh = function() {
   console.log(form)
   $('#remesh-btn').button('loading')
   $.post('/mesh', form, function(json) {
-    $('#remesh-btn').button('reset')
-    mesh.chart.data(json.mesh) // update mesh
-    .call()
-    glacier1d.makeit();
+    jobs.follow(json, function(json) {
+      $('#remesh-btn').button('reset')
+      mesh.chart.data(json.mesh) // update mesh
+      .call()
+      glacier1d.makeit();
+    })
   })
 }
 
@@ -164,8 +166,8 @@ mesh.remesh = function() {
 mesh.extractOutline = function() {
   var form = $("#mesh-form").serializeArray();
   console.log(form)
-  $.get('/meshoutline', form, function(json) {
-    json.lines.forEach(function(line,i){
+  $.get('/meshoutline', form.concat([{name:'format', value:'columnar'}, {name:'encoding', value:'base64'}]), function(json) {
+    payload.lines(json).lines.forEach(function(line,i){
       drawing.linecharts[i].id(line.id);
       drawing.linecharts[i].data(line.values)();
     })
@@ -204,6 +206,7 @@ mesh.meshGeneratorChart = function() {
   // add mesh generator
   $.getJSON('/lines', function(json) {
     console.log('received lines data')
+    drawing.setSynced(json.lines, json.version);
 
     json.lines.forEach(function(line) {
       var linechart = drawing.drawLine(
@@ -0,0 +1,58 @@
+/*******************************************************
+ * Decode columnar responses (?format=columnar) into the
+ * per-point structures used by the charts
+ *******************************************************/
+var payload = {};
+payload.params = {format: 'columnar', encoding: 'base64'};
+
+// decode an array from the server: list, or base64 float32 with shape
+payload.decode = function(col) {
+  if (col === null || col.data === undefined) return col;
+  var bin = atob(col.data);
+  var bytes = new Uint8Array(bin.length);
+  for (var i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+  var flat = new Float32Array(bytes.buffer);
+  if (col.shape.length < 2) return Array.prototype.slice.call(flat);
+  var n = col.shape[1], rows = [];
+  for (var i = 0; i < col.shape[0]; i++) {
+    rows.push(Array.prototype.slice.call(flat.subarray(i*n, (i+1)*n)));
+  }
+  return rows;
+}
+
+// /figure/glacier1d: sources[name].values as [{x, y}]
+payload.glacier1d = function(json) {
+  if (json.format !== 'columnar') return json;
+  var x = payload.decode(json.x);
+  var missing = Math.fround(json.missing_values); // float32 precision
+  for (var name in json.sources) {
+    var values = payload.decode(json.sources[name]);
+    json.sources[name] = {
+      missing_values: json.missing_values,
+      values: values.map(function(y, i) {
+        return {x: x[i], y: (Math.fround(y) === missing) ? json.missing_values : y};
+      })
+    };
+  }
+  return json;
+}
+
+// /mesh: mesh as [[{x, y, s}]], one list per section
+payload.mesh = function(json) {
+  if (json.format !== 'columnar') return json;
+  var s = payload.decode(json.mesh.s), x = payload.decode(json.mesh.x), y = payload.decode(json.mesh.y);
+  json.mesh = x.map(function(xs, i) {
+    return xs.map(function(xij, j) { return {x: xij, y: y[i][j], s: s[i]}; });
+  });
+  return json;
+}
+
+// /meshoutline: lines as [{id, values:[{x, y}]}]
+payload.lines = function(json) {
+  if (json.format !== 'columnar') return json;
+  json.lines = json.lines.map(function(line) {
+    var x = payload.decode(line.x), y = payload.decode(line.y);
+    return {id: line.id, values: x.map(function(xi, i) { return {x: xi, y: y[i]}; })};
+  });
+  return json;
+}
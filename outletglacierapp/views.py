@@ -2,20 +2,46 @@
 """
 from outletglacierapp import app
 import os
-import warnings
+import shutil
 import itertools
-import json
 import numpy as np
 
-from flask import Flask, redirect, url_for, render_template, request, jsonify, flash, session, abort, make_response, send_from_directory
+from flask import Flask, redirect, url_for, render_template, request, jsonify, flash, session, abort, send_from_directory, g, send_file
 from forms import MapForm, FlowLineForm, ExtractForm, MeshForm
-from config import glacier_choices, datadir
+from config import glacier_choices
+import config
 
 import dimarray as da
-from models.greenmap import get_dict_data, get_json_data, _load_data, get_coords
+from models.greenmap import get_dict_data, _load_data, get_coords, dataset_identity
 from models.flowline import compute_one_flowline
-from models.mesh import make_2d_grid_from_contours, Point, Line, extractglacier1d
+from models.mesh import make_2d_grid_from_contours, Point, Line, extractglacier1d, refine_spacing, REFINE
 from models.glacier1d import massbalance_diag
+from models.artifacts import ArtifactWriter
+from models.rastercache import set_cache
+from models.store import set_store, stored
+from models.budget import clamp_map, clamp_mesh, line_length, MemoryGuard, OverWatermark
+from workspace import get_workspace, maybe_collect_garbage
+from linestore import LineStore, VersionConflict
+from jobs import get_queue, input_key, file_hash, DONE
+from payloads import get_format, encode_array, json_response
+import profiling
+
+set_cache(config.rastercachedir, config.rastercache_maxbytes)
+set_store(config.storedir, config.store_maxbytes)
+
+_memory = MemoryGuard(config.memory_watermark)
+
+_artifact_writer = None
+
+def get_artifacts():
+    """ function to write intermediate datasets of one extraction, if enabled in config
+    """
+    global _artifact_writer
+    if not config.debug_artifacts:
+        return None
+    if _artifact_writer is None:
+        _artifact_writer = ArtifactWriter(config.artifactdir)
+    return _artifact_writer.bind()
 
 def flash_errors(form):
     for field, errors in form.errors.items():
@@ -25,23 +51,125 @@ def flash_errors(form):
                 error
             ))
 
+@app.before_request
+def remove_stale_workspaces():
+    maybe_collect_garbage(keep=[session.get('workspace')])
+
+#
+# Profiling of single requests, on demand (see profiling.py)
+#
+@app.before_request
+def start_profile():
+    if not config.profiling or not profiling.requested(request):
+        return
+    if not profiling.allowed(request):
+        abort(403, "profiling not allowed (see config.profiling)")
+    g.profile = profiling.RequestProfile(request.method+' '+request.url)
+    g.profile.enable()
+
+@app.after_request
+def stop_profile(response):
+    profile = getattr(g, 'profile', None)
+    if profile is None:
+        return response
+    profile.disable()
+    response.headers['X-Profile-Report'] = url_for('profile_report', id=profile.id)
+    if response.is_streamed:
+        response.response = profile.wrap(response.response) # until the stream ends
+    else:
+        profile.finish()
+    return response
+
+@app.teardown_request
+def abort_profile(error=None):
+    profile = getattr(g, 'profile', None)
+    if profile is not None and error is not None:
+        profile.finish()
+
+@app.route('/profiles/<id>')
+def profile_report(id):
+    """ text report of a profiled request, or raw statistics with ?format=prof
+    """
+    if not config.profiling:
+        abort(404)
+    prof = request.args.get('format') == 'prof'
+    try:
+        path = profiling.report_path(id, '.prof' if prof else '.txt')
+    except ValueError:
+        abort(404)
+    if not os.path.exists(path):
+        abort(404)
+    if prof:
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True)
+    return send_file(path, mimetype='text/plain')
+
+def stream_jsonify(**data):
+    """ same as jsonify, for large responses: streamed, and compressed if accepted
+    """
+    return json_response(data, request.headers.get('Accept-Encoding', ''), 
+                         min_size=config.compress_min_size, level=config.compress_level)
+
+def request_format():
+    """ payload format and encoding requested (see payloads.get_format), or abort with 400
+    """
+    try:
+        return get_format(request.args)
+    except ValueError as error:
+        abort(400, str(error))
+
+#
+# Admission control, from the predicted cost of requests (see models/budget.py)
+#
+def admit(estimate):
+    """ cost of a request within the budget (config.budget_policy), or abort with 400
+    (OverWatermark, i.e. 503, if the process has no memory left)
+
+    Parameters
+    ----------
+    estimate : function estimate(maxbytes, maxwork) returning the Cost of the
+        request, with parameters clamped to fit these bounds (None: no bound)
+
+    Returns
+    -------
+    Cost, whose params are the parameters to use
+    """
+    policy = config.budget_policy
+    maxbytes, maxwork = config.request_maxbytes, config.request_maxwork
+    try:
+        cost = estimate(None, None)
+        if policy == 'clamp':
+            available = _memory.available()
+            if available is not None and available <= 0:
+                raise OverWatermark(cost.bytes, available) # nothing left to clamp to
+            if available is not None:
+                maxbytes = available if maxbytes is None else min(maxbytes, available)
+            cost = estimate(maxbytes, maxwork)
+    except ValueError as error:
+        abort(400, str(error))
+    if policy is not None and not cost.fits(config.request_maxbytes, maxwork):
+        abort(400, "request over budget: {}, reduce its resolution or extent".format(cost))
+    return cost
+
+def reserve(cost):
+    """ reserve the memory of a request while it runs (503 if over the watermark)
+    """
+    return _memory.reserve(cost.bytes if config.budget_policy is not None else 0)
+
+@app.errorhandler(OverWatermark)
+def server_busy(error):
+    response = jsonify(error=str(error))
+    response.status_code = 503
+    response.headers['Retry-After'] = '10'
+    return response
+
 def getmeshpath(session):
-    if 'mesh2d' not in session:
-        session['mesh2d'] = 'mesh2d.nc'
-    return os.path.join(datadir, session['mesh2d'])
+    return get_workspace(session).path('mesh2d.nc')
 
 def getglacierpath(session):
-    if 'glacier1d' not in session:
-        session['glacier1d'] = 'glacier1d.nc'
-    return os.path.join(datadir, session['glacier1d'])
-
-def getlinepath(session):
-    if 'lines' not in session:
-        session['lines'] = 'lines.json'
-    if type(session['lines']) is list:
-        warnings.warn('lines is a list for some reason')
-        session['lines'] = 'lines.json'
-    return os.path.join(datadir, session['lines'])
+    return get_workspace(session).path('glacier1d.nc')
+
+def getlinestore(session):
+    return LineStore(get_workspace(session))
 
 def get_map_form(session):
     """ instantiate and define MapForm based on session parameters
@@ -133,22 +261,32 @@ def mapdata():
     session['glacier'] = form.glacier.data
     session['maxpixels'] = form.maxpixels.data
 
-    # update coordinates to get a fixed aspect ratio
-    r = 1
-    currentwidth = form.right.data - form.left.data
-    width = r*(form.top.data - form.bottom.data)
-    # form.right.data += (width-currentwidth)/2 
-    # form.left.data -= (width-currentwidth)/2 
-    form.right.data = form.left.data + width # maintain the left side...
-    session['coords'] = [form.left.data, form.right.data, form.bottom.data, form.top.data]
+    session['coords'] = map_coords(form.left.data, form.right.data, form.bottom.data, form.top.data)
 
     coords = session['coords'] # coordinates (can be custom)
     variable = session['variable'] # coordinates (can be custom)
     dataset = session['dataset'] # coordinates (can be custom)
 
-    maxshape = (session['maxpixels'],)*2
-    data = get_json_data(variable, dataset, coords, maxshape=maxshape)
-    return make_response(data) #, type='application/json')
+    maxpixels = session['maxpixels']
+    cost = admit(lambda maxbytes, maxwork: clamp_map(coords, dataset, maxpixels, maxbytes, maxwork))
+    maxshape = (cost.params['maxpixels'],)*2
+    with reserve(cost):
+        data = get_dict_data(variable, dataset, coords, maxshape=maxshape)
+    if cost.params['maxpixels'] != maxpixels:
+        session['maxpixels'] = data['clamped_maxpixels'] = cost.params['maxpixels']
+    return stream_jsonify(**data)
+
+def map_coords(left, right, bottom, top):
+    """ map window (left, right, bottom, top in km) with a fixed aspect ratio
+    """
+    # update coordinates to get a fixed aspect ratio
+    r = 1
+    currentwidth = right - left
+    width = r*(top - bottom)
+    # right += (width-currentwidth)/2 
+    # left -= (width-currentwidth)/2 
+    right = left + width # maintain the left side...
+    return [left, right, bottom, top]
 
 @app.route('/glacierinfo')
 def glacierinfo():
@@ -173,43 +311,90 @@ def flowline():
     #TODO: remove maxshape argument (related to shape of loaded data) and write 
     # a fortran routine !
     line = compute_one_flowline(form.x.data, form.y.data, dx=form.dx.data, maxdist=form.maxdist.data,
-                                dataset=form.dataset.data, maxshape=(500,500))
+                                dataset=form.dataset.data, maxshape=config.flowline_maxshape)
     return jsonify(line=line)
 
-@app.route('/lines', methods=['GET','POST']) 
+@app.route('/lines', methods=['GET','POST','PATCH']) 
 def lines():
+    """ GET the lines and their version, POST all lines, or PATCH them (see linestore.py)
+    """
+    store = getlinestore(session)
     if request.method == 'GET':
-        lines = _getlines(session)
-        return jsonify(lines=lines)
+        lines, version = store.load()
+        return jsonify(lines=lines, version=version)
+    elif request.method == 'PATCH':
+        return _patchlines(store, request.json)
     else:
-        lines = request.json
-        _setlines(session, lines)
-        return jsonify(lines=lines)
+        return _replacelines(store, request.json)
+
+@app.route('/lines/undo', methods=['POST'])
+def undo_lines():
+    lines, version = getlinestore(session).undo()
+    return jsonify(lines=lines, version=version)
+
+@app.route('/lines/redo', methods=['POST'])
+def redo_lines():
+    lines, version = getlinestore(session).redo()
+    return jsonify(lines=lines, version=version)
+
+@app.route('/lines/changes')
+def lines_changes():
+    """ operations applied to the lines since version `since` (null if too old: everything changed)
+    """
+    since = request.args.get('since', type=int)
+    if since is None:
+        abort(400, "since parameter required")
+    return jsonify(since=since, changes=getlinestore(session).changes(since))
+
+def _patchlines(store, patch, transform=None):
+    """ apply {'version':..., 'ops':[...]} to the lines, or return 409 if the version is outdated
+
+    transform : function applied to the points of each operation before applying it
+    """
+    if not isinstance(patch, dict) or not isinstance(patch.get('ops'), list):
+        abort(400, "expected {'version': ..., 'ops': [...]}")
+    ops = patch['ops']
+    try:
+        if transform is not None:
+            ops = [dict(op, points=transform(op['points'])) if isinstance(op, dict) and 'points' in op else op 
+                   for op in ops]
+        lines, version = store.patch(ops, version=patch.get('version'))
+    except VersionConflict as error:
+        lines, version = store.load()
+        return jsonify(error=str(error), version=version, lines=lines), 409
+    except (ValueError, TypeError, KeyError) as error:
+        abort(400, str(error))
+    return jsonify(version=version)
+
+def _replacelines(store, lines, transform=None):
+    """ replace all lines by [{'id':..., 'values':[...]}, ...], or return 400 if malformed
+
+    transform : function applied to the points of each line before replacing
+    """
+    if not isinstance(lines, list):
+        abort(400, "expected [{'id': ..., 'values': [...]}, ...]")
+    try:
+        if transform is not None:
+            lines = [dict(line, values=transform(line['values'])) for line in lines]
+        lines, version = store.replace(lines)
+    except (ValueError, TypeError, KeyError) as error:
+        abort(400, str(error))
+    return jsonify(lines=lines, version=version)
 
 def _getlines(session):
-    linepath = getlinepath(session)
-    if os.path.exists(linepath):
-        with open(linepath,'r') as f:
-            lines = json.load(f)
-    else:
-        lines = []
+    lines, version = getlinestore(session).load()
     return lines
 
-def _setlines(session, lines):
-    linepath = getlinepath(session)
-    with open(linepath,'w') as f:
-        lines = json.dump(lines, f)
-
-@app.route('/lineslonglat', methods=['GET','POST']) 
+@app.route('/lineslonglat', methods=['GET','POST','PATCH']) 
 def lineslonglat():
     import cartopy.crs as ccrs
     from models.greenmap import CRS
     longlat = ccrs.PlateCarree()
 
-    def transform_line(line, crs0, crs1):
-        " transform a line between two coordinate systems "
-        x, y = zip(*[(pt['x'], pt['y']) for pt in line['values']])
-        x, y = np.array(x), np.array(y)
+    def transform_points(points, crs0, crs1):
+        " transform points between two coordinate systems "
+        x, y = zip(*[(pt['x'], pt['y']) for pt in points]) if len(points) else ((), ())
+        x, y = np.array(x, dtype=float), np.array(y, dtype=float)
 
         if crs0 != longlat:
             x *= 1e3
@@ -220,29 +405,31 @@ def lineslonglat():
         if crs1 != longlat:
             pts_xyz /= 1e3
 
-        lon, lat = pts_xyz[...,0], pts_xyz[...,1]
-        newvalues = [{'x':lo, 'y':la} for lo, la in zip(lon, lat)]
         if np.any(~np.isfinite(pts_xyz)):
-            raise RuntimeError("nan or inf in points !")
-        return {'id':line['id'], 'values':newvalues}
+            raise ValueError("nan or inf in points !")
+        lon, lat = pts_xyz[...,0], pts_xyz[...,1]
+        return [{'x':lo, 'y':la} for lo, la in zip(lon, lat)]
+
+    def transform_line(line, crs0, crs1):
+        " transform a line between two coordinate systems "
+        return {'id':line['id'], 'values':transform_points(line['values'], crs0, crs1)}
+
+    store = getlinestore(session)
 
     if request.method == 'GET':
-        lines = _getlines(session)
+        lines, version = store.load()
 
         longlatlines = [transform_line(line, CRS, longlat) for line in lines]
         # lines = [transform_line(line, longlat, CRS) for line in longlatlines]
 
-        return jsonify(longlatlines=longlatlines)
-    else:
+        return jsonify(longlatlines=longlatlines, version=version)
+
+    elif request.method == 'PATCH':
+        # only the points of the patch are transformed
+        return _patchlines(store, request.json, transform=lambda points: transform_points(points, longlat, CRS))
 
-        print "received longlat", request.json
-        #lines = [transform_line(line, longlat, CRS) for line in request.json]
-        lines = [transform_line(line, longlat, CRS) for line in request.json]
-        print "transformed xy", lines
-        _setlines(session, lines)
-        # return jsonify(msg='all good')
-        return jsonify(lines=lines)
-        # return jsonify(lines=lines)
+    else:
+        return _replacelines(store, request.json, transform=lambda points: transform_points(points, longlat, CRS))
 
 @app.route('/mesh', methods=['GET', 'POST'])
 def mesh():
@@ -259,21 +446,32 @@ def mesh():
             flash("mesh file not found, create mesh via POST first (Save and Mesh button)")
             return jsonify(url=url_for('drawing'))
 
+        format, encoding = request_format()
+        if format == 'columnar':
+            # along-flow distance, and (nx, ny) arrays of node coordinates, in km
+            mesh = {
+                's': encode_array(ds.x*1e-3, encoding),
+                'x': encode_array(ds['x_coord'].values*1e-3, encoding),
+                'y': encode_array(ds['y_coord'].values*1e-3, encoding),
+            }
+            return stream_jsonify(mesh=mesh, format=format, encoding=encoding)
+
         mesh = [[{'x':x*1e-3, 'y':y*1e-3, 's':s*1e-3} for x, y in zip(xs_section, ys_section)] for xs_section, ys_section, s in zip(ds['x_coord'], ds['y_coord'], ds.x)]
 
         # return redirect(url_for('/viewmesh'))
-        return jsonify(mesh=mesh)
+        return stream_jsonify(mesh=mesh)
 
     else:
         # compute mesh and return the data extraction page
         lines = _getlines(session)
 
         meshform = MeshForm(request.form)
+        # validate the step bounds only: meshform.html has no csrf token
+        fields = [meshform.dxmin, meshform.dxmax]
+        if not all([field.validate(meshform) for field in fields]):
+            abort(400, "; ".join("{}: {}".format(field.label.text, error) for field in fields for error in field.errors))
         set_form(meshform, session) # make request persistent
 
-        dx = meshform.data['dx']
-        ny = meshform.data['ny']
-
         if len(lines) == 0:
             flash('no lines found !')
             return jsonify(url=url_for('drawing'))
@@ -287,21 +485,73 @@ def mesh():
             flash('Unxpected line ids. Expected: {}, got: {}'.format(['left','right','middle'],linedict.keys()))
             return jsonify(url=url_for('drawing'))
 
-        # make Lines objects
-        for nm in ['middle','left','right']:
-            linedict[nm] = Line([Point(pt['x']*1e3, pt['y']*1e3) for pt in linedict[nm]]) # make a Line object
-
         # # build fake mesh for testing
         # ny = 5 
         # nx = len(session['lines'][0])
         # mesh = [[{'x':pt['x']+20*j,'y':pt['y']+20*j} for j in range(ny)] for pt in session['lines'][0]['values']]
 
-        dima_mesh = make_2d_grid_from_contours(dx=dx, ny=ny, **linedict)
-        dima_mesh.write_nc(meshpath, 'w') # write mesh to disk
+        params = {k: meshform.data[k] for k in ['dx', 'ny', 'dxmin', 'dxmax', 'refine']}
+
+        # coarsen the mesh if over budget
+        length = line_length(linedict['middle'])*1e3
+        nside = len(linedict['left']) + len(linedict['right'])
+        cost = admit(lambda maxbytes, maxwork: clamp_mesh(length, params['dx'], params['ny'], 
+            params['dxmin'], params['dxmax'], params['refine'] in REFINE, nside, maxbytes, maxwork))
+        clamped = {k: v for k, v in cost.params.items() if v != params[k]}
+        if clamped:
+            params.update(clamped)
+            for k in clamped:
+                session['MeshForm_'+k] = clamped[k]
+            flash('mesh too large for the server, coarsened to: {}'.format(
+                ', '.join('{}={:g}'.format(k, clamped[k]) for k in sorted(clamped))))
+
+        if config.background_jobs:
+            return _submit('mesh', mesh_job, (linedict, params), inputs=(linedict, params))
+
+        with reserve(cost):
+            dima_mesh = _make_mesh(linedict, params)
+        workspace = get_workspace(session)
+        with workspace.lock(), workspace.atomic('mesh2d.nc') as tmp:
+            dima_mesh.write_nc(tmp, 'w') # write mesh to disk
 
         # return jsonify(url=url_for('viewmesh'))
         return redirect(url_for('mesh'))
 
+def _make_mesh(linedict, params, progress=None):
+    """ make the glacier mesh from middle, left and right line values (km) and MeshForm data
+    (kept in the persistent store, see models/store.py)
+    """
+    inputs = [linedict, params]
+    if params['refine'] in REFINE:
+        inputs.append(dataset_identity(REFINE[params['refine']][1])) # data of the step function
+    return stored('mesh', inputs, lambda : _compute_mesh(linedict, params, progress), 
+                  code=(make_2d_grid_from_contours, Line))
+
+def _compute_mesh(linedict, params, progress=None):
+    dx = params['dx']
+    ny = params['ny']
+    dxmin = params['dxmin']
+    dxmax = params['dxmax']
+
+    # make Lines objects
+    lines = {}
+    for nm in ['middle','left','right']:
+        lines[nm] = Line([Point(pt['x']*1e3, pt['y']*1e3) for pt in linedict[nm]]) # make a Line object
+
+    if params['refine'] in REFINE:
+        if progress: progress(0., 'refine step from '+params['refine'])
+        dx = refine_spacing(lines['middle'], params['refine'], dxmin, dxmax)
+
+    return make_2d_grid_from_contours(dx=dx, ny=ny, dxmin=dxmin, dxmax=dxmax, progress=progress, **lines)
+
+def mesh_job(progress, outdir, linedict, params):
+    """ background version of /mesh POST (see jobs.JobQueue.submit)
+    """
+    progress(0., 'build mesh')
+    path = os.path.join(outdir, 'mesh2d.nc')
+    _make_mesh(linedict, params, progress).write_nc(path, 'w')
+    return path
+
 @app.route('/viewmesh')
 def viewmesh():
     """ mesh / glacier view
@@ -322,23 +572,23 @@ def meshoutline():
     y_coord = da.read_nc(meshpath,'y_coord').values*1e-3
 
     ni, nj = x_coord.shape
-    left = []
-    middle = []
-    right = []
-    lines = [{'id':'middle', 'values':[]}, 
-             {'id':'left', 'values':[]}, 
-             {'id':'right', 'values':[]}]
-
-    for i in range(ni): # loop over sections
-        lines[0]['values'].append({'x':x_coord[i][int(nj/2)], 'y':y_coord[i][int(nj/2)]})
-        lines[1]['values'].append({'x':x_coord[i][0], 'y':y_coord[i][0]})
-        lines[2]['values'].append({'x':x_coord[i][-1], 'y':y_coord[i][-1]})
+    columns = [('middle', int(nj/2)), ('left', 0), ('right', -1)] # mesh column of each line
+
+    def points(j):
+        return [{'x':x, 'y':y} for x, y in zip(x_coord[:,j].tolist(), y_coord[:,j].tolist())]
 
     # if POST, make it the default line
     if request.method == 'POST':
-        _setlines(session, lines)
+        getlinestore(session).replace([{'id':id, 'values':points(j)} for id, j in columns])
 
-    return jsonify(lines=lines)
+    format, encoding = request_format()
+    if format == 'columnar':
+        lines = [{'id':id, 'x':encode_array(x_coord[:,j], encoding), 'y':encode_array(y_coord[:,j], encoding)} 
+                 for id, j in columns]
+        return stream_jsonify(lines=lines, format=format, encoding=encoding)
+
+    lines = [{'id':id, 'values':points(j)} for id, j in columns]
+    return stream_jsonify(lines=lines)
 
 
 # @app.route('/data1d/<name:variable>/<name:dataset>', methods=['GET'])
@@ -351,24 +601,83 @@ def make_glacier1d():
     """ extract data 
     """
     meshpath = getmeshpath(session)
-    glacierpath = getglacierpath(session)
 
     if request.method == 'POST':
     # if request.method == 'GET':
         extractform = ExtractForm(request.form)
         # extractform = ExtractForm()
+        data = {k: v for k, v in extractform.data.items() if k != 'csrf_token'}
+
+        if config.background_jobs:
+            # the mesh may change before the job runs: give the job its own copy
+            prepare = lambda outdir: shutil.copyfile(meshpath, os.path.join(outdir, 'mesh2d.nc'))
+            return _submit('glacier1d', glacier1d_job, (data,), inputs=(file_hash(meshpath), data), prepare=prepare)
+
         mesh = da.read_nc(meshpath)
-        glacier1d = extractglacier1d(mesh, extractform.data)
+        glacier1d = extractglacier1d(mesh, data, artifacts=get_artifacts(), 
+                                     tilesize=config.extract_tilesize)
         # quick fix SMB shifted upward
         # glacier1d['smb'].values += (0.2/(3600*24*365.25))
         # glacier1d['smb'].note = "increased by 0.2 m/year, uniformly"
-        glacier1d.write_nc(glacierpath, 'w')
+        workspace = get_workspace(session)
+        with workspace.lock(), workspace.atomic('glacier1d.nc') as tmp:
+            glacier1d.write_nc(tmp, 'w')
 
         return redirect(url_for('vizualize_glacier1d'))  # get method
 
     elif request.method == 'GET':
         raise ValueError("no GET route for /glacier1d, try /figure/glacier1d")
 
+def glacier1d_job(progress, outdir, data):
+    """ background version of /glacier1d POST, on the mesh copied into outdir
+    """
+    progress(0., 'extract glacier1d')
+    mesh = da.read_nc(os.path.join(outdir, 'mesh2d.nc'))
+    glacier1d = extractglacier1d(mesh, data, artifacts=get_artifacts(), 
+                                 tilesize=config.extract_tilesize, progress=progress)
+    path = os.path.join(outdir, 'glacier1d.nc')
+    glacier1d.write_nc(path, 'w')
+    return path
+
+#
+# Background jobs (if config.background_jobs)
+#
+# where to get the result of each kind of job, once installed in the session workspace
+_JOB_VIEWS = {'mesh': 'mesh', 'glacier1d': 'vizualize_glacier1d'}
+
+def _submit(kind, func, args, inputs, prepare=None):
+    """ submit a job and return its id, with status code 202 (accepted)
+    """
+    id = get_queue().submit(kind, func, args, key=input_key(kind, *inputs), prepare=prepare)
+    return jsonify(job=id, status_url=url_for('job_status', id=id)), 202
+
+@app.route('/jobs/<id>')
+def job_status(id):
+    """ status and progress of a background job
+    """
+    job = get_queue().status(id)
+    if job is None:
+        abort(404)
+    del job['result'] # path on the server
+    if job['status'] == DONE:
+        job['result_url'] = url_for('job_result', id=id)
+    return jsonify(**job)
+
+@app.route('/jobs/<id>/result')
+def job_result(id):
+    """ install the result of a finished job in the session workspace, and show it
+    """
+    job = get_queue().status(id)
+    if job is None:
+        abort(404)
+    if job['status'] != DONE:
+        return jsonify(job=id, status=job['status'], error=job['error']), 409
+    workspace = get_workspace(session)
+    result = job['result']
+    with workspace.lock(), workspace.atomic(os.path.basename(result)) as tmp:
+        shutil.copyfile(result, tmp)
+    return redirect(url_for(_JOB_VIEWS[job['kind']]))
+
 @app.route("/figure/glacier1d")
 def vizualize_glacier1d():
     """ return data to make a figure
@@ -448,6 +757,13 @@ def vizualize_glacier1d():
     for k in glacier1d:
         glacier1d[k][np.isnan(glacier1d[k])] = missing_values
 
+    format, encoding = request_format()
+    if format == 'columnar':
+        # shared x, and one array of values per variable
+        sources = {nm: encode_array(glacier1d[nm].values, encoding) for nm in names}
+        return stream_jsonify(views=views, x=encode_array(glacier1d.x, encoding), sources=sources, 
+                       missing_values=missing_values, format=format, encoding=encoding, width=350, height=120)
+
     # for simplicity, organize each line a list of poitns with x, y property
     sources = {}
     for nm in names:
@@ -459,7 +775,7 @@ def vizualize_glacier1d():
     # not used for now
     units = {k:glacier1d[k].units.strip()  if hasattr(glacier1d[k], 'units') else '' for k in names}
 
-    return jsonify(views=views, sources=sources, width=350, height=120)
+    return stream_jsonify(views=views, sources=sources, width=350, height=120)
 
 @app.route('/download/glacier1d.nc')
 def download():
@@ -0,0 +1,191 @@
+""" Per-session workspaces, so that several users and worker processes do not share files
+
+Each session gets its own directory under config.workspacedir, named after a
+random id stored in the session cookie. Files are replaced atomically (written
+to a temporary file, then renamed), so that readers never see partial files,
+and read-modify-write sequences are serialized with a per-workspace file lock,
+which also works across worker processes. Workspaces which have not been used
+for a while, or the least recently used ones beyond a disk quota, are removed
+by collect_garbage.
+"""
+import os
+import re
+import time
+import uuid
+import shutil
+import errno
+import warnings
+from contextlib import contextmanager
+
+import config
+from models.helper import flock, makedirs
+
+LOCKFILE = '.lock'
+_VALID_ID = re.compile(r'^[0-9a-f]{32}$')
+
+class Workspace(object):
+    """ Directory holding the files of one session
+
+    Parameters
+    ----------
+    root : directory containing all workspaces
+    id : workspace id (32 hexadecimal characters)
+    """
+    def __init__(self, root, id):
+        if not _VALID_ID.match(id):
+            raise ValueError("invalid workspace id: "+repr(id))
+        self.root = root
+        self.id = id
+        self.directory = os.path.join(root, id)
+        makedirs(self.directory)
+
+    def path(self, filename):
+        """ path of a file in the workspace
+        """
+        return os.path.join(self.directory, filename)
+
+    def touch(self):
+        """ mark the workspace as recently used (see collect_garbage)
+        """
+        os.utime(self.directory, None)
+
+    @contextmanager
+    def lock(self, shared=False):
+        """ hold the workspace lock (exclusive by default), across processes
+        """
+        with flock(os.path.join(self.directory, LOCKFILE), shared=shared):
+            yield
+
+    @contextmanager
+    def atomic(self, filename):
+        """ yield a temporary path to write to, which replaces filename on success
+
+        Examples
+        --------
+        >>> with workspace.atomic('mesh2d.nc') as tmp: # doctest: +SKIP
+        ...     mesh.write_nc(tmp, 'w')
+        """
+        path = self.path(filename)
+        tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex[:8])
+        try:
+            yield tmp
+            os.rename(tmp, path) # atomic on POSIX
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+def get_workspace(session, root=None):
+    """ workspace of a flask session, created on first use
+
+    Parameters
+    ----------
+    session : flask session (a new workspace id is stored into it if needed)
+    root : directory containing all workspaces, by default config.workspacedir
+
+    Returns
+    -------
+    Workspace instance
+    """
+    if root is None:
+        root = config.workspacedir
+    id = session.get('workspace')
+    if not id or not _VALID_ID.match(id):
+        id = uuid.uuid4().hex
+        session['workspace'] = id
+    workspace = Workspace(root, id)
+    workspace.touch()
+    return workspace
+
+def collect_garbage(root=None, ttl=None, quota=None, keep=()):
+    """ Remove stale workspaces
+
+    Workspaces unused for more than ttl seconds are removed, then the least
+    recently used ones until the total size is below quota. Workspaces
+    locked by a request in progress are left alone.
+
+    Parameters
+    ----------
+    root : directory containing all workspaces, by default config.workspacedir
+    ttl : time-to-live (s) after last use, by default config.workspace_ttl
+    quota : max total size (bytes), by default config.workspace_quota
+    keep : workspace ids not to remove (e.g. the current one)
+
+    Returns
+    -------
+    removed : list of removed workspace ids
+    """
+    if root is None: root = config.workspacedir
+    if ttl is None: ttl = config.workspace_ttl
+    if quota is None: quota = config.workspace_quota
+    if not os.path.isdir(root):
+        return []
+
+    workspaces = []
+    for id in os.listdir(root):
+        directory = os.path.join(root, id)
+        if not _VALID_ID.match(id) or not os.path.isdir(directory):
+            continue
+        try:
+            workspaces.append((os.path.getmtime(directory), _du(directory), id))
+        except OSError:
+            continue # removed meanwhile
+    workspaces.sort() # least recently used first
+
+    now = time.time()
+    total = sum(size for _, size, _ in workspaces)
+    removed = []
+    for mtime, size, id in workspaces:
+        if now - mtime < ttl and total <= quota:
+            break
+        if id in keep:
+            continue
+        if _remove(os.path.join(root, id)):
+            removed.append(id)
+            total -= size
+    return removed
+
+def maybe_collect_garbage(root=None, interval=None, **kwargs):
+    """ collect_garbage, at most once per interval (s) across all worker processes
+    """
+    if root is None: root = config.workspacedir
+    if interval is None: interval = config.workspace_gc_interval
+    makedirs(root)
+    stamp = os.path.join(root, '.gc')
+    if os.path.exists(stamp) and time.time() - os.path.getmtime(stamp) < interval:
+        return []
+    try:
+        with flock(stamp, blocking=False):
+            os.utime(stamp, None)
+            return collect_garbage(root, **kwargs)
+    except IOError as error:
+        if error.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return [] # another process is collecting
+
+def _remove(directory):
+    """ remove a workspace directory unless it is locked
+    """
+    try:
+        with flock(os.path.join(directory, LOCKFILE), blocking=False):
+            # move out of the way first, so the removal looks atomic to other processes
+            trash = directory + '.trash'
+            os.rename(directory, trash)
+    except (IOError, OSError) as error:
+        if error.errno not in (errno.EAGAIN, errno.EACCES, errno.ENOENT):
+            warnings.warn("failed to remove workspace {}: {}".format(directory, error))
+        return False
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+def _du(directory):
+    """ total size (bytes) of files in a directory
+    """
+    size = 0
+    for dirpath, _, filenames in os.walk(directory):
+        for fname in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, fname))
+            except OSError:
+                pass
+    return size
+
@@ -0,0 +1,65 @@
+""" Edge cases of the admission control (outletglacierapp/models/budget.py)
+
+Run from the repository root, on the synthetic dataset of loadtest.py:
+
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import loadtest
+loadtest.install_synthetic_icedata(tempfile.mkdtemp(prefix='test-budget-'))
+
+from outletglacierapp import app, views
+from outletglacierapp.models.budget import clamp_map, clamp_mesh, mesh_cost, MemoryGuard, OverWatermark
+
+COORDS = (-600., 800., -3400., -600.) # km, whole Greenland
+
+@pytest.mark.parametrize('maxbytes', [0, -1000])
+def test_clamp_mesh_nonpositive_budget(maxbytes):
+    with pytest.raises(ValueError):
+        clamp_mesh(50e3, 1000., 10, maxbytes=maxbytes, maxwork=5e6)
+
+@pytest.mark.parametrize('maxbytes', [0, -1000])
+def test_clamp_map_nonpositive_budget(maxbytes):
+    with pytest.raises(ValueError):
+        clamp_map(COORDS, 'bamber2013', 400, maxbytes=maxbytes, maxwork=5e6)
+
+def test_clamp_mesh_fits():
+    cost = clamp_mesh(100e3, 1., 10, maxbytes=512*1024**2, maxwork=5e6, nside=200)
+    assert cost.fits(512*1024**2, 5e6)
+    assert cost.params['dx'] > 1.
+
+def test_clamp_mesh_too_small_budget_stops():
+    # a 2 x 2 mesh does not fit 1 byte: return it rather than loop
+    cost = clamp_mesh(50e3, 1000., 10, maxbytes=1, maxwork=5e6)
+    assert not cost.fits(1, 5e6)
+    assert cost.params['ny'] == 2
+
+def test_clamp_map_fits():
+    cost = clamp_map(COORDS, 'morlighem2014', 5000, maxbytes=64*1024**2, maxwork=5e6)
+    assert cost.fits(64*1024**2, 5e6)
+    assert 10 <= cost.params['maxpixels'] < 5000
+
+@pytest.mark.parametrize('dxmin, dxmax', [(0., 10e3), (-1., 10e3), (20e3, 10e3)])
+def test_mesh_cost_invalid_refine_bounds(dxmin, dxmax):
+    with pytest.raises(ValueError):
+        mesh_cost(50e3, 1000., 10, dxmin=dxmin, dxmax=dxmax, refine=True)
+
+def test_admit_over_watermark(monkeypatch):
+    monkeypatch.setattr(views.config, 'budget_policy', 'clamp')
+    monkeypatch.setattr(views, '_memory', MemoryGuard(watermark=1)) # below any resident size
+    with app.test_request_context():
+        with pytest.raises(OverWatermark):
+            views.admit(lambda maxbytes, maxwork: clamp_mesh(50e3, 1000., 10, maxbytes=maxbytes, maxwork=maxwork))
+
+def test_memory_guard_release():
+    guard = MemoryGuard(watermark=None)
+    with guard.reserve(1000):
+        assert guard.reserved == 1000
+    assert guard.reserved == 0
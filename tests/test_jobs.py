@@ -0,0 +1,58 @@
+""" Timeout of background jobs (outletglacierapp/jobs.py)
+
+Run from the repository root, on the synthetic dataset of loadtest.py:
+
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import loadtest
+loadtest.install_synthetic_icedata(tempfile.mkdtemp(prefix='test-jobs-'))
+
+from outletglacierapp import jobs
+
+def _insert(queue, status, age, key='key'):
+    """ job row last updated age seconds ago
+    """
+    conn = jobs._connect(queue.dbpath)
+    try:
+        id = jobs.uuid.uuid4().hex
+        updated = time.time() - age
+        conn.execute("INSERT INTO jobs (id, kind, key, status, progress, message, created, updated) VALUES (?,?,?,?,?,?,?,?)",
+                     (id, 'mesh', key, status, 0., '', updated, updated))
+    finally:
+        conn.close()
+    return id
+
+def test_queued_job_does_not_time_out(tmpdir):
+    queue = jobs.JobQueue(str(tmpdir), timeout=10)
+    id = _insert(queue, jobs.QUEUED, age=100)
+    assert queue.status(id)['status'] == jobs.QUEUED
+    assert queue.submit('mesh', None, (), key='key') == id # coalesced
+
+def test_running_job_without_heartbeat_fails(tmpdir):
+    queue = jobs.JobQueue(str(tmpdir), timeout=10)
+    stale = _insert(queue, jobs.RUNNING, age=100, key='stale')
+    alive = _insert(queue, jobs.RUNNING, age=1, key='alive')
+    assert queue.status(stale)['status'] == jobs.FAILED
+    assert queue.status(alive)['status'] == jobs.RUNNING
+    assert queue.submit('mesh', None, (), key='alive') == alive
+
+def test_progress_is_a_heartbeat(tmpdir):
+    queue = jobs.JobQueue(str(tmpdir), timeout=10)
+    id = _insert(queue, jobs.QUEUED, age=100)
+    seen = []
+
+    def job(progress, outdir):
+        progress(0.5, 'half way')
+        seen.append(queue.status(id))
+        return 'result'
+    jobs._run(queue.dbpath, id, os.path.join(str(tmpdir), id), job, ())
+    assert seen[0]['status'] == jobs.RUNNING
+    assert seen[0]['message'] == 'half way'
+    assert queue.status(id)['status'] == jobs.DONE
@@ -0,0 +1,85 @@
+""" Shared raster cache (outletglacierapp/models/rastercache.py): entries follow the source data
+
+Run from the repository root, on the synthetic dataset of loadtest.py:
+
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import loadtest
+loadtest.install_synthetic_icedata(tempfile.mkdtemp(prefix='test-rastercache-'))
+
+import dimarray as da
+from outletglacierapp.models import rastercache, store, greenmap, flowline
+
+COORDS = (-300., -100., -2200., -2000.) # km
+
+@pytest.fixture
+def cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(rastercache, '_cache', rastercache.RasterCache(str(tmpdir.join('cache'))))
+    monkeypatch.setattr(store, '_store', None) # the shared cache alone
+    return rastercache.get_cache()
+
+def _raster(value):
+    x, y = np.arange(3.), np.arange(2.)
+    return da.DimArray(np.zeros((2, 3)) + value, axes=[y, x], dims=['y', 'x'])
+
+def _touch_later(path):
+    mtime = os.path.getmtime(path) + 100
+    os.utime(path, (mtime, mtime))
+
+def test_mapdata_reloaded_after_source_change(cache, monkeypatch):
+    calls = []
+    def load(coords, variable, dataset, maxshape=None):
+        calls.append(dataset)
+        return _raster(len(calls))
+    monkeypatch.setattr(greenmap, '_load_data', load)
+
+    def window():
+        greenmap._load_map_window.cache_clear() # only the shared cache
+        return greenmap._load_map_window('smb', 'standard_dataset', COORDS, (10, 10))
+
+    assert window().values[0, 0] == 1
+    assert window().values[0, 0] == 1 # from the cache
+    assert len(calls) == 1
+
+    _touch_later(greenmap.icedata.greenland.presentday.get_file())
+    assert window().values[0, 0] == 2
+    assert len(calls) == 2
+
+def test_velocity_reloaded_after_source_change(cache, monkeypatch, tmpdir):
+    ncfile = tmpdir.join('velocity.nc')
+    ncfile.write('')
+    monkeypatch.setattr(greenmap.icedata.greenland.rignot_mouginot2012, 'NCFILE', str(ncfile), raising=False)
+
+    calls = []
+    def load(dataset, maxshape=None):
+        calls.append(dataset)
+        vel = da.Dataset()
+        vel['vx'] = _raster(len(calls))
+        vel['vy'] = _raster(0.)
+        return vel
+    monkeypatch.setattr(flowline, 'load_velocity', load)
+
+    def velocity():
+        flowline.get_velocity_functions.cache_clear() # only the shared cache
+        x, y, fx, fy = flowline.get_velocity_functions('rignot_mouginot2012')
+        return len(calls)
+
+    assert velocity() == 1
+    assert velocity() == 1 # from the cache
+    _touch_later(str(ncfile))
+    assert velocity() == 2
+
+def test_hit_does_not_lock_index(cache, monkeypatch):
+    cache.put('key', {'a': np.zeros((2, 2))})
+    monkeypatch.setattr(cache, '_index', None) # any use of the index lock fails
+    arrays, meta = cache.get('key')
+    assert arrays['a'].shape == (2, 2)
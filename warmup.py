@@ -0,0 +1,190 @@
+#!/usr/bin/python
+""" Warm-up: precompute what the first users would otherwise wait for
+
+After a deployment (or a change in the data), the first users pay for loading
+the velocity fields of flowlines, the Greenland-wide overviews and the map
+window of each preset glacier. This script computes them ahead of serving, into
+the persistent store and the shared raster cache configured in
+outletglacierapp/config.py (see models/store.py and models/rastercache.py):
+
+- the glacier region registry, with the box of every glacier (/glacierinfo)
+- velocity fields for each velocity dataset (/flowline)
+- map windows for every glacier and dataset, at the default number of pixels,
+  as requested when a glacier is selected (/mapdata)
+
+Tasks run in parallel (processes). Completed tasks are recorded in a state
+file, so that an interrupted warm-up resumes where it stopped (all tasks are
+run again if the data files changed).
+
+Examples
+--------
+    python warmup.py
+    python warmup.py --processes 8 --only mapdata --glaciers Greenland "Jakobshavn Isbrae"
+    python warmup.py --list
+"""
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+
+KINDS = ['region', 'velocity', 'mapdata']
+
+def make_tasks(config, kinds=KINDS, glaciers=None, datasets=None, maxpixels=None):
+    """ list of tasks (kind, args), in the order they should run
+    """
+    if glaciers is None:
+        glaciers = [nm for nm in config.glacier_choices if nm.lower() != 'custom']
+    if datasets is None:
+        datasets = config.dataset_choices
+    if maxpixels is None:
+        maxpixels = config.maxpixels
+
+    tasks = []
+    if 'region' in kinds:
+        tasks.extend(('region', (nm,)) for nm in glaciers)
+    if 'velocity' in kinds:
+        tasks.extend(('velocity', (ds,)) for ds in config.sources_choices['velocity_mag'])
+    if 'mapdata' in kinds:
+        # Greenland-wide overviews first: the most requested
+        glaciers = sorted(glaciers, key=lambda nm: nm.lower() != 'greenland')
+        tasks.extend(('mapdata', (nm, ds, maxpixels)) for nm in glaciers for ds in datasets)
+    return tasks
+
+def task_id(task):
+    kind, args = task
+    return ':'.join([kind] + [str(a) for a in args])
+
+def run_task(task):
+    """ run one task (in a worker process), return its id, duration and error if any
+    """
+    from outletglacierapp import config
+    from outletglacierapp.views import map_coords
+    from outletglacierapp.models.greenmap import get_coords, get_dict_data
+    from outletglacierapp.models.flowline import get_velocity_functions
+
+    kind, args = task
+    start = time.time()
+    try:
+        if kind == 'region':
+            get_coords(*args)
+
+        elif kind == 'velocity':
+            get_velocity_functions(args[0], maxshape=config.flowline_maxshape)
+
+        elif kind == 'mapdata':
+            # same window as /mapdata for the glacier's default coordinates
+            glacier, choice, maxpixels = args
+            variable, dataset = [s.strip() for s in choice.split('-')]
+            coords = map_coords(*get_coords(glacier))
+            get_dict_data(variable, dataset, coords, maxshape=(maxpixels,)*2)
+
+        else:
+            raise ValueError("unknown task: "+repr(kind))
+    except Exception:
+        return task_id(task), time.time() - start, traceback.format_exc()
+    return task_id(task), time.time() - start, None
+
+def data_identity(config):
+    """ identity of the source files: completed tasks are redone if it changes
+    """
+    from outletglacierapp.models.greenmap import dataset_identity
+    from outletglacierapp.models.outlet_glacier_region import regions_identity
+    return [regions_identity()] + [dataset_identity(ds) for ds in sorted(config.sources)]
+
+class State(object):
+    """ ids of completed tasks, saved to a file after each of them
+
+    Parameters
+    ----------
+    path : state file
+    identity : identity of the data (json-compatible), the state is reset if it changed
+    """
+    def __init__(self, path, identity=None):
+        self.path = path
+        self.identity = json.loads(json.dumps(identity))
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('identity') == self.identity:
+                self.done = saved['done']
+
+    def add(self, id, elapsed):
+        self.done[id] = {'elapsed': elapsed, 'time': time.time()}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'identity': self.identity, 'done': self.done}, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="number of worker processes (default: %(default)s)")
+    parser.add_argument("--only", nargs='+', choices=KINDS, default=KINDS, help="kinds of tasks to run (default: all)")
+    parser.add_argument("--glaciers", nargs='+', help="glaciers to warm up (default: all in config.glacier_choices)")
+    parser.add_argument("--datasets", nargs='+', help="map datasets, as 'variable - source' (default: all in config.dataset_choices)")
+    parser.add_argument("--maxpixels", type=int, help="map size (default: config.maxpixels)")
+    parser.add_argument("--state", help="state file of completed tasks (default: warmup.json in the store directory)")
+    parser.add_argument("--force", action="store_true", help="run all tasks, including those already completed")
+    parser.add_argument("--list", action="store_true", help="only list the tasks, and whether they are completed")
+    arg = parser.parse_args()
+
+    from outletglacierapp import config # also configures the store and raster cache (see views)
+
+    tasks = make_tasks(config, arg.only, arg.glaciers, arg.datasets, arg.maxpixels)
+
+    statepath = arg.state
+    if statepath is None:
+        if config.storedir is None:
+            parser.error("the persistent store is disabled (config.storedir): nothing would be kept")
+        if not os.path.exists(config.storedir):
+            os.makedirs(config.storedir)
+        statepath = os.path.join(config.storedir, 'warmup.json')
+    state = State(statepath, data_identity(config))
+    if arg.force:
+        state.done = {}
+
+    todo = [task for task in tasks if task_id(task) not in state.done]
+
+    if arg.list:
+        for task in tasks:
+            print("done" if task_id(task) in state.done else "todo", task_id(task))
+        return
+
+    print("{} tasks, {} already completed, {} to run with {} processes".format(
+        len(tasks), len(tasks) - len(todo), len(todo), arg.processes))
+
+    # region boxes first (quick, and needed by map windows), then the rest in parallel
+    first = [task for task in todo if task[0] == 'region']
+    rest = [task for task in todo if task[0] != 'region']
+
+    failed = []
+    start = time.time()
+    pool = multiprocessing.Pool(arg.processes) if arg.processes > 1 else None
+    try:
+        for batch in [first, rest]:
+            results = pool.imap_unordered(run_task, batch) if pool is not None else map(run_task, batch)
+            for id, elapsed, error in results:
+                if error is None:
+                    state.add(id, elapsed)
+                    print("{:7.1f} s  {}".format(elapsed, id))
+                else:
+                    failed.append((id, error))
+                    print("{:7.1f} s  {}  FAILED: {}".format(elapsed, id, error.strip().splitlines()[-1]))
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    print("completed {} tasks in {:.1f} s, {} failed".format(len(todo) - len(failed), time.time() - start, len(failed)))
+    if failed:
+        print("\nfirst error ({}):\n{}".format(*failed[0]))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()